@@ -1,35 +1,109 @@
+import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from config import Config
+from app.database import apply_database_profile, install_connect_hooks, RoutingSession, init_replica_routing
+from app.instrumentation import init_instrumentation
 
-app = Flask(__name__)
-app.config.from_object(Config)
-db = SQLAlchemy(app)
-login_manager = LoginManager(app)
+db = SQLAlchemy(session_options={'class_': RoutingSession}) # Reads in @replica_reads views may go to a replica
+login_manager = LoginManager()
 login_manager.login_view = 'login' # The route to redirect to for login_required
 login_manager.login_message_category = 'info'
 
-# Import and register Blueprints
-from app.chatbot import chatbot_bp
-app.register_blueprint(chatbot_bp, url_prefix='/chatbot')
+# Page templates and static files live at the repository root, next to the app package
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
-from app import routes, models # routes needs to be imported before context processor usually
+class DeferredApp:
+    """
+    Stands in for the Flask app in app/routes.py: routes and hooks declared there at import time are
+    recorded and added to every app create_app() builds. Unlike a Blueprint, endpoint names keep no
+    prefix, so url_for('index') and friends are unchanged.
+    """
+
+    def __init__(self):
+        self._deferred = []
+
+    def route(self, rule, **options):
+        def decorator(view):
+            self._deferred.append(lambda app: app.add_url_rule(rule, view_func=view, **options))
+            return view
+        return decorator
+
+    def before_request(self, func):
+        self._deferred.append(lambda app: app.before_request(func))
+        return func
+
+    def init_app(self, app):
+        for setup in self._deferred:
+            setup(app)
+
+
+def create_app(config_class=Config):
+    app = Flask(__name__, template_folder=os.path.join(PROJECT_ROOT, 'templates'),
+                static_folder=os.path.join(PROJECT_ROOT, 'static'))
+    app.config.from_object(config_class)
+    apply_database_profile(app) # Validates DATABASE_PROFILE and sets SQLALCHEMY_ENGINE_OPTIONS before the engine exists
+    db.init_app(app)
+    install_connect_hooks(app, db)
+    init_replica_routing(app)
+    init_instrumentation(app) # Per-request query counts/timings, slow-query log, /admin/perf data
+    login_manager.init_app(app)
+
+    from app import routes, models # routes needs to be imported before context processor usually
+    routes.main.init_app(app)
+
+    # Import and register Blueprints. Optional subsystems are only imported when enabled.
+    if app.config.get('CHATBOT_ENABLED', True):
+        from app.chatbot import chatbot_bp
+        app.register_blueprint(chatbot_bp, url_prefix='/chatbot')
+    from app.exports import exports_bp
+    app.register_blueprint(exports_bp, url_prefix='/export')
+    from app.bookings import bookings_bp
+    app.register_blueprint(bookings_bp, url_prefix='/resources')
+    from app.availability import availability_bp
+    app.register_blueprint(availability_bp, url_prefix='/availability')
+    from app.rfid import rfid_bp, init_rfid
+    app.register_blueprint(rfid_bp, url_prefix='/rfid')
+    init_rfid(app) # Preloads the card/reader directory when scan ingestion is enabled
+    from app.security_dashboard import security_bp
+    app.register_blueprint(security_bp, url_prefix='/security')
+    from app.library import library_bp
+    app.register_blueprint(library_bp, url_prefix='/library')
+    from app.metrics import metrics_bp, init_metrics
+    app.register_blueprint(metrics_bp)
+    init_metrics(app) # Request latency/query histograms, served at /metrics
+
+    from app.timetable import timetable_clashes_command
+    app.cli.add_command(timetable_clashes_command)
+    from app.partitioning import logs_maintain_command
+    app.cli.add_command(logs_maintain_command)
+    from app.security_dashboard import security_rollups_rebuild_command
+    app.cli.add_command(security_rollups_rebuild_command)
+    from app.library import library_overdue_command
+    app.cli.add_command(library_overdue_command)
+
+    app.context_processor(inject_utilities)
+    return app
+
 
 # Context processors make functions available in all templates
-@app.context_processor
 def inject_utilities():
-    from app.utils import (get_target_score, get_colleges_for_navbar, 
+    from app.utils import (get_target_score, get_colleges_for_navbar, get_college_post_counts,
                            get_pending_reports_count, get_unread_notifications_count) # Added
-    from app.models import Post, Comment, Course, StudyGroup, Event, ReportStatus
-    from app.forms import SearchForm 
+    from app.models import User, Post, Comment, Course, StudyGroup, Event, ReportStatus
+    from app.forms import SearchForm
+    from flask_wtf.csrf import generate_csrf
     return dict(
+        csrf_token=generate_csrf, # Used by hand-written forms; CSRFProtect isn't installed, so nothing else provides it
         get_target_score=get_target_score,
         get_colleges_for_navbar=get_colleges_for_navbar,
+        get_college_post_counts=get_college_post_counts,
         get_pending_reports_count=get_pending_reports_count,
         get_unread_notifications_count=get_unread_notifications_count, # Added
-        search_form=SearchForm(), 
+        search_form=SearchForm(),
+        User=User,
         Post=Post,
         Comment=Comment,
         Course=Course,
@@ -37,6 +111,3 @@ def inject_utilities():
         Event=Event,
         ReportStatus=ReportStatus
     )
-
-# Import models after db initialization and potential context processors
-# from app import models # already imported above
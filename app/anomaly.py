@@ -0,0 +1,132 @@
+"""
+Streaming anomaly detection over RFID scans.
+
+ingest_scans() (app/rfid.py) feeds every scan at a known reader through this process's
+AnomalyDetector, oldest first, once the batch's AccessLog rows are committed, and opens a
+SecurityIncident for each anomaly in a transaction of its own. The detector keeps only sliding-window state in memory and never
+queries history, so it costs a few dict and deque operations per scan:
+
+* denial_burst: ANOMALY_DENIAL_THRESHOLD denied scans at one reader within ANOMALY_DENIAL_WINDOW_SECONDS
+  (per-reader deque of denial times). A burst is reported once per window.
+* impossible_travel: a card seen at two readers farther apart than ANOMALY_MIN_DISTANCE_METERS, faster
+  than ANOMALY_MAX_SPEED_MPS would allow (last scan per card). Needs reader coordinates on AccessPoint.
+* tailgating: a card granted twice at the same reader within ANOMALY_PASSBACK_SECONDS, i.e. passed back
+  to let someone else through (last grant per card). Readers have no door sensors, so passback is the
+  tailgating pattern scans alone can show.
+
+State is per process and assumes scans arrive roughly in time order, so all readers of a site
+should post to the same ingestion worker. It starts empty on restart; a burst or passback spanning
+the restart is missed.
+"""
+import math
+import threading
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+from flask import current_app
+from app.models import SecurityIncident
+
+Anomaly = namedtuple('Anomaly', 'kind severity detected_at access_point_id location card_uid description')
+
+SEVERITIES = {'denial_burst': 'medium', 'impossible_travel': 'high', 'tailgating': 'medium'}
+
+EARTH_RADIUS_METERS = 6371000
+
+
+def distance_meters(first, second):
+    """Great-circle distance between two readers; None when either has no coordinates."""
+    if None in (first.latitude, first.longitude, second.latitude, second.longitude):
+        return None
+    lat1, lat2 = math.radians(first.latitude), math.radians(second.latitude)
+    dlat, dlon = lat2 - lat1, math.radians(second.longitude - first.longitude)
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(a))
+
+
+def _location(reader):
+    return reader.name or f'Access point {reader.id}'
+
+
+class AnomalyDetector:
+    def __init__(self, denial_window: int = 60, denial_threshold: int = 5, max_speed: float = 7.0,
+                 min_distance: float = 100.0, passback_window: int = 30):
+        self.denial_window = timedelta(seconds=denial_window)
+        self.denial_threshold = denial_threshold
+        self.max_speed = max_speed
+        self.min_distance = min_distance
+        self.passback_window = timedelta(seconds=passback_window)
+        self._lock = threading.Lock()
+        self.clear()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('ANOMALY_DENIAL_WINDOW_SECONDS', 60), config.get('ANOMALY_DENIAL_THRESHOLD', 5),
+                   config.get('ANOMALY_MAX_SPEED_MPS', 7.0), config.get('ANOMALY_MIN_DISTANCE_METERS', 100.0),
+                   config.get('ANOMALY_PASSBACK_SECONDS', 30))
+
+    def clear(self) -> None:
+        self._denials = {} # Access point id -> deque of denial times inside the window
+        self._quiet_until = {} # Access point id -> no new burst is reported before this time
+        self._last_seen = {} # card_uid -> (time, ReaderState) of its latest scan
+        self._last_grant = {} # card_uid -> (time, access point id) of its latest granted scan
+
+    def observe(self, scanned_at: datetime, reader, card_uid: str, granted: bool) -> list:
+        """Anomalies completed by one scan at `reader` (a ReaderState). card_uid is None for unknown cards."""
+        found = []
+        if not granted:
+            denials = self._denials.setdefault(reader.id, deque())
+            denials.append(scanned_at)
+            while denials[0] <= scanned_at - self.denial_window:
+                denials.popleft()
+            if len(denials) >= self.denial_threshold and scanned_at >= self._quiet_until.get(reader.id, datetime.min):
+                self._quiet_until[reader.id] = scanned_at + self.denial_window
+                found.append(Anomaly('denial_burst', SEVERITIES['denial_burst'], scanned_at, reader.id, _location(reader), None,
+                                     f'{len(denials)} denied scans at {_location(reader)} within '
+                                     f'{int(self.denial_window.total_seconds())}s'))
+        if card_uid is None:
+            return found # Unknown uids only count towards bursts, and aren't kept per card
+
+        previous = self._last_seen.get(card_uid)
+        if previous is not None and previous[1].id != reader.id:
+            seen_at, other = previous
+            distance = distance_meters(other, reader)
+            seconds = abs((scanned_at - seen_at).total_seconds())
+            if distance is not None and distance >= self.min_distance and distance > self.max_speed * seconds:
+                found.append(Anomaly('impossible_travel', SEVERITIES['impossible_travel'], scanned_at, reader.id,
+                                     _location(reader), card_uid,
+                                     f'Card {card_uid} scanned at {_location(other)} and {_location(reader)}, '
+                                     f'{distance:.0f}m apart, {seconds:.0f}s apart'))
+        if previous is None or scanned_at >= previous[0]:
+            self._last_seen[card_uid] = (scanned_at, reader)
+
+        if granted:
+            last_grant = self._last_grant.get(card_uid)
+            if last_grant is not None and last_grant[1] == reader.id and \
+                    timedelta(0) <= scanned_at - last_grant[0] <= self.passback_window:
+                found.append(Anomaly('tailgating', SEVERITIES['tailgating'], scanned_at, reader.id, _location(reader), card_uid,
+                                     f'Card {card_uid} granted twice at {_location(reader)} within '
+                                     f'{(scanned_at - last_grant[0]).total_seconds():.0f}s (passback)'))
+                self._last_grant.pop(card_uid) # A third scan starts a new pair rather than reporting again
+            else:
+                self._last_grant[card_uid] = (scanned_at, reader.id)
+        return found
+
+    def observe_batch(self, scans) -> list:
+        """(scanned_at, reader, card_uid, granted) scans, in any order; returns their anomalies in time order."""
+        found = []
+        with self._lock:
+            for scan in sorted(scans, key=lambda scan: scan[0]):
+                found.extend(self.observe(*scan))
+        return found
+
+
+def current_detector() -> AnomalyDetector:
+    """The app's detector, built from its config on first use."""
+    detector = current_app.extensions.get('anomaly_detector')
+    if detector is None:
+        detector = current_app.extensions.setdefault('anomaly_detector', AnomalyDetector.from_config(current_app.config))
+    return detector
+
+
+def incident_for(anomaly: Anomaly) -> SecurityIncident:
+    return SecurityIncident(incident_type=anomaly.kind, severity=anomaly.severity, description=anomaly.description,
+                            incident_datetime=anomaly.detected_at, location_description=anomaly.location)
@@ -0,0 +1,218 @@
+"""
+Week-at-a-glance availability for many resources or advisors at once.
+
+AvailabilityGrid divides a time range into fixed buckets (15 minutes by default) and keeps one
+bitmap per resource or advisor as a Python int, bit i set when bucket i is free. Filling a grid takes
+a single query for every entity in it; after that, "when are all of these free", "which is free
+first" and "free windows of each" are bitwise operations on ints rather than queries per entity
+per slot. A week is 672 buckets, so a bitmap is a few machine words.
+
+Resources start fully free and lose every bucket an active booking touches. Advisors start fully
+busy and gain the buckets that an unbooked AppointmentSlot covers completely.
+"""
+from datetime import datetime, timedelta
+from flask import Blueprint, abort, current_app, jsonify, request
+from flask_login import current_user, login_required
+from app import db
+from app.bookings import visible_resources
+from app.instrumentation import query_budget
+from app.models import User, Resource, ResourceBooking, AppointmentSlot
+
+availability_bp = Blueprint('availability', __name__)
+
+BUCKET = timedelta(minutes=15)
+
+
+def runs_of(bits: int, length: int) -> int:
+    """Bit i is set in the result when bits i .. i+length-1 are all set in `bits`."""
+    span = 1
+    while span < length:
+        step = min(span, length - span)
+        bits &= bits >> step
+        span += step
+    return bits
+
+
+def _lowest_bit(bits: int) -> int:
+    return (bits & -bits).bit_length() - 1
+
+
+class AvailabilityGrid:
+    def __init__(self, start: datetime, end: datetime, bucket: timedelta = BUCKET):
+        self.start = start
+        self.bucket = bucket
+        self.size = -(-(end - start) // bucket) # Ceiling: a partial last bucket still counts
+        self.full = (1 << self.size) - 1
+        self.free = {} # entity id -> bitmap
+
+    @property
+    def end(self) -> datetime:
+        return self.start + self.size * self.bucket
+
+    def _mask(self, first: int, last: int) -> int:
+        """Bits first .. last-1, clamped to the grid."""
+        first, last = max(first, 0), min(last, self.size)
+        return ((1 << (last - first)) - 1) << first if last > first else 0
+
+    def add(self, key, free: bool = True) -> None:
+        self.free.setdefault(key, self.full if free else 0)
+
+    def mark_busy(self, key, start: datetime, end: datetime) -> None:
+        """Clears every bucket that [start, end) touches."""
+        first = (start - self.start) // self.bucket
+        last = -(-(end - self.start) // self.bucket)
+        self.free[key] = self.free.get(key, self.full) & ~self._mask(first, last)
+
+    def mark_free(self, key, start: datetime, end: datetime) -> None:
+        """Sets the buckets that [start, end) covers completely."""
+        first = -(-(start - self.start) // self.bucket)
+        last = (end - self.start) // self.bucket
+        self.free[key] = self.free.get(key, 0) | self._mask(first, last)
+
+    def buckets_for(self, duration: timedelta) -> int:
+        return max(1, -(-duration // self.bucket))
+
+    def all_free(self, keys=None) -> int:
+        """Buckets in which every one of `keys` (default: all entities) is free."""
+        bits = self.full
+        for key in (self.free if keys is None else keys):
+            bits &= self.free.get(key, 0)
+        return bits
+
+    def first_fit(self, bits: int, duration: timedelta):
+        """Start of the earliest run of free buckets in `bits` long enough for `duration`, or None."""
+        fits = runs_of(bits, self.buckets_for(duration))
+        return self.start + _lowest_bit(fits) * self.bucket if fits else None
+
+    def first_fit_any(self, duration: timedelta):
+        """(start, key) for the entity that can start `duration` earliest; ties go to the lowest key."""
+        best = None
+        length = self.buckets_for(duration)
+        for key in sorted(self.free):
+            fits = runs_of(self.free[key], length)
+            if fits and (best is None or _lowest_bit(fits) < best[0]):
+                best = (_lowest_bit(fits), key)
+        return (self.start + best[0] * self.bucket, best[1]) if best else None
+
+    def windows(self, bits: int) -> list:
+        """The runs of set bits as [(start, end), ...] datetimes."""
+        result = []
+        while bits:
+            first = _lowest_bit(bits)
+            shifted = bits >> first
+            length = (shifted ^ (shifted + 1)).bit_length() - 1 # Trailing ones
+            result.append((self.start + first * self.bucket, self.start + (first + length) * self.bucket))
+            bits &= ~(((1 << length) - 1) << first)
+        return result
+
+
+def resource_grid(resource_ids, start: datetime, end: datetime, bucket: timedelta = BUCKET) -> AvailabilityGrid:
+    """Grid of the resources' free time, from one query over their active bookings in [start, end)."""
+    grid = AvailabilityGrid(start, end, bucket)
+    for resource_id in resource_ids:
+        grid.add(resource_id, free=True)
+    if resource_ids:
+        rows = db.session.query(ResourceBooking.resource_id, ResourceBooking.start_time, ResourceBooking.end_time)\
+            .filter(ResourceBooking.resource_id.in_(resource_ids), ResourceBooking.start_time < grid.end,
+                    ResourceBooking.end_time > start, ResourceBooking.status != 'cancelled')
+        for resource_id, booked_start, booked_end in rows:
+            grid.mark_busy(resource_id, booked_start, booked_end)
+    return grid
+
+
+def advisor_grid(provider_ids, start: datetime, end: datetime, bucket: timedelta = BUCKET) -> AvailabilityGrid:
+    """Grid of the providers' open appointment slots, from one query over their unbooked slots in [start, end)."""
+    grid = AvailabilityGrid(start, end, bucket)
+    for provider_id in provider_ids:
+        grid.add(provider_id, free=False)
+    if provider_ids:
+        rows = db.session.query(AppointmentSlot.provider_id, AppointmentSlot.start_time, AppointmentSlot.end_time)\
+            .filter(AppointmentSlot.provider_id.in_(provider_ids), AppointmentSlot.start_time < grid.end,
+                    AppointmentSlot.end_time > start, AppointmentSlot.is_booked.is_(False))
+        for provider_id, slot_start, slot_end in rows:
+            grid.mark_free(provider_id, slot_start, slot_end)
+    return grid
+
+
+# -------------------------- Availability API --------------------------
+
+def _week_arg():
+    """The Monday 00:00 of ?week=YYYY-MM-DD (any day of the week), or of the current week."""
+    try:
+        day = datetime.strptime(request.args['week'], '%Y-%m-%d').date() if request.args.get('week') else datetime.utcnow().date()
+    except ValueError:
+        abort(400)
+    monday = day - timedelta(days=day.weekday())
+    return datetime.combine(monday, datetime.min.time())
+
+
+def _windows_json(grid, bits):
+    return [{'start': s.isoformat(), 'end': e.isoformat()} for s, e in grid.windows(bits)]
+
+
+def grid_response(grid, names):
+    """
+    JSON for a filled grid. With ?duration=<minutes>, also the earliest time all entities are free that
+    long together and the entity that is free that long soonest.
+    """
+    together = grid.all_free(names) if names else 0
+    body = {
+        'start': grid.start.isoformat(), 'end': grid.end.isoformat(),
+        'bucket_minutes': int(grid.bucket.total_seconds() // 60),
+        'entities': [{'id': key, 'name': name, 'bitmap': format(grid.free[key], 'x'), # Bit i: bucket i is free
+                      'free': _windows_json(grid, grid.free[key])} for key, name in names.items()],
+        'all_free': _windows_json(grid, together),
+    }
+    duration = request.args.get('duration', type=int)
+    if duration and duration > 0:
+        duration = timedelta(minutes=duration)
+        together_at = grid.first_fit(together, duration)
+        soonest = grid.first_fit_any(duration)
+        body['first_fit'] = {
+            'all': together_at.isoformat() if together_at else None,
+            'any': {'id': soonest[1], 'start': soonest[0].isoformat()} if soonest else None,
+        }
+    return jsonify(body)
+
+
+def _requested_ids(arg_name):
+    ids = request.args.getlist(arg_name, type=int)
+    if len(set(ids)) > current_app.config.get('AVAILABILITY_GRID_MAX_ENTITIES', 500):
+        abort(400)
+    return ids
+
+
+@availability_bp.route('/resources', methods=['GET'])
+@login_required
+@query_budget(3) # User, resources, bookings
+def resources_grid():
+    """Free time this week (or ?week=) of ?resource_id=.. (default: every bookable resource at the user's college)."""
+    start = _week_arg()
+    resource_ids = _requested_ids('resource_id')
+    query = visible_resources(db.session.query(Resource.id, Resource.name).filter(Resource.is_available.is_(True)))
+    if resource_ids:
+        query = query.filter(Resource.id.in_(resource_ids))
+    resources = dict(query.order_by(Resource.id).limit(current_app.config.get('AVAILABILITY_GRID_MAX_ENTITIES', 500)).all())
+    if resource_ids and len(resources) != len(set(resource_ids)):
+        abort(404)
+    return grid_response(resource_grid(list(resources), start, start + timedelta(days=7)), resources)
+
+
+@availability_bp.route('/advisors', methods=['GET'])
+@login_required
+@query_budget(3) # User, providers, slots
+def advisors_grid():
+    """Open appointment time this week (or ?week=) of ?provider_id=.. (default: faculty and management at the user's college)."""
+    start = _week_arg()
+    provider_ids = _requested_ids('provider_id')
+    query = db.session.query(User.id, User.username)
+    if provider_ids:
+        query = query.filter(User.id.in_(provider_ids))
+    else:
+        query = query.filter(User.role.in_([User.ROLE_FACULTY, User.ROLE_MANAGEMENT]))
+    if current_user.role != User.ROLE_ADMIN:
+        query = query.filter(User.college_id == current_user.college_id)
+    providers = dict(query.order_by(User.id).limit(current_app.config.get('AVAILABILITY_GRID_MAX_ENTITIES', 500)).all())
+    if provider_ids and len(providers) != len(set(provider_ids)):
+        abort(404)
+    return grid_response(advisor_grid(list(providers), start, start + timedelta(days=7)), providers)
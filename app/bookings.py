@@ -0,0 +1,183 @@
+"""
+Resource booking engine: race-safe overlap checks and availability search.
+
+Two active (not cancelled) bookings of the same resource may not overlap; intervals are half-open,
+so a booking ending at 11:00 doesn't clash with one starting at 11:00. On PostgreSQL this is enforced
+by the excl_booking_resource_overlap exclusion constraint on resource_booking, and book_resource()
+just inserts and translates the constraint violation. Other backends have no such constraint, so
+bookings of one resource are serialized instead: a no-op UPDATE of the resource row takes its write
+lock (on SQLite, the database write lock) before the overlap check, and holds it until the insert
+commits. Both the check and find_free_windows() filter on (resource_id, start_time), which the
+ix_resource_booking_resource_time index serves.
+"""
+from datetime import datetime, timedelta, timezone
+from flask import Blueprint, abort, current_app, jsonify, request
+from flask_login import current_user, login_required
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.instrumentation import query_budget
+from app.models import User, Resource, ResourceBooking
+
+bookings_bp = Blueprint('bookings', __name__)
+
+EXCLUSION_VIOLATION = '23P01' # PostgreSQL SQLSTATE for exclusion_violation
+
+
+class BookingConflict(Exception):
+    """Raised by book_resource() when the requested interval overlaps active bookings."""
+
+    def __init__(self, resource_id, conflicts):
+        self.resource_id = resource_id
+        self.conflicts = conflicts
+        super().__init__(f'Resource {resource_id} has {len(conflicts)} overlapping booking(s)')
+
+
+def _active_overlaps(start, end):
+    """Criteria for active bookings overlapping the half-open interval [start, end)."""
+    return (ResourceBooking.start_time < end, ResourceBooking.end_time > start, ResourceBooking.status != 'cancelled')
+
+
+def overlapping_bookings(resource_id, start, end):
+    return ResourceBooking.query.filter(ResourceBooking.resource_id == resource_id, *_active_overlaps(start, end))\
+        .order_by(ResourceBooking.start_time).all()
+
+
+def _is_exclusion_violation(exc):
+    orig = exc.orig
+    return (getattr(orig, 'pgcode', None) or getattr(orig, 'sqlstate', None)) == EXCLUSION_VIOLATION # psycopg2 / psycopg 3
+
+
+def book_resource(resource_id, user_id, start, end, purpose=None, status='confirmed', course_id=None, event_id=None):
+    """
+    Books `resource_id` for [start, end) and commits. Raises BookingConflict if an active booking
+    overlaps, ValueError if the interval is empty.
+    """
+    if end <= start:
+        raise ValueError('end must be after start')
+    booking = ResourceBooking(resource_id=resource_id, user_id=user_id, start_time=start, end_time=end,
+                              purpose=purpose, status=status, course_id=course_id, event_id=event_id)
+    if db.engine.dialect.name == 'postgresql':
+        db.session.add(booking)
+        try:
+            db.session.commit()
+        except IntegrityError as exc:
+            db.session.rollback()
+            if not _is_exclusion_violation(exc):
+                raise
+            raise BookingConflict(resource_id, overlapping_bookings(resource_id, start, end)) from exc
+        return booking
+
+    # Serialize concurrent bookings of this resource until the commit below
+    db.session.execute(update(Resource).where(Resource.id == resource_id).values(id=Resource.id))
+    conflicts = overlapping_bookings(resource_id, start, end)
+    if conflicts:
+        db.session.rollback()
+        raise BookingConflict(resource_id, conflicts)
+    db.session.add(booking)
+    db.session.commit()
+    return booking
+
+
+def find_free_windows(resource_ids, start, end, min_duration=timedelta(0)):
+    """
+    Free intervals of each resource within [start, end) that are at least `min_duration` long, as
+    {resource_id: [(free_start, free_end), ...]}. One query fetches every overlapping active booking
+    ordered by (resource_id, start_time); a single sweep then walks each resource's bookings, keeping
+    the latest end seen so far, and emits the gaps.
+    """
+    windows = {resource_id: [] for resource_id in resource_ids}
+    if not windows or end <= start:
+        return windows
+    rows = db.session.query(ResourceBooking.resource_id, ResourceBooking.start_time, ResourceBooking.end_time)\
+        .filter(ResourceBooking.resource_id.in_(windows), *_active_overlaps(start, end))\
+        .order_by(ResourceBooking.resource_id, ResourceBooking.start_time)
+    free_from = dict.fromkeys(windows, start)
+    for resource_id, booked_start, booked_end in rows:
+        if booked_start > free_from[resource_id] and booked_start - free_from[resource_id] >= min_duration:
+            windows[resource_id].append((free_from[resource_id], booked_start))
+        free_from[resource_id] = max(free_from[resource_id], booked_end)
+    for resource_id, free_start in free_from.items():
+        if end > free_start and end - free_start >= min_duration:
+            windows[resource_id].append((free_start, end))
+    return windows
+
+
+# -------------------------- Booking API --------------------------
+
+def _parse_datetime(value):
+    """ISO 8601 to the naive UTC datetimes stored in the database; None if missing or malformed."""
+    if isinstance(value, str) and value[-1:] in ('Z', 'z'):
+        value = value[:-1] + '+00:00' # fromisoformat() only accepts a Z suffix from Python 3.11
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _booking_json(booking):
+    return {'id': booking.id, 'resource_id': booking.resource_id, 'user_id': booking.user_id,
+            'start_time': booking.start_time.isoformat(), 'end_time': booking.end_time.isoformat(),
+            'purpose': booking.purpose, 'status': booking.status}
+
+
+def visible_resources(query):
+    """Limits a Resource query to the current user's college; admins see every college."""
+    if current_user.role != User.ROLE_ADMIN:
+        query = query.filter(Resource.college_id == current_user.college_id)
+    return query
+
+
+@bookings_bp.route('/<int:resource_id>/bookings', methods=['POST'])
+@login_required
+@query_budget(6)
+def create_booking(resource_id):
+    resource = visible_resources(Resource.query.filter(Resource.id == resource_id)).first_or_404()
+    data = request.get_json(silent=True) or {}
+    start, end = _parse_datetime(data.get('start_time')), _parse_datetime(data.get('end_time'))
+    if start is None or end is None or end <= start:
+        return jsonify({'error': 'start_time and end_time must be ISO 8601 datetimes with end_time after start_time'}), 400
+    if not resource.is_available:
+        return jsonify({'error': 'This resource is not available for booking'}), 409
+    try:
+        booking = book_resource(resource.id, current_user.id, start, end, purpose=data.get('purpose'))
+    except BookingConflict as exc:
+        return jsonify({'error': 'The resource is already booked during that time',
+                        'conflicts': [{'start_time': b.start_time.isoformat(), 'end_time': b.end_time.isoformat()}
+                                      for b in exc.conflicts]}), 409
+    return jsonify({'booking': _booking_json(booking)}), 201
+
+
+@bookings_bp.route('/availability', methods=['GET'])
+@login_required
+@query_budget(3) # User, resources, bookings
+def availability():
+    """
+    Free windows for ?resource_id=..&resource_id=.. (default: every bookable resource at the user's
+    college) between ?start= and ?end=, optionally only those at least ?min_minutes= long.
+    """
+    start, end = _parse_datetime(request.args.get('start')), _parse_datetime(request.args.get('end'))
+    if start is None or end is None or end <= start:
+        return jsonify({'error': 'start and end must be ISO 8601 datetimes with end after start'}), 400
+    if end - start > timedelta(days=current_app.config.get('BOOKING_SEARCH_MAX_DAYS', 31)):
+        return jsonify({'error': 'The search range is too long'}), 400
+    min_duration = timedelta(minutes=max(0, request.args.get('min_minutes', 0, type=int)))
+
+    query = visible_resources(db.session.query(Resource.id, Resource.name).filter(Resource.is_available.is_(True)))
+    resource_ids = request.args.getlist('resource_id', type=int)
+    if resource_ids:
+        query = query.filter(Resource.id.in_(resource_ids))
+    resources = query.order_by(Resource.id).all()
+    if resource_ids and len(resources) != len(set(resource_ids)):
+        abort(404)
+
+    windows = find_free_windows([resource_id for resource_id, _ in resources], start, end, min_duration)
+    return jsonify({
+        'start': start.isoformat(), 'end': end.isoformat(),
+        'resources': [{'resource_id': resource_id, 'name': name,
+                       'free': [{'start': s.isoformat(), 'end': e.isoformat()} for s, e in windows[resource_id]]}
+                      for resource_id, name in resources],
+    })
@@ -1,39 +1,223 @@
-import google.generativeai as genai
-from flask import Blueprint, request, jsonify, current_app, render_template
-from app.models import College, Course, Event # Import models
+import importlib.util
+import json
+import random
+import sys
+import threading
+import time
+from flask import Blueprint, request, jsonify, current_app, render_template, Response, stream_with_context
+from app.retrieval import retrieve_context
+from app.ratelimit import rate_limit
+from app.metrics import cache_requests, chatbot_llm_duration, chatbot_llm_errors, chatbot_llm_retries, chatbot_streams_in_flight
+from app.chatbot_cache import response_cache
 
-chatbot_bp = Blueprint('chatbot', __name__)
+chatbot_bp = Blueprint('chatbot', __name__, template_folder='templates') # chatbot.html is in app/templates
 
-def get_gemini_response(user_query: str, context_data: str = None) -> str:
-    try:
-        api_key = current_app.config.get('GEMINI_API_KEY')
-        if not api_key:
-            current_app.logger.error('GEMINI_API_KEY not found.')
-            return "Chatbot is not configured. Missing API key."
 
+def _lazy_import(name: str):
+    """
+    Returns module `name`, deferring the actual import to its first attribute access. google.generativeai
+    takes about a second to import, which every cold start (and test run) would otherwise pay up front.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name) # Imports the parent packages, which are cheap
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    parent, _, child = name.rpartition('.')
+    setattr(sys.modules[parent], child, module) # As a regular import would, for code that uses parent.child
+    return module
+
+genai = _lazy_import('google.generativeai')
+core_exceptions = _lazy_import('google.api_core.exceptions')
+
+ERROR_RESPONSE = "Sorry, I encountered an error trying to respond. Please try again later."
+MISSING_KEY_RESPONSE = "Chatbot is not configured. Missing API key."
+
+# -------------------------- LLM Client Registry --------------------------
+# genai.configure() builds a fresh transport (and so fresh connections) every time it is called, so the
+# client is configured once per process and GenerativeModel instances are reused across requests.
+
+_models = {}
+_configured_with = None
+_registry_lock = threading.Lock()
+
+def _retryable_errors() -> tuple:
+    # Errors worth retrying: 5xx/429 from the API and connection-level failures (timeouts, resets).
+    # Built on demand so that importing this module doesn't load google.api_core.
+    return (core_exceptions.ServerError, core_exceptions.TooManyRequests, OSError)
+
+def _configure_genai(api_key: str, endpoint: str = None) -> None:
+    """
+    Configures the Gemini client. When GEMINI_API_ENDPOINT is set (e.g. a local fake LLM server in tests)
+    the REST transport is used so plain HTTP endpoints work.
+    """
+    if endpoint:
+        genai.configure(api_key=api_key, transport='rest', client_options={'api_endpoint': endpoint})
+    else:
         genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-pro')
 
-        full_prompt = user_query
-        if context_data and context_data.strip(): # ensure context_data is not just whitespace
-            # The prompt structure can be important.
-            # Using the structure from a previous successful implementation.
-            full_prompt = f"""Here is some information that might be relevant to the user's query:
+def get_model(model_name: str = None) -> 'genai.GenerativeModel':
+    """
+    Returns the shared GenerativeModel for `model_name` (default GEMINI_MODEL), configuring the client on
+    first use or when the API key/endpoint config changes.
+    """
+    model_name = model_name or current_app.config.get('GEMINI_MODEL', 'gemini-pro')
+    settings = (current_app.config.get('GEMINI_API_KEY'), current_app.config.get('GEMINI_API_ENDPOINT'))
+    global _configured_with
+    with _registry_lock:
+        if _configured_with != settings:
+            _configure_genai(*settings)
+            _models.clear()
+            _configured_with = settings
+        model = _models.get(model_name)
+        if model is None:
+            model = _models[model_name] = genai.GenerativeModel(model_name)
+        return model
+
+def reset_llm_clients() -> None:
+    """Drops the shared client and models; the next get_model() call reconfigures."""
+    global _configured_with
+    with _registry_lock:
+        _models.clear()
+        _configured_with = None
+
+def _request_options() -> dict:
+    # retry=None turns off google-api-core's built-in retry (which can wait minutes) so ours applies instead.
+    return {'timeout': current_app.config.get('CHATBOT_TIMEOUT_SECONDS', 30), 'retry': None}
+
+def call_with_retries(kind: str, func, *args, **kwargs):
+    """
+    Calls func(*args, **kwargs), retrying _retryable_errors() up to CHATBOT_MAX_RETRIES times with
+    full-jitter exponential backoff, and records latency, retries and errors in the /metrics registry.
+    """
+    max_retries = current_app.config.get('CHATBOT_MAX_RETRIES', 2)
+    base_delay = current_app.config.get('CHATBOT_RETRY_BACKOFF_SECONDS', 0.5)
+    retryable = _retryable_errors()
+    started = time.perf_counter()
+    attempt = 0
+    while True:
+        try:
+            result = func(*args, **kwargs)
+        except retryable as e:
+            if attempt >= max_retries:
+                chatbot_llm_errors.inc(kind=kind, error=type(e).__name__)
+                chatbot_llm_duration.observe(time.perf_counter() - started, kind=kind, outcome='error')
+                raise
+            delay = random.uniform(0, base_delay * (2 ** attempt))
+            current_app.logger.warning(f"Gemini {kind} call failed ({e}); retry {attempt + 1}/{max_retries} in {delay:.2f}s")
+            chatbot_llm_retries.inc(kind=kind)
+            time.sleep(delay)
+            attempt += 1
+        except Exception as e:
+            chatbot_llm_errors.inc(kind=kind, error=type(e).__name__)
+            chatbot_llm_duration.observe(time.perf_counter() - started, kind=kind, outcome='error')
+            raise
+        else:
+            chatbot_llm_duration.observe(time.perf_counter() - started, kind=kind, outcome='ok')
+            return result
+
+def build_prompt(user_query: str, context_data: str = None) -> str:
+    full_prompt = user_query
+    if context_data and context_data.strip(): # ensure context_data is not just whitespace
+        # The prompt structure can be important.
+        # Using the structure from a previous successful implementation.
+        full_prompt = f"""Here is some information that might be relevant to the user's query:
 {context_data}
 
 User query: {user_query}
 Please answer the user's query based on the information provided above if relevant, or use your general knowledge.
 """
-        
+    return full_prompt
+
+def get_gemini_response(user_query: str, context_data: str = None) -> str:
+    try:
+        api_key = current_app.config.get('GEMINI_API_KEY')
+        if not api_key:
+            current_app.logger.error('GEMINI_API_KEY not found.')
+            return MISSING_KEY_RESPONSE
+
+        model = get_model()
+        full_prompt = build_prompt(user_query, context_data)
         current_app.logger.debug(f"Gemini Prompt: {full_prompt}")
-        response = model.generate_content(full_prompt)
+        response = call_with_retries('generate', model.generate_content, full_prompt,
+                                     request_options=_request_options())
         return response.text
         
     except Exception as e:
         current_app.logger.error(f"Gemini API call failed: {e}")
-        return "Sorry, I encountered an error trying to respond. Please try again later."
+        return ERROR_RESPONSE
+
+def stream_gemini_response(user_query: str, context_data: str = None):
+    """
+    Generator yielding response text chunks as Gemini produces them.
+    Raises TimeoutError if the whole response takes longer than CHATBOT_TIMEOUT_SECONDS;
+    API errors propagate to the caller. Only the initial request is retried, never a half-sent stream.
+    """
+    api_key = current_app.config.get('GEMINI_API_KEY')
+    if not api_key:
+        current_app.logger.error('GEMINI_API_KEY not found.')
+        yield MISSING_KEY_RESPONSE
+        return
+
+    timeout = current_app.config.get('CHATBOT_TIMEOUT_SECONDS', 30)
+    deadline = time.monotonic() + timeout
+    model = get_model()
+    # The per-call timeout bounds each HTTP read; the deadline bounds the stream as a whole.
+    response = call_with_retries('stream', model.generate_content, build_prompt(user_query, context_data),
+                                 stream=True, request_options=_request_options())
+    for chunk in response:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'Gemini response exceeded {timeout}s')
+        if chunk.text:
+            yield chunk.text
+
+# Streams hold a worker thread for the whole LLM latency, so cap how many run at once and shed the rest.
+_stream_slots = None
+_stream_slots_lock = threading.Lock()
+
+def _get_stream_slots() -> threading.BoundedSemaphore:
+    global _stream_slots
+    with _stream_slots_lock:
+        if _stream_slots is None:
+            _stream_slots = threading.BoundedSemaphore(current_app.config.get('CHATBOT_MAX_CONCURRENT_STREAMS', 8))
+        return _stream_slots
+
+def _sse_event(data: dict, event: str = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+def _cached_response(user_message: str, context_data: str = None):
+    cached = response_cache.get(user_message, context_data,
+                                similarity=current_app.config.get('CHATBOT_CACHE_SIMILARITY', 0))
+    cache_requests.inc(cache='chatbot', result='miss' if cached is None else 'hit')
+    return cached
+
+def _cache_response(user_message: str, context_data: str, response_text: str) -> None:
+    if not response_text or response_text in (ERROR_RESPONSE, MISSING_KEY_RESPONSE):
+        return # Never cache failures
+    response_cache.set(user_message, context_data, response_text,
+                       ttl=current_app.config.get('CHATBOT_CACHE_TTL_SECONDS', 600),
+                       max_entries=current_app.config.get('CHATBOT_CACHE_MAX_ENTRIES', 512))
+
+def build_context_data(user_message: str):
+    """
+    Builds the context string passed to Gemini from the records most relevant to the message
+    (College, Course, Event, StudyGroup, Post), capped at CHATBOT_CONTEXT_TOKEN_BUDGET; None if nothing matches.
+    """
+    lines = retrieve_context(user_message,
+                             k=current_app.config.get('CHATBOT_CONTEXT_TOP_K', 5),
+                             token_budget=current_app.config.get('CHATBOT_CONTEXT_TOKEN_BUDGET', 300),
+                             max_age=current_app.config.get('CHATBOT_INDEX_REFRESH_SECONDS', 300),
+                             rebuild_age=current_app.config.get('CHATBOT_INDEX_REBUILD_SECONDS', 3600),
+                             max_per_type=current_app.config.get('CHATBOT_INDEX_MAX_PER_TYPE', 20000))
+    if not lines:
+        return None
+    return "Relevant records:\n" + "\n".join(f"- {line}" for line in lines)
 
 @chatbot_bp.route('/chat', methods=['POST'])
+@rate_limit('chatbot')
 def chat_api():
     # Using request.get_json() is generally preferred as it handles content type checking.
     data = request.get_json() 
@@ -41,66 +225,69 @@ def chat_api():
         return jsonify({"error": "No message provided"}), 400
 
     user_message = data['message'] # If data is not None and 'message' is present
-    
-    # Step 2.b: Convert user_message to lowercase for keyword matching
-    lower_query = user_message.lower()
-    
-    # Step 2.c: Initialize context_data_parts
-    context_data_parts = []
-
-    # Step 2.d: College Data
-    if "college" in lower_query:
-        colleges = College.query.limit(3).all()
-        if colleges:
-            college_info = ", ".join([c.name for c in colleges])
-            context_data_parts.append(f"Some colleges in the system: {college_info}.")
-
-    # Step 2.e: Course Data
-    if "course" in lower_query:
-        courses = Course.query.limit(3).all()
-        if courses:
-            # Assuming c.college.name is accessible if courses have a loaded 'college' relationship.
-            # For simplicity, sticking to c.name as per direct instruction.
-            # A more robust version might try:
-            # course_info_parts = []
-            # for c in courses:
-            #   info = c.name
-            #   try: # Attempt to get college name if relationship exists and is loaded
-            #       if c.college: info += f" (at {c.college.name})"
-            #   except Exception: pass # Ignore if college info isn't easily accessible
-            #   course_info_parts.append(info)
-            # course_info = ", ".join(course_info_parts)
-            course_info = ", ".join([c.name for c in courses])
-            context_data_parts.append(f"Some available courses: {course_info}.")
-
-    # Step 2.f: Event Data
-    if "event" in lower_query:
-        # Assuming Event model has 'date_time' attribute for ordering
-        # If it's just 'date', then Event.date.desc()
-        # Let's assume 'date_time' exists as per instruction.
-        # If Event.date_time is not available, this would cause an error.
-        # A safer default would be to not order or order by ID if date_time is uncertain.
-        # For now, following instruction.
-        try:
-            events = Event.query.order_by(Event.date_time.desc()).limit(3).all()
-            if events:
-                event_info = ", ".join([e.name for e in events])
-                context_data_parts.append(f"Some recent or upcoming events: {event_info}.")
-        except AttributeError: # Fallback if Event.date_time doesn't exist
-            current_app.logger.warning("Event.date_time attribute not found for ordering, fetching without specific order.")
-            events = Event.query.limit(3).all()
-            if events:
-                event_info = ", ".join([e.name for e in events])
-                context_data_parts.append(f"Some events: {event_info}.")
-
-
-    # Step 2.g: Join context parts
-    context_data_str = " ".join(context_data_parts) if context_data_parts else None
+    context_data_str = build_context_data(user_message)
+
+    cached = _cached_response(user_message, context_data_str)
+    if cached is not None:
+        response = jsonify({'response': cached})
+        response.headers['X-Chatbot-Cache'] = 'hit'
+        return response
     
     # Step 2.h: Call get_gemini_response with user message and context
     response_text = get_gemini_response(user_message, context_data=context_data_str) 
+    _cache_response(user_message, context_data_str, response_text)
     
-    return jsonify({'response': response_text})
+    response = jsonify({'response': response_text})
+    response.headers['X-Chatbot-Cache'] = 'miss'
+    return response
+
+@chatbot_bp.route('/chat/stream', methods=['POST'])
+@rate_limit('chatbot')
+def chat_stream_api():
+    """
+    Server-Sent Events variant of chat_api: emits a `data: {"text": ...}` event per chunk as it arrives,
+    then `event: done` (or `event: error`). Returns 503 when CHATBOT_MAX_CONCURRENT_STREAMS are in flight.
+    """
+    data = request.get_json(silent=True)
+    if not data or 'message' not in data:
+        return jsonify({"error": "No message provided"}), 400
+
+    user_message = data['message']
+    context_data_str = build_context_data(user_message)
+
+    # Cache hits are replayed as a single chunk and never take a stream slot.
+    cached = _cached_response(user_message, context_data_str)
+    if cached is not None:
+        return Response(_sse_event({'text': cached}) + _sse_event({}, event='done'), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Chatbot-Cache': 'hit'})
+
+    slots = _get_stream_slots()
+    if not slots.acquire(blocking=False):
+        response = jsonify({"error": "The chatbot is busy right now. Please try again shortly."})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+
+    def generate():
+        chatbot_streams_in_flight.inc()
+        try:
+            parts = []
+            for text in stream_gemini_response(user_message, context_data=context_data_str):
+                parts.append(text)
+                yield _sse_event({'text': text})
+            _cache_response(user_message, context_data_str, ''.join(parts))
+            yield _sse_event({}, event='done')
+        except Exception as e:
+            current_app.logger.error(f"Gemini streaming call failed: {e}")
+            yield _sse_event({'error': ERROR_RESPONSE}, event='error')
+        finally:
+            chatbot_streams_in_flight.dec()
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'X-Chatbot-Cache': 'miss'})
+    # Released when the client finishes reading or disconnects, even if the generator never started.
+    response.call_on_close(slots.release)
+    return response
 
 @chatbot_bp.route('/chatbot_ui', methods=['GET'])
 def chatbot_ui():
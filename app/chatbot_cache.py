@@ -0,0 +1,114 @@
+"""
+Response cache for the chatbot.
+
+Entries are keyed by the normalized user query plus a fingerprint of the context_data sent with it, so
+the same question asked against the same College/Course/Event context is answered without a Gemini
+round trip. Entries expire after CHATBOT_CACHE_TTL_SECONDS and the whole cache is dropped when a
+College, Course or Event row is inserted, updated or deleted in this process (other workers fall back
+on the context fingerprint and TTL). With CHATBOT_CACHE_SIMILARITY > 0, a miss falls back to the most
+similar cached query under the same context, by character-trigram Jaccard similarity.
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+from app.models import College, Course, Event
+
+_NON_WORD = re.compile(r'[^\w\s]+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_query(query: str) -> str:
+    """Lowercases, drops punctuation and collapses whitespace: 'What events are coming up?!' -> 'what events are coming up'."""
+    return _WHITESPACE.sub(' ', _NON_WORD.sub(' ', query.lower())).strip()
+
+
+def context_fingerprint(context_data: str = None) -> str:
+    return hashlib.sha1((context_data or '').encode('utf-8')).hexdigest()
+
+
+def _trigrams(text: str) -> frozenset:
+    padded = f'  {text} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ResponseCache:
+    """Thread-safe LRU of chatbot responses with per-entry expiry."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # (normalized query, fingerprint) -> (response, expires_at, trigrams)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query: str, context_data: str = None, similarity: float = 0):
+        """
+        Returns the cached response or None.
+        :param similarity: Minimum trigram similarity for a near-duplicate match; 0 means exact matches only.
+        """
+        normalized = normalize_query(query)
+        fingerprint = context_fingerprint(context_data)
+        now = time.monotonic()
+        with self._lock:
+            key = (normalized, fingerprint)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None and similarity > 0:
+                key, entry = self._closest(normalized, fingerprint, similarity, now)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def _closest(self, normalized, fingerprint, similarity, now):
+        # Linear in cache size, which CHATBOT_CACHE_MAX_ENTRIES keeps small.
+        grams = _trigrams(normalized)
+        best_key, best_entry, best_score = None, None, similarity
+        for key, entry in self._entries.items():
+            if key[1] != fingerprint or entry[1] <= now:
+                continue
+            score = _jaccard(grams, entry[2])
+            if score >= best_score:
+                best_key, best_entry, best_score = key, entry, score
+        return best_key, best_entry
+
+    def set(self, query: str, context_data: str, response: str, ttl: float, max_entries: int) -> None:
+        if ttl <= 0 or max_entries <= 0:
+            return
+        normalized = normalize_query(query)
+        with self._lock:
+            key = (normalized, context_fingerprint(context_data))
+            self._entries[key] = (response, time.monotonic() + ttl, _trigrams(normalized))
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+response_cache = ResponseCache()
+
+
+def _invalidate(mapper, connection, target):
+    response_cache.clear()
+
+for _model in (College, Course, Event):
+    for _event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event_name, _invalidate)
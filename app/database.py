@@ -0,0 +1,161 @@
+"""
+Engine options and connection setup for the configured database profile.
+
+DATABASE_PROFILES in config.py describes each supported deployment (sqlite-dev, sqlite-prod-wal,
+postgres): SQLAlchemy engine/pool options, plus PRAGMAs that SQLite needs set on every new
+connection because they are per-connection state. apply_database_profile() runs before the engine is
+created and fails fast on a profile that doesn't match the database URL; install_connect_hooks() runs
+right after, so the pragmas are in place before the first connection is opened. The second half of the
+module routes read-only requests to replica binds.
+"""
+import random
+import time
+from functools import wraps
+from flask import g, has_request_context, request, session as http_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.engine import make_url
+
+# Options that only make sense for a QueuePool, which SQLite engines don't use by default.
+POOL_SIZING_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+
+def resolve_profile_name(config) -> str:
+    """DATABASE_PROFILE if set, otherwise inferred from the database URL's backend."""
+    if config.get('DATABASE_PROFILE'):
+        return config['DATABASE_PROFILE'].lower()
+    backend = make_url(config['SQLALCHEMY_DATABASE_URI']).get_backend_name()
+    return 'postgres' if backend == 'postgresql' else 'sqlite-dev'
+
+
+def validate_profile(name: str, profile: dict, uri: str) -> None:
+    """Raises ValueError if the profile can't be used with `uri`."""
+    backend = make_url(uri).get_backend_name()
+    if profile['backend'] != backend:
+        raise ValueError(f"DATABASE_PROFILE '{name}' is for {profile['backend']} but SQLALCHEMY_DATABASE_URI is {backend}")
+    options = profile.get('engine_options', {})
+    if backend == 'sqlite':
+        sizing = [key for key in POOL_SIZING_OPTIONS if key in options]
+        if sizing:
+            raise ValueError(f"DATABASE_PROFILE '{name}' sets {', '.join(sizing)}, which SQLite pools don't accept")
+    elif profile.get('sqlite_pragmas'):
+        raise ValueError(f"DATABASE_PROFILE '{name}' sets sqlite_pragmas for a {backend} database")
+    for key in ('pool_size', 'max_overflow', 'pool_recycle', 'pool_timeout'):
+        if key in options and (not isinstance(options[key], (int, float)) or options[key] < 0):
+            raise ValueError(f"DATABASE_PROFILE '{name}': {key} must be a non-negative number")
+
+
+def apply_database_profile(app) -> dict:
+    """
+    Validates the active profile and merges its engine options under any explicit SQLALCHEMY_ENGINE_OPTIONS.
+    Must run before SQLAlchemy(app) creates the engine. Returns the profile.
+    """
+    profiles = app.config.get('DATABASE_PROFILES', {})
+    name = resolve_profile_name(app.config)
+    if name not in profiles:
+        raise ValueError(f"Unknown DATABASE_PROFILE '{name}'; expected one of {', '.join(sorted(profiles))}")
+    profile = profiles[name]
+    validate_profile(name, profile, app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {**profile.get('engine_options', {}),
+                                               **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})}
+    app.config['DATABASE_PROFILE'] = name
+    return profile
+
+
+def install_sqlite_pragmas(engine, pragmas: dict) -> None:
+    """Runs `PRAGMA key=value` for each entry on every new DBAPI connection the engine opens."""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for key, value in pragmas.items():
+                cursor.execute(f'PRAGMA {key}={value}')
+        finally:
+            cursor.close()
+
+
+def install_connect_hooks(app, db) -> None:
+    """Attaches the profile's per-connection setup to every engine (the default one and any binds)."""
+    profile = app.config['DATABASE_PROFILES'][app.config['DATABASE_PROFILE']]
+    with app.app_context():
+        for engine in db.engines.values():
+            install_sqlite_pragmas(engine, profile.get('sqlite_pragmas', {}))
+            if profile.get('sqlite_pragmas', {}).get('journal_mode', '').upper() == 'WAL':
+                _check_wal(app, engine)
+
+
+def _check_wal(app, engine):
+    # In-memory databases silently stay in 'memory' journal mode; say so rather than pretend WAL is on.
+    with engine.connect() as connection:
+        mode = connection.exec_driver_sql('PRAGMA journal_mode').scalar()
+    if str(mode).lower() != 'wal':
+        app.logger.warning(f"DATABASE_PROFILE '{app.config['DATABASE_PROFILE']}' requested WAL but journal_mode is {mode}")
+
+
+# -------------------------- Read Replica Routing --------------------------
+# Replicas are ordinary binds named replica_<n> (see DATABASE_REPLICA_URLS). Views opt in with
+# @replica_reads; within those, SELECTs go to a replica unless the session has unflushed or uncommitted
+# writes, or the user wrote something within the last DATABASE_STICKY_SECONDS (read-your-writes).
+# Everything else, including all flushes, uses the primary.
+
+REPLICA_BIND_PREFIX = 'replica_'
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends eligible reads to a randomly chosen replica bind."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._reads_from_replica(mapper, clause):
+            replicas = [engine for key, engine in self._db.engines.items()
+                        if key and key.startswith(REPLICA_BIND_PREFIX)]
+            if replicas:
+                return random.choice(replicas)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _reads_from_replica(self, mapper, clause):
+        if not has_request_context() or not g.get('db_use_replica'):
+            return False
+        if self._flushing or self.info.get('routing_dirty') or self.new or self.dirty or self.deleted:
+            return False
+        if clause is not None and not getattr(clause, 'is_select', False):
+            return False
+        if mapper is not None and sa_inspect(mapper).local_table.metadata.info.get('bind_key'):
+            return False # Models on another bind aren't replicated
+        return True
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_dirty(session, flush_context):
+    session.info['routing_dirty'] = True
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _mark_written(session):
+    if session.info.pop('routing_dirty', False) and has_request_context() and request.method not in SAFE_METHODS:
+        g.db_wrote = True
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _clear_dirty(session):
+    session.info.pop('routing_dirty', None)
+
+
+def replica_reads(view):
+    """Lets a view's GET/HEAD requests read from a replica, outside the user's sticky-after-write window."""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        g.db_use_replica = (request.method in SAFE_METHODS
+                            and http_session.get('db_primary_until', 0) <= time.time())
+        return view(*args, **kwargs)
+    return wrapped
+
+
+def init_replica_routing(app) -> None:
+    """Starts the sticky window (stored in the signed session cookie, so it holds across workers) after writes."""
+    @app.after_request
+    def _stick_to_primary(response):
+        if g.get('db_wrote'):
+            http_session['db_primary_until'] = time.time() + app.config.get('DATABASE_STICKY_SECONDS', 5)
+        return response
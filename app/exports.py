@@ -0,0 +1,229 @@
+"""
+Streaming CSV/NDJSON exports for admin and faculty reports.
+
+Every export is a plain column query (no ORM objects) fetched with yield_per, which also turns on
+server-side cursors where the backend supports them. Rows are written out one at a time through a
+generator response, so memory use stays flat no matter how large the result set is.
+"""
+import csv
+import io
+import json
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from flask import Blueprint, Response, abort, request, stream_with_context
+from flask_login import current_user, login_required
+from sqlalchemy.orm import Query, aliased
+from app import db
+from app.models import (User, College, Course, CourseEnrollment, AttendanceRecord,
+                        Book, LibraryLoan, FinancialAccount, TransactionLedger)
+from app.partitioning import PARTITIONED, select_range
+
+exports_bp = Blueprint('exports', __name__)
+
+EXPORT_BATCH_SIZE = 1000
+
+
+def _json_default(value):
+    """Serializes the non-JSON types that appear in export rows."""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+
+def csv_lines(header, rows):
+    """Yields CSV text one line at a time, starting with the header."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield buffer.getvalue()
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate(0)
+        writer.writerow(row)
+        yield buffer.getvalue()
+
+
+def ndjson_lines(header, rows):
+    """Yields one JSON object per row, keyed by the header, newline-delimited."""
+    for row in rows:
+        yield json.dumps(dict(zip(header, row)), default=_json_default) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', csv_lines),
+    'ndjson': ('application/x-ndjson', ndjson_lines),
+}
+
+
+def export_response(filename_stem, header, query, fmt='csv'):
+    """
+    Streams `query` as an attachment in the requested format.
+    :param filename_stem: Download filename without extension.
+    :param header: Column names, in the same order as the query's columns.
+    :param query: A column query, or a Core select such as partitioning.select_range() returns; it is
+        consumed lazily in EXPORT_BATCH_SIZE batches.
+    :param fmt: One of EXPORT_FORMATS.
+    """
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    mimetype, writer = EXPORT_FORMATS[fmt]
+    if isinstance(query, Query):
+        rows = query.yield_per(EXPORT_BATCH_SIZE)
+    else:
+        rows = db.session.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    return Response(stream_with_context(writer(header, rows)),
+                    mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename_stem}.{fmt}'})
+
+
+def _date_arg(value):
+    """Query-string type converter for YYYY-MM-DD dates; werkzeug treats ValueError as 'not given'."""
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+# -------------------------- Export Definitions --------------------------
+
+_EXPORTS = {}
+
+def register_export(name, roles):
+    """
+    Registers a report under /export/<name>.<fmt>, restricted to `roles`.
+    The decorated function receives request.args and returns (header, query).
+    """
+    def decorator(func):
+        _EXPORTS[name] = (roles, func)
+        return func
+    return decorator
+
+
+@register_export('users', roles=[User.ROLE_ADMIN])
+def users_export(args):
+    header = ['id', 'username', 'email', 'college', 'role', 'is_college_verified', 'registered', 'last_seen']
+    query = db.session.query(
+        User.id, User.username, User.email, College.name, User.role,
+        User.is_college_verified, User.timestamp, User.last_seen
+    ).outerjoin(College, User.college_id == College.id)
+    if args.get('college_id', type=int):
+        query = query.filter(User.college_id == args.get('college_id', type=int))
+    if args.get('role'):
+        query = query.filter(User.role == args.get('role'))
+    return header, query.order_by(User.id)
+
+
+@register_export('enrollments', roles=[User.ROLE_ADMIN, User.ROLE_MANAGEMENT])
+def enrollments_export(args):
+    header = ['course_code', 'course', 'student', 'email', 'status', 'enrollment_date', 'grade_points']
+    query = db.session.query(
+        Course.course_code, Course.name, User.username, User.email,
+        CourseEnrollment.status, CourseEnrollment.enrollment_date, CourseEnrollment.grade_points
+    ).join(User, CourseEnrollment.user_id == User.id)\
+        .join(Course, CourseEnrollment.course_id == Course.id)
+    if args.get('course_id', type=int):
+        query = query.filter(CourseEnrollment.course_id == args.get('course_id', type=int))
+    if args.get('status'):
+        query = query.filter(CourseEnrollment.status == args.get('status'))
+    return header, query.order_by(Course.course_code, User.username)
+
+
+ATTENDANCE_EXPORT_HEADER = ['date', 'student', 'course_code', 'course', 'status', 'marked_by', 'time_marked']
+
+def attendance_export_query(criteria, order_by):
+    """Column query behind attendance exports; callers supply filter criteria and ordering."""
+    marker = aliased(User)
+    return db.session.query(
+        AttendanceRecord.date, User.username, Course.course_code, Course.name,
+        AttendanceRecord.status, marker.username, AttendanceRecord.timestamp
+    ).join(User, AttendanceRecord.user_id == User.id)\
+        .join(Course, AttendanceRecord.course_id == Course.id)\
+        .outerjoin(marker, AttendanceRecord.marked_by_id == marker.id)\
+        .filter(*criteria)\
+        .order_by(*order_by)
+
+
+@register_export('attendance', roles=[User.ROLE_ADMIN, User.ROLE_FACULTY])
+def attendance_export(args):
+    criteria = []
+    if args.get('course_id', type=int):
+        criteria.append(AttendanceRecord.course_id == args.get('course_id', type=int))
+    if args.get('user_id', type=int):
+        criteria.append(AttendanceRecord.user_id == args.get('user_id', type=int))
+    if args.get('start_date', type=_date_arg):
+        criteria.append(AttendanceRecord.date >= args.get('start_date', type=_date_arg))
+    if args.get('end_date', type=_date_arg):
+        criteria.append(AttendanceRecord.date <= args.get('end_date', type=_date_arg))
+    return ATTENDANCE_EXPORT_HEADER, attendance_export_query(criteria, [AttendanceRecord.date.desc(), User.username.asc()])
+
+
+@register_export('library_loans', roles=[User.ROLE_ADMIN, User.ROLE_MANAGEMENT])
+def library_loans_export(args):
+    header = ['loan_id', 'isbn', 'title', 'borrower', 'loan_date', 'due_date', 'return_date', 'status']
+    query = db.session.query(
+        LibraryLoan.id, Book.isbn, Book.title, User.username,
+        LibraryLoan.loan_date, LibraryLoan.due_date, LibraryLoan.return_date, LibraryLoan.status
+    ).join(Book, LibraryLoan.book_id == Book.id)\
+        .join(User, LibraryLoan.user_id == User.id)
+    if args.get('status'):
+        query = query.filter(LibraryLoan.status == args.get('status'))
+    if args.get('user_id', type=int):
+        query = query.filter(LibraryLoan.user_id == args.get('user_id', type=int))
+    return header, query.order_by(LibraryLoan.loan_date.desc())
+
+
+@register_export('ledger', roles=[User.ROLE_ADMIN, User.ROLE_MANAGEMENT])
+def ledger_export(args):
+    header = ['id', 'transaction_date', 'description', 'debit_account', 'credit_account', 'amount',
+              'reference_id', 'entered_by', 'is_approved']
+    debit_account = aliased(FinancialAccount)
+    credit_account = aliased(FinancialAccount)
+    query = db.session.query(
+        TransactionLedger.id, TransactionLedger.transaction_date, TransactionLedger.description,
+        debit_account.account_name, credit_account.account_name, TransactionLedger.amount,
+        TransactionLedger.reference_id, User.username, TransactionLedger.is_approved
+    ).join(debit_account, TransactionLedger.debit_account_id == debit_account.id)\
+        .join(credit_account, TransactionLedger.credit_account_id == credit_account.id)\
+        .join(User, TransactionLedger.entered_by_id == User.id)
+    if args.get('start_date', type=_date_arg):
+        query = query.filter(TransactionLedger.transaction_date >= args.get('start_date', type=_date_arg))
+    if args.get('end_date', type=_date_arg):
+        query = query.filter(TransactionLedger.transaction_date <= args.get('end_date', type=_date_arg))
+    return header, query.order_by(TransactionLedger.transaction_date, TransactionLedger.id)
+
+
+def log_export(name, args, filters):
+    """
+    Every column of a partitioned log, oldest first, from the hot table and whichever archived months
+    overlap start_date..end_date (both inclusive, both optional). `filters` maps query-string
+    arguments to the integer column they filter on.
+    """
+    start = args.get('start_date', type=_date_arg)
+    end = args.get('end_date', type=_date_arg)
+    criteria = {column: args.get(arg, type=int) for arg, column in filters.items() if args.get(arg, type=int)}
+    query = select_range(name,
+                         start=datetime.combine(start, datetime.min.time()) if start else None,
+                         end=datetime.combine(end + timedelta(days=1), datetime.min.time()) if end else None,
+                         where=lambda table: [table.c[column] == value for column, value in criteria.items()])
+    return [column.name for column in PARTITIONED[name].model.__table__.columns], query
+
+
+@register_export('access_log', roles=[User.ROLE_ADMIN, User.ROLE_MANAGEMENT]) # As /security/dashboard
+def access_log_export(args):
+    return log_export('access_log', args, {'access_point_id': 'access_point_id', 'card_id': 'rfid_card_id'})
+
+
+@register_export('audit_log', roles=[User.ROLE_ADMIN])
+def audit_log_export(args):
+    return log_export('audit_log', args, {'user_id': 'user_id'})
+
+
+@exports_bp.route('/<name>.<fmt>', methods=['GET'])
+@login_required
+def export_report(name, fmt):
+    if name not in _EXPORTS:
+        abort(404)
+    roles, build = _EXPORTS[name]
+    if current_user.role not in roles:
+        abort(403)
+    header, query = build(request.args)
+    return export_response(name, header, query, fmt)
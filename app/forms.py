@@ -74,7 +74,7 @@ class PostForm(FlaskForm):
 from wtforms.widgets import TextArea # This import is already here, ensure it stays
 # DateTimeField, HiddenField, DateField, FieldList, FormField are now imported from wtforms.fields at the top
 from wtforms_sqlalchemy.fields import QuerySelectField # For StudyGroupForm course selection
-from app.models import Course, ReportStatus # To populate QuerySelectField and for ReportStatusUpdateForm
+from app.models import Course, ReportStatus, AttendanceRecord, CourseEnrollment # To populate QuerySelectField and for ReportStatusUpdateForm
 
 class CommentForm(FlaskForm):
     content = StringField('Comment', validators=[DataRequired(), Length(min=1, max=1000)], widget=TextArea())
@@ -92,6 +92,18 @@ def get_college_courses(college_id):
     """ Helper to provide courses for a specific college to QuerySelectField. """
     return Course.query.filter_by(college_id=college_id).order_by(Course.name)
 
+def get_attended_courses(user_id):
+    """ Helper to provide only the courses a user has attendance records in to QuerySelectField. """
+    return Course.query.filter(
+        Course.id.in_(AttendanceRecord.query.with_entities(AttendanceRecord.course_id).filter_by(user_id=user_id))
+    ).order_by(Course.name)
+
+def get_course_students(course_id):
+    """ Helper to provide only the students enrolled (in any status) in a course to QuerySelectField. """
+    return User.query.join(CourseEnrollment, CourseEnrollment.user_id == User.id)\
+        .filter(CourseEnrollment.course_id == course_id)\
+        .order_by(User.username)
+
 class StudyGroupForm(FlaskForm):
     name = StringField('Group Name', validators=[DataRequired(), Length(max=100)])
     description = StringField('Description/Goals', widget=TextArea(), validators=[Length(max=5000)])
@@ -184,15 +196,16 @@ class TakeAttendanceForm(FlaskForm):
     submit = SubmitField('Submit Attendance')
 
 class ViewAttendanceForm(FlaskForm):
+    # Both filters are scoped in the route (get_attended_courses / get_course_students),
+    # so a page load never materializes every course or user in the system.
     course_id = QuerySelectField('Filter by Course (Optional)',
-                                 query_factory=lambda: Course.query.order_by(Course.name).all(),
+                                 query_factory=lambda: [], # Will be populated in the route
                                  get_label='name',
                                  allow_blank=True,
                                  blank_text='-- All Courses --',
                                  validators=[Optional()])
-    # For user_id, consider filtering by role (e.g., only students) in the route or a more specific query_factory
     user_id = QuerySelectField('Filter by Student (Optional)',
-                               query_factory=lambda: User.query.order_by(User.username).all(), 
+                               query_factory=lambda: [], # Will be populated in the route
                                get_label='username',
                                allow_blank=True,
                                blank_text='-- All Students --',
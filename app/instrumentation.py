@@ -0,0 +1,157 @@
+"""
+Per-request SQL instrumentation.
+
+Cursor execute events on every engine record each statement's time against the current request:
+query count, total DB time and statements issued more than once (the usual signature of an N+1).
+Statements slower than SQL_SLOW_QUERY_MS are logged together with the endpoint that issued them.
+Per-endpoint totals are aggregated in-process for /admin/perf, and with SQL_DEBUG_HEADERS (or in
+debug mode) each response carries X-DB-Query-Count / X-DB-Time-ms / X-DB-Duplicate-Queries.
+Views may declare a query budget with @query_budget(n); requests that exceed it are logged and recorded,
+and the test suite fails any test whose requests went over (see tests/conftest.py).
+"""
+import threading
+import time
+from collections import Counter, deque
+from functools import wraps
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SLOW_QUERY_HISTORY = 50 # Most recent slow queries kept for /admin/perf
+BUDGET_VIOLATION_HISTORY = 50
+
+
+class QueryStats:
+    """Statements executed while handling one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.statements = Counter()
+
+    def record(self, statement: str, elapsed: float) -> None:
+        self.count += 1
+        self.total_time += elapsed
+        self.statements[statement] += 1
+
+    @property
+    def duplicates(self) -> dict:
+        """Statement text -> times executed, for statements run more than once (parameters ignored)."""
+        return {statement: n for statement, n in self.statements.items() if n > 1}
+
+
+class PerfRegistry:
+    """Per-endpoint aggregates across requests, plus a short history of slow queries."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.routes = {}
+            self.slow_queries = deque(maxlen=SLOW_QUERY_HISTORY)
+            self.budget_violations = deque(maxlen=BUDGET_VIOLATION_HISTORY)
+
+    def record_request(self, endpoint: str, stats: QueryStats, duration: float) -> None:
+        with self._lock:
+            route = self.routes.setdefault(endpoint, {'requests': 0, 'queries': 0, 'max_queries': 0,
+                                                      'db_time': 0.0, 'duration': 0.0, 'duplicate_requests': 0})
+            route['requests'] += 1
+            route['queries'] += stats.count
+            route['max_queries'] = max(route['max_queries'], stats.count)
+            route['db_time'] += stats.total_time
+            route['duration'] += duration
+            if stats.duplicates:
+                route['duplicate_requests'] += 1
+
+    def record_slow_query(self, endpoint: str, statement: str, elapsed: float) -> None:
+        with self._lock:
+            self.slow_queries.appendleft({'endpoint': endpoint, 'statement': statement,
+                                          'elapsed_ms': elapsed * 1000, 'at': time.time()})
+
+    def record_budget_violation(self, endpoint: str, path: str, stats: QueryStats, budget: int) -> None:
+        with self._lock:
+            self.budget_violations.appendleft({'endpoint': endpoint, 'path': path, 'queries': stats.count,
+                                               'budget': budget, 'duplicates': stats.duplicates, 'at': time.time()})
+
+    def summary(self) -> list:
+        """Per-endpoint rows with averages, heaviest (by average query count) first."""
+        with self._lock:
+            rows = [dict(route, endpoint=endpoint,
+                         avg_queries=route['queries'] / route['requests'],
+                         avg_db_ms=route['db_time'] * 1000 / route['requests'],
+                         avg_duration_ms=route['duration'] * 1000 / route['requests'])
+                    for endpoint, route in self.routes.items()]
+        return sorted(rows, key=lambda row: row['avg_queries'], reverse=True)
+
+
+perf_registry = PerfRegistry()
+
+
+def query_budget(max_queries: int):
+    """
+    Declares the most SQL statements one request to the view may issue, counting the current user's
+    load and everything the template triggers. Put it below @app.route; the other decorators in this
+    app use functools.wraps, which carries the budget up to the registered view function.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            return view(*args, **kwargs)
+        wrapped.query_budget = max_queries
+        return wrapped
+    return decorator
+
+
+def current_query_stats():
+    """The QueryStats for the request being handled, or None outside a request."""
+    if not has_request_context():
+        return None
+    if '_query_stats' not in g:
+        g._query_stats = QueryStats()
+    return g._query_stats
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # On the execution context, not conn.info: a statement that raises never reaches after_cursor_execute,
+    # and anything left on the pooled connection would outlive it.
+    context._query_start_time = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_start_time
+    stats = current_query_stats()
+    if stats is None:
+        return
+    stats.record(statement, elapsed)
+    if elapsed * 1000 >= current_app.config.get('SQL_SLOW_QUERY_MS', 200):
+        endpoint = request.endpoint or request.path
+        current_app.logger.warning(f"Slow query ({elapsed * 1000:.1f} ms) in {endpoint}: {statement}")
+        perf_registry.record_slow_query(endpoint, statement, elapsed)
+
+
+def init_instrumentation(app) -> None:
+    @app.before_request
+    def _start_request_timer():
+        # Reset explicitly: g belongs to the app context, which spans several requests if one was pushed first (tests)
+        g._query_stats = QueryStats()
+        g.pop('query_budget_extra', None)
+        g._request_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        stats = current_query_stats()
+        started = g.pop('_request_started', None)
+        if started is not None and request.endpoint:
+            perf_registry.record_request(request.endpoint, stats, time.perf_counter() - started)
+        budget = getattr(app.view_functions.get(request.endpoint), 'query_budget', None)
+        if budget is not None and stats.count > budget + g.get('query_budget_extra', 0):
+            app.logger.warning(f"{request.endpoint} issued {stats.count} queries, over its budget of {budget}: {request.path}")
+            perf_registry.record_budget_violation(request.endpoint, request.path, stats, budget)
+        if app.debug or app.config.get('SQL_DEBUG_HEADERS'):
+            response.headers['X-DB-Query-Count'] = str(stats.count)
+            response.headers['X-DB-Time-ms'] = f'{stats.total_time * 1000:.1f}'
+            response.headers['X-DB-Duplicate-Queries'] = str(sum(n - 1 for n in stats.duplicates.values()))
+        return response
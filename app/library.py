@@ -0,0 +1,367 @@
+"""
+Library circulation: atomic checkout and return, reservation handoff, and scanner-station batches.
+
+Book.available_copies counts copies on the shelf that nobody holds. It only ever changes through
+conditional UPDATEs, so the check and the change are one statement and two checkouts of the last
+copy can't both succeed:
+
+* checkout: UPDATE book SET available_copies = available_copies - 1 WHERE id = ? AND available_copies > 0.
+  No row updated means no copy. A patron whose reservation is 'available' takes their held copy
+  instead, without touching the counter.
+* return: the loan is closed with UPDATE ... WHERE status IN ('active', 'overdue'), so a copy can't be
+  returned twice. The copy then goes to the oldest pending reservation (claimed with a conditional
+  UPDATE of its status, so two returns can't hand over to the same patron), who is notified;
+  only when nobody is waiting does available_copies go up, capped at total_copies.
+
+Each step of an item is checked before anything of it is written, so in a batch a failed item leaves
+nothing behind while the others still go through, and the whole batch commits once.
+
+`flask library-overdue`, run nightly, is the set-based counterpart for overdue loans and their fines;
+see sweep_overdue().
+"""
+import json
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal
+import click
+from flask import Blueprint, abort, current_app, jsonify, request
+from flask.cli import with_appcontext
+from flask_login import current_user, login_required
+from sqlalchemy import Integer, Numeric, and_, case, cast, exists, func, insert, literal, or_, select, update
+from app import db
+from app.models import User, Book, BookReservation, Fine, LibraryLoan, Notification
+from app.utils import send_notification
+
+library_bp = Blueprint('library', __name__)
+
+OPEN_LOAN_STATUSES = ('active', 'overdue')
+
+ItemResult = namedtuple('ItemResult', 'book_id loan_id error')
+
+
+class CirculationError(Exception):
+    """A checkout or return that can't be done; nothing of it was written."""
+
+
+def _open_loan_exists(user_id, book_id) -> bool:
+    return db.session.query(LibraryLoan.id).filter(LibraryLoan.user_id == user_id, LibraryLoan.book_id == book_id,
+                                                   LibraryLoan.status.in_(OPEN_LOAN_STATUSES)).first() is not None
+
+
+def _checkout(book_id, user_id, now, loan_days) -> LibraryLoan:
+    if _open_loan_exists(user_id, book_id):
+        raise CirculationError('The patron already has this book on loan')
+    reservations = BookReservation.__table__.c
+    held = db.session.execute(
+        update(BookReservation.__table__)
+        .where(reservations.book_id == book_id, reservations.user_id == user_id, reservations.status == 'available')
+        .values(status='fulfilled', fulfilled_date=now)).rowcount
+    if not held:
+        taken = db.session.execute(
+            update(Book.__table__).where(Book.id == book_id, Book.available_copies > 0)
+            .values(available_copies=Book.available_copies - 1)).rowcount
+        if not taken:
+            raise CirculationError('No copy of this book is available')
+        # A pending reservation of the patron's own is fulfilled by this loan too
+        db.session.execute(
+            update(BookReservation.__table__)
+            .where(reservations.book_id == book_id, reservations.user_id == user_id, reservations.status == 'pending')
+            .values(status='fulfilled', fulfilled_date=now))
+    loan = LibraryLoan(book_id=book_id, user_id=user_id, loan_date=now, due_date=now + timedelta(days=loan_days))
+    db.session.add(loan)
+    db.session.flush()
+    return loan
+
+
+def _hand_over(book_id, now, hold_days):
+    """Holds a returned copy for the oldest pending reservation; returns it, or None if nobody is waiting."""
+    reservations = BookReservation.__table__.c
+    while True:
+        candidate = db.session.execute(
+            select(reservations.id, reservations.user_id)
+            .where(reservations.book_id == book_id, reservations.status == 'pending')
+            .order_by(reservations.reservation_date, reservations.id).limit(1)).first()
+        if candidate is None:
+            return None
+        claimed = db.session.execute(
+            update(BookReservation.__table__).where(reservations.id == candidate.id, reservations.status == 'pending')
+            .values(status='available', notification_sent=True, expiry_date=now + timedelta(days=hold_days))).rowcount
+        if claimed: # Otherwise a concurrent return got this reservation first; try the next one
+            send_notification(candidate.user_id, 'book_reservation_available',
+                              {'book_id': book_id, 'reservation_id': candidate.id,
+                               'hold_until': (now + timedelta(days=hold_days)).isoformat()})
+            return candidate.id
+
+
+def _release_copy(book_id, now, hold_days):
+    """A copy came back (or a hold lapsed): hand it to the next reservation or put it on the shelf."""
+    reservation_id = _hand_over(book_id, now, hold_days)
+    if reservation_id is None:
+        db.session.execute(update(Book.__table__).where(Book.id == book_id, Book.available_copies < Book.total_copies)
+                           .values(available_copies=Book.available_copies + 1))
+    return reservation_id
+
+
+def _return(loan_id, now, hold_days):
+    loans = LibraryLoan.__table__.c
+    book_id = db.session.execute(select(loans.book_id).where(loans.id == loan_id)).scalar()
+    closed = db.session.execute(
+        update(LibraryLoan.__table__).where(loans.id == loan_id, loans.status.in_(OPEN_LOAN_STATUSES))
+        .values(status='returned', return_date=now)).rowcount
+    if not closed:
+        raise CirculationError('This loan is not open')
+    return book_id, _release_copy(book_id, now, hold_days)
+
+
+def _settings(now):
+    config = current_app.config
+    return now or datetime.utcnow(), config.get('LIBRARY_LOAN_DAYS', 14), config.get('LIBRARY_HOLD_DAYS', 3)
+
+
+def checkout(book_id, user_id, now=None) -> LibraryLoan:
+    """Lends a copy of `book_id` to `user_id` and commits. Raises CirculationError."""
+    now, loan_days, _ = _settings(now)
+    try:
+        loan = _checkout(book_id, user_id, now, loan_days)
+    except CirculationError:
+        db.session.rollback()
+        raise
+    db.session.commit()
+    return loan
+
+
+def return_loan(loan_id, now=None):
+    """
+    Closes the loan and commits; the copy goes to the next reservation, if any. Returns the id of the
+    reservation now holding the copy, or None. Raises CirculationError if the loan isn't open.
+    """
+    now, _, hold_days = _settings(now)
+    try:
+        _, reservation_id = _return(loan_id, now, hold_days)
+    except CirculationError:
+        db.session.rollback()
+        raise
+    db.session.commit()
+    return reservation_id
+
+
+def checkout_batch(user_id, book_ids, now=None) -> list:
+    """Checks out each book to the patron in one transaction; one ItemResult per book, in order."""
+    now, loan_days, _ = _settings(now)
+    results = []
+    for book_id in book_ids:
+        try:
+            results.append(ItemResult(book_id, _checkout(book_id, user_id, now, loan_days).id, None))
+        except CirculationError as exc:
+            results.append(ItemResult(book_id, None, str(exc)))
+    db.session.commit()
+    return results
+
+
+def return_batch(user_id, book_ids, now=None) -> list:
+    """Returns the patron's oldest open loan of each book in one transaction; one ItemResult per book."""
+    now, _, hold_days = _settings(now)
+    results = []
+    for book_id in book_ids:
+        loan_id = db.session.query(LibraryLoan.id).filter(
+            LibraryLoan.user_id == user_id, LibraryLoan.book_id == book_id, LibraryLoan.status.in_(OPEN_LOAN_STATUSES))\
+            .order_by(LibraryLoan.loan_date, LibraryLoan.id).limit(1).scalar()
+        if loan_id is None:
+            results.append(ItemResult(book_id, None, 'The patron has no open loan of this book'))
+            continue
+        try:
+            _return(loan_id, now, hold_days)
+            results.append(ItemResult(book_id, loan_id, None))
+        except CirculationError as exc: # Returned by another station in the meantime
+            results.append(ItemResult(book_id, loan_id, str(exc)))
+    db.session.commit()
+    return results
+
+
+def expire_holds(now=None) -> int:
+    """Lapses 'available' reservations past their expiry and passes each copy on. Returns how many lapsed."""
+    now, _, hold_days = _settings(now)
+    reservations = BookReservation.__table__.c
+    lapsed = db.session.execute(select(reservations.id, reservations.book_id)
+                                .where(reservations.status == 'available', reservations.expiry_date < now)).all()
+    count = 0
+    for reservation_id, book_id in lapsed:
+        expired = db.session.execute(
+            update(BookReservation.__table__).where(reservations.id == reservation_id, reservations.status == 'available')
+            .values(status='expired')).rowcount
+        if expired: # Not collected in the meantime
+            _release_copy(book_id, now, hold_days)
+            count += 1
+    db.session.commit()
+    return count
+
+
+# -------------------------- Scanner Station API --------------------------
+
+def _station_request():
+    """(patron, book ids by ISBN, isbns) from {"user_id": .., "isbns": [..]}; aborts on a bad request."""
+    if current_user.role not in (User.ROLE_ADMIN, User.ROLE_MANAGEMENT):
+        abort(403)
+    data = request.get_json(silent=True) or {}
+    isbns = data.get('isbns')
+    if not isinstance(isbns, list) or not isbns or not all(isinstance(isbn, str) for isbn in isbns):
+        abort(400)
+    if len(isbns) > current_app.config.get('LIBRARY_MAX_BATCH', 50):
+        abort(413)
+    patron = db.session.get(User, data.get('user_id')) if isinstance(data.get('user_id'), int) else None
+    if patron is None:
+        abort(404)
+    book_ids = dict(db.session.query(Book.isbn, Book.id).filter(Book.isbn.in_(isbns)))
+    return patron, book_ids, isbns
+
+
+def _station_response(isbns, book_ids, results):
+    by_book = iter(results)
+    items = []
+    for isbn in isbns:
+        if isbn not in book_ids:
+            items.append({'isbn': isbn, 'loan_id': None, 'ok': False, 'error': 'Unknown ISBN'})
+            continue
+        result = next(by_book)
+        items.append({'isbn': isbn, 'loan_id': result.loan_id, 'ok': result.error is None, 'error': result.error})
+    return jsonify({'items': items, 'succeeded': sum(1 for item in items if item['ok'])})
+
+
+@library_bp.route('/circulation/checkout', methods=['POST'])
+@login_required
+def station_checkout():
+    """Body: {"user_id": 42, "isbns": ["978...", ...]}. Items are reported individually, in order."""
+    patron, book_ids, isbns = _station_request()
+    results = checkout_batch(patron.id, [book_ids[isbn] for isbn in isbns if isbn in book_ids])
+    return _station_response(isbns, book_ids, results)
+
+
+@library_bp.route('/circulation/return', methods=['POST'])
+@login_required
+def station_return():
+    """Body: {"user_id": 42, "isbns": ["978...", ...]}. Items are reported individually, in order."""
+    patron, book_ids, isbns = _station_request()
+    results = return_batch(patron.id, [book_ids[isbn] for isbn in isbns if isbn in book_ids])
+    return _station_response(isbns, book_ids, results)
+
+
+# -------------------------- Nightly Overdue Sweep --------------------------
+
+OVERDUE_FINE_REASON = 'Overdue'
+DIGEST_NOTIFICATION = 'library_overdue_digest'
+RETURNED_LOOKBACK = timedelta(days=7) # Late returns whose fine is still settled by the sweep
+
+OverdueReport = namedtuple('OverdueReport', 'marked fines_created fines_updated digests holds_expired chunks timings')
+
+
+def _whole_days(end, start):
+    """Whole days from `start` to `end`, in SQL."""
+    if db.engine.dialect.name == 'postgresql':
+        return func.floor(func.extract('epoch', end - start) / 86400)
+    return cast(func.julianday(end) - func.julianday(start), Integer)
+
+
+def _fine_amount(loans, now, per_day, cap):
+    """Fine for a loan: per_day for each whole day past due until its return (or now), capped."""
+    days = _whole_days(func.coalesce(loans.c.return_date, now), loans.c.due_date)
+    amount = days * literal(per_day, Numeric(10, 2))
+    return case((amount > cap, literal(cap, Numeric(10, 2))), else_=amount)
+
+
+def sweep_overdue(now=None, chunk_size=None, log=None) -> OverdueReport:
+    """
+    Marks loans past due as overdue and creates or updates one unpaid 'Overdue' Fine per loan, with
+    set-based UPDATE and INSERT ... SELECT statements over chunks of loan ids, one commit per chunk.
+    Loans returned late within the last week are included, so their fine ends at the return date.
+    Then queues one digest notification per patron with overdue loans (at most one per day) and
+    lapses expired holds. Rerunning it the same day changes nothing.
+    """
+    config = current_app.config
+    now = now or datetime.utcnow()
+    chunk_size = chunk_size or config.get('LIBRARY_OVERDUE_CHUNK', 5000)
+    per_day = Decimal(str(config.get('LIBRARY_FINE_PER_DAY', '0.50')))
+    cap = Decimal(str(config.get('LIBRARY_FINE_CAP', '20.00')))
+    loans, fines = LibraryLoan.__table__, Fine.__table__
+    now_param = literal(now, db.DateTime)
+    finable = or_(and_(loans.c.status.in_(OPEN_LOAN_STATUSES), loans.c.due_date < now_param),
+                  and_(loans.c.status == 'returned', loans.c.return_date > loans.c.due_date,
+                       loans.c.return_date >= now - RETURNED_LOOKBACK))
+    open_fine = and_(fines.c.loan_id == loans.c.id, fines.c.reason == OVERDUE_FINE_REASON)
+    amount = _fine_amount(loans, now_param, per_day, cap)
+    timings, counts = {}, {'marked': 0, 'created': 0, 'updated': 0, 'chunks': 0}
+
+    started = time.perf_counter()
+    first_id, last_id = db.session.execute(select(func.min(loans.c.id), func.max(loans.c.id)).where(finable)).one()
+    for low in range(first_id or 0, (last_id or -1) + 1, chunk_size):
+        in_chunk = and_(loans.c.id >= low, loans.c.id < low + chunk_size)
+        counts['marked'] += db.session.execute(
+            update(loans).where(in_chunk, loans.c.status == 'active', loans.c.due_date < now_param)
+            .values(status='overdue')).rowcount
+        counts['updated'] += db.session.execute(
+            update(fines).where(fines.c.reason == OVERDUE_FINE_REASON, fines.c.paid_status == 'unpaid',
+                                fines.c.loan_id.in_(select(loans.c.id).where(in_chunk, finable)))
+            .values(amount=select(amount).where(loans.c.id == fines.c.loan_id).scalar_subquery())
+            .where(fines.c.amount != select(amount).where(loans.c.id == fines.c.loan_id).scalar_subquery())).rowcount
+        counts['created'] += db.session.execute(
+            insert(fines).from_select(
+                ['loan_id', 'book_id', 'user_id', 'amount', 'reason', 'issued_date', 'paid_status', 'timestamp'],
+                select(loans.c.id, loans.c.book_id, loans.c.user_id, amount, literal(OVERDUE_FINE_REASON),
+                       now_param, literal('unpaid'), now_param)
+                .where(in_chunk, finable, amount > 0, ~exists().where(open_fine)))).rowcount
+        db.session.commit()
+        counts['chunks'] += 1
+    timings['fines'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    digests = queue_overdue_digests(now)
+    timings['digests'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    holds_expired = expire_holds(now)
+    timings['holds'] = time.perf_counter() - started
+
+    report = OverdueReport(counts['marked'], counts['created'], counts['updated'], digests, holds_expired,
+                           counts['chunks'], timings)
+    if log:
+        log(report)
+    return report
+
+
+def queue_overdue_digests(now) -> int:
+    """One notification per patron with overdue loans, listing them; skips patrons already sent one today."""
+    loans, fines, notifications = LibraryLoan.__table__, Fine.__table__, Notification.__table__
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    owed = select(func.coalesce(func.sum(fines.c.amount), 0)).where(
+        fines.c.loan_id == loans.c.id, fines.c.reason == OVERDUE_FINE_REASON, fines.c.paid_status == 'unpaid')\
+        .scalar_subquery()
+    already_sent = select(notifications.c.user_id).where(notifications.c.timestamp >= day_start, # Uncorrelated: runs once
+                                                         notifications.c.name == DIGEST_NOTIFICATION)
+    rows = db.session.execute(
+        select(loans.c.user_id, loans.c.id, loans.c.book_id, loans.c.due_date, owed)
+        .where(loans.c.status == 'overdue', loans.c.user_id.notin_(already_sent)).order_by(loans.c.user_id, loans.c.due_date)).all()
+    digests = {}
+    for user_id, loan_id, book_id, due_date, amount in rows:
+        digest = digests.setdefault(user_id, {'loans': [], 'total_fines': Decimal('0')})
+        digest['loans'].append({'loan_id': loan_id, 'book_id': book_id, 'due_date': due_date.isoformat(),
+                                'fine': str(Decimal(str(amount)).quantize(Decimal('0.01')))})
+        digest['total_fines'] += Decimal(str(amount))
+    if digests:
+        db.session.execute(insert(notifications), [
+            {'user_id': user_id, 'name': DIGEST_NOTIFICATION, 'timestamp': now, 'is_read': False,
+             'payload_json': json.dumps({'overdue_loans': digest['loans'],
+                                         'total_fines': str(digest['total_fines'].quantize(Decimal('0.01')))})}
+            for user_id, digest in digests.items()])
+    db.session.commit()
+    return len(digests)
+
+
+@click.command('library-overdue')
+@click.option('--chunk-size', type=int, default=None, help='Loans per transaction (default LIBRARY_OVERDUE_CHUNK)')
+@with_appcontext
+def library_overdue_command(chunk_size):
+    """Nightly: marks overdue loans, updates their fines, queues digests and lapses expired holds."""
+    report = sweep_overdue(chunk_size=chunk_size)
+    click.echo(f'Marked {report.marked} loans overdue; fines created {report.fines_created}, updated {report.fines_updated} '
+               f'({report.chunks} chunks); {report.digests} digests queued; {report.holds_expired} holds expired')
+    click.echo('Timings: ' + ', '.join(f'{phase} {seconds:.2f}s' for phase, seconds in report.timings.items()))
@@ -0,0 +1,287 @@
+"""
+In-process metrics registry exposed at /metrics in the Prometheus text format.
+
+Counters, gauges and histograms are plain in-memory structures. Under Gunicorn each worker has its own
+copy, so when METRICS_MULTIPROC_DIR is set every worker also writes a snapshot of its values to
+<dir>/metrics_<pid>.json (at most every METRICS_FLUSH_SECONDS, and at exit). A scrape, served by any
+one worker, merges all snapshots: counters and histograms are summed; gauges are summed over live
+workers only. Call mark_process_dead(pid) from Gunicorn's child_exit hook so a dead worker's gauges
+stop counting while its counters are kept. The directory should be emptied when the master starts.
+"""
+import atexit
+import glob
+import json
+import math
+import os
+import threading
+import time
+from flask import Blueprint, Response, abort, current_app, g, request
+
+metrics_bp = Blueprint('metrics', __name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metric:
+    type_name = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {} # label values tuple -> value
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self) -> list:
+        """[[label values, value], ...] in a JSON-friendly shape."""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if amount < 0:
+            raise ValueError('Counters can only increase')
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                state = self._values[key] = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            state['buckets'][index] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(key), {'buckets': list(state['buckets']), 'sum': state['sum'], 'count': state['count']}]
+                    for key, state in self._values.items()]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f'Metric {metric.name} already registered with a different type or labels')
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> dict:
+        return {name: {'type': metric.type_name, 'help': metric.documentation, 'labelnames': list(metric.labelnames),
+                       'buckets': list(getattr(metric, 'buckets', ())), 'values': metric.snapshot()}
+                for name, metric in list(self._metrics.items())}
+
+    def reset(self) -> None:
+        for metric in list(self._metrics.values()):
+            metric.reset()
+
+
+registry = MetricsRegistry()
+
+# -------------------------- Application Metrics --------------------------
+
+http_requests = registry.counter('http_requests_total', 'HTTP requests handled.', ('endpoint', 'method', 'status'))
+http_request_duration = registry.histogram('http_request_duration_seconds', 'Request latency.', ('endpoint', 'method'))
+db_queries_per_request = registry.histogram('db_queries_per_request', 'SQL statements issued per request.', ('endpoint',),
+                                            buckets=(1, 2, 5, 10, 20, 50, 100, 200))
+cache_requests = registry.counter('cache_requests_total', 'Cache lookups by cache and result.', ('cache', 'result'))
+chatbot_llm_duration = registry.histogram('chatbot_llm_duration_seconds', 'Gemini call latency, retries included.',
+                                          ('kind', 'outcome'), buckets=(0.25, 0.5, 1, 2, 4, 8, 16, 32, 64))
+chatbot_llm_retries = registry.counter('chatbot_llm_retries_total', 'Gemini calls retried after a transient error.', ('kind',))
+chatbot_llm_errors = registry.counter('chatbot_llm_errors_total', 'Gemini calls that failed for good, by exception type.',
+                                      ('kind', 'error'))
+chatbot_streams_in_flight = registry.gauge('chatbot_streams_in_flight', 'Chatbot SSE streams currently open.')
+notification_fanout = registry.histogram('notification_fanout', 'Notifications created by a single request.', ('endpoint',),
+                                         buckets=(1, 2, 5, 10, 25, 50, 100, 250, 1000))
+
+
+def count_notification() -> None:
+    """Called for each notification created; the per-request total is observed as notification_fanout."""
+    g._notifications_created = g.get('_notifications_created', 0) + 1
+
+
+# -------------------------- Multi-process Snapshots --------------------------
+
+_last_flush = 0.0
+
+def _snapshot_path(directory: str, pid: int) -> str:
+    return os.path.join(directory, f'metrics_{pid}.json')
+
+def flush(directory: str) -> None:
+    """Atomically writes this process's snapshot so other workers can merge it."""
+    global _last_flush
+    path = _snapshot_path(directory, os.getpid())
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'pid': os.getpid(), 'live': True, 'metrics': registry.snapshot()}, f)
+    os.replace(tmp_path, path)
+    _last_flush = time.monotonic()
+
+def mark_process_dead(pid: int, directory: str = None) -> None:
+    """Gunicorn child_exit hook helper: keeps the dead worker's counters, drops its gauges."""
+    directory = directory or os.environ.get('METRICS_MULTIPROC_DIR')
+    path = _snapshot_path(directory, pid) if directory else None
+    if not path or not os.path.exists(path):
+        return
+    with open(path) as f:
+        data = json.load(f)
+    data['live'] = False
+    for metric in data['metrics'].values():
+        if metric['type'] == 'gauge':
+            metric['values'] = []
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(f'{path}.tmp', path)
+
+def collect(directory: str = None) -> dict:
+    """This process's metrics, merged with every other worker's snapshot when `directory` is set."""
+    if not directory:
+        return registry.snapshot()
+    flush(directory)
+    merged = {}
+    for path in glob.glob(os.path.join(directory, 'metrics_*.json')):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue # A worker is mid-write or the file vanished; it will be in the next scrape
+        for name, metric in data['metrics'].items():
+            target = merged.setdefault(name, dict(metric, values={}))
+            for labels, value in metric['values']:
+                key = tuple(labels)
+                if metric['type'] == 'histogram':
+                    current = target['values'].setdefault(key, {'buckets': [0] * len(value['buckets']), 'sum': 0.0, 'count': 0})
+                    current['buckets'] = [a + b for a, b in zip(current['buckets'], value['buckets'])]
+                    current['sum'] += value['sum']
+                    current['count'] += value['count']
+                else:
+                    target['values'][key] = target['values'].get(key, 0) + value
+    for metric in merged.values():
+        metric['values'] = [[list(key), value] for key, value in metric['values'].items()]
+    return merged
+
+
+# -------------------------- Text Exposition --------------------------
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+def render_text(metrics: dict) -> str:
+    lines = []
+    for name in sorted(metrics):
+        metric = metrics[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for labels, value in sorted(metric['values']):
+            if metric['type'] == 'histogram':
+                cumulative = 0
+                for bound, count in zip(list(metric['buckets']) + [math.inf], value['buckets']):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(metric['labelnames'], labels, [('le', _number(bound))])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(metric['labelnames'], labels)} {_number(value['sum'])}")
+                lines.append(f"{name}_count{_labels(metric['labelnames'], labels)} {value['count']}")
+            else:
+                lines.append(f"{name}{_labels(metric['labelnames'], labels)} {_number(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+@metrics_bp.route('/metrics')
+def metrics_endpoint():
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(403)
+    body = render_text(collect(current_app.config.get('METRICS_MULTIPROC_DIR')))
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def init_metrics(app) -> None:
+    directory = app.config.get('METRICS_MULTIPROC_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        atexit.register(flush, directory)
+
+    @app.before_request
+    def _start_metrics_timer():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request_metrics(response):
+        from app.instrumentation import current_query_stats
+        started = g.pop('_metrics_started', None)
+        endpoint = request.endpoint or 'unmatched' # Never label by raw path, which would be unbounded
+        if started is not None and endpoint != 'metrics.metrics_endpoint':
+            http_requests.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+            http_request_duration.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+            db_queries_per_request.observe(current_query_stats().count, endpoint=endpoint)
+            if g.get('_notifications_created'):
+                notification_fanout.observe(g._notifications_created, endpoint=endpoint)
+        if directory and time.monotonic() - _last_flush >= app.config.get('METRICS_FLUSH_SECONDS', 5):
+            flush(directory)
+        return response
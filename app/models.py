@@ -2,6 +2,8 @@ from datetime import datetime
 from app import db, login_manager
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects.postgresql import ExcludeConstraint
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -131,7 +133,7 @@ class Vote(db.Model):
 
 class Course(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False, index=True) # Indexed for ordering and prefix lookups
     course_code = db.Column(db.String(20), nullable=False)
     description = db.Column(db.Text)
     instructor = db.Column(db.String(100)) # Simple text field for instructor name
@@ -499,12 +501,23 @@ class ResourceBooking(db.Model):
 
     __table_args__ = (
         db.CheckConstraint('end_time > start_time', name='chk_booking_end_time_after_start_time'),
+        # Overlap checks and availability sweeps filter on resource_id and range-scan start_time (see app/bookings.py)
+        db.Index('ix_resource_booking_resource_time', 'resource_id', 'start_time', 'end_time'),
+        # On PostgreSQL the database itself rejects overlapping active bookings for a resource; needs btree_gist
+        ExcludeConstraint(
+            (resource_id, '='), (db.func.tsrange(start_time, end_time, '[)'), '&&'),
+            name='excl_booking_resource_overlap', using='gist', where="status <> 'cancelled'"
+        ).ddl_if(dialect='postgresql'),
     )
 
     def __repr__(self):
         return f'<ResourceBooking {self.id} for Resource {self.resource_id} by User {self.user_id} from {self.start_time} to {self.end_time}>'
 
 
+event.listen(ResourceBooking.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS btree_gist').execute_if(dialect='postgresql'))
+
+
 # --- Hackathon Model ---
 
 class Hackathon(db.Model):
@@ -584,6 +597,8 @@ class AccessPoint(db.Model):
     location_description = db.Column(db.Text, nullable=True)
     reader_id = db.Column(db.String(100), unique=True, nullable=False, index=True)
     is_active = db.Column(db.Boolean, nullable=False, default=True, index=True)
+    latitude = db.Column(db.Float, nullable=True) # Reader position, for impossible-travel detection (app/anomaly.py)
+    longitude = db.Column(db.Float, nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
     # If linking to a specific college (optional, but good for multi-tenant systems)
@@ -608,10 +623,27 @@ class AccessLog(db.Model):
     rfid_card = db.relationship('RFIDCard', backref=db.backref('access_logs', lazy='dynamic'))
     access_point = db.relationship('AccessPoint', backref=db.backref('access_logs', lazy='dynamic'))
 
+    # Old rows move to monthly partitions (app/partitioning.py); ids must never be reused, even if this table empties
+    __table_args__ = {'sqlite_autoincrement': True}
+
     def __repr__(self):
         return f'<AccessLog {self.id} - Card {self.rfid_card_id} at AP {self.access_point_id} on {self.access_datetime} - Granted: {self.access_granted}>'
 
 
+# --- CacheVersion Model ---
+# Change counters for in-process caches (e.g. the RFID access directory in app/rfid.py). Writers bump
+# the counter in the same transaction as their change; each worker compares it with the version of
+# its copy to notice that the copy is stale.
+
+class CacheVersion(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<CacheVersion {self.name} v{self.version}>'
+
+
 # --- SecurityCamera Model ---
 
 class SecurityCamera(db.Model):
@@ -678,6 +710,30 @@ class SecurityPatrolLog(db.Model):
         return f'<SecurityPatrolLog {self.id} by Guard {self.guard_id} at {self.log_datetime} - Type: {self.entry_type}>'
 
 
+# --- Security Dashboard Rollups ---
+# Maintained incrementally by app/security_dashboard.py as scans, patrols and incidents are written,
+# so the dashboard never reads the raw log tables.
+
+class SecurityRollup(db.Model):
+    resolution = db.Column(db.String(10), primary_key=True) # 'minute' or 'hour'
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    metric = db.Column(db.String(30), primary_key=True) # 'scan_granted', 'scan_denied', 'patrol', 'incident'
+    key = db.Column(db.String(100), primary_key=True) # Access point id, or severity for incidents
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<SecurityRollup {self.resolution} {self.bucket_start} {self.metric}[{self.key}] = {self.count}>'
+
+
+class IncidentTally(db.Model):
+    status = db.Column(db.String(50), primary_key=True)
+    severity = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<IncidentTally {self.status}/{self.severity} = {self.count}>'
+
+
 # --- BookCategory Model ---
 
 class BookCategory(db.Model):
@@ -902,6 +958,8 @@ class AuditLog(db.Model):
 
     user = db.relationship('User', backref=db.backref('audit_logs', lazy='dynamic'))
 
+    __table_args__ = {'sqlite_autoincrement': True} # See AccessLog
+
     def __repr__(self):
         return f'<AuditLog {self.id} - User {self.user_id} performed {self.action_type} on {self.target_entity}:{self.target_id} at {self.action_datetime}>'
 
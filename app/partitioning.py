@@ -0,0 +1,261 @@
+"""
+Monthly partitions, time-range routing, archiving and retention for the append-only logs.
+
+access_log and audit_log stay the tables the app writes to, and hold only the hot window: the
+current month and the LOG_HOT_MONTHS - 1 before it. `flask logs-maintain` (run it daily from cron)
+moves older rows, a month at a time, into monthly partitions:
+
+* PostgreSQL: native range partitions <table>_YYYY_MM of a <table>_archive parent partitioned on
+  the log's time column, so range queries on the parent are pruned to the months they touch.
+* Other backends (SQLite): plain sharded tables <table>_YYYY_MM with the same columns.
+
+Neither kind of partition is in db.metadata, so create_all() never creates them, and they carry no
+foreign keys, so cards and users can still be deleted once their history is archived. select_range()
+routes a time-bounded query to the hot table plus only the partitions that overlap the range; ranges
+inside the hot window never look at a partition. The security rollup rebuild and the access_log and
+audit_log exports read through it. Partitions older than LOG_RETENTION_MONTHS are
+written to LOG_ARCHIVE_DIR as CSV.gz (or Parquet, when pyarrow is installed) and dropped.
+"""
+import csv
+import gzip
+import os
+import re
+from collections import namedtuple
+from datetime import date, datetime
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import Column, Index, MetaData, PrimaryKeyConstraint, Table, delete, func, insert, literal_column, select, union_all
+from sqlalchemy import inspect as sa_inspect
+from app import db
+from app.models import AccessLog, AuditLog
+from app.security_dashboard import prune_minute_rollups
+
+PartitionSpec = namedtuple('PartitionSpec', 'model time_column')
+
+PARTITIONED = {
+    'access_log': PartitionSpec(AccessLog, 'access_datetime'),
+    'audit_log': PartitionSpec(AuditLog, 'action_datetime'),
+}
+
+ARCHIVE_FORMATS = ('csv.gz', 'parquet')
+ARCHIVE_BATCH_SIZE = 5000
+
+_partition_metadata = MetaData()
+
+
+def month_start(value) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def hot_cutoff(hot_months: int, now: datetime = None) -> datetime:
+    """Rows at or after this time stay in the hot table."""
+    return add_months(month_start(now or datetime.utcnow()), -(max(hot_months, 1) - 1))
+
+
+def partition_name(name: str, month: datetime) -> str:
+    return f'{name}_{month:%Y_%m}'
+
+
+def _native():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def _table(table_name: str, name: str, primary_key) -> Table:
+    """A copy of the log's columns (without foreign keys) under `table_name`."""
+    if table_name in _partition_metadata.tables:
+        return _partition_metadata.tables[table_name]
+    spec = PARTITIONED[name]
+    columns = [Column(column.name, column.type, nullable=column.nullable) for column in spec.model.__table__.columns]
+    kwargs = {'postgresql_partition_by': f'RANGE ({spec.time_column})'} if table_name.endswith('_archive') else {}
+    return Table(table_name, _partition_metadata, *columns, PrimaryKeyConstraint(*primary_key),
+                 Index(f'ix_{table_name}_{spec.time_column}', spec.time_column), **kwargs)
+
+
+def archive_parent(name: str) -> Table:
+    """PostgreSQL only: the partitioned parent. Its primary key has to include the partition column."""
+    return _table(f'{name}_archive', name, ('id', PARTITIONED[name].time_column))
+
+
+def partition_table(name: str, month: datetime) -> Table:
+    key = ('id', PARTITIONED[name].time_column) if _native() else ('id',)
+    return _table(partition_name(name, month), name, key)
+
+
+def list_partitions(name: str) -> list:
+    """Months that have a partition, oldest first."""
+    pattern = re.compile(rf'^{re.escape(name)}_(\d{{4}})_(\d{{2}})$')
+    months = []
+    for table_name in sa_inspect(db.session.connection()).get_table_names():
+        match = pattern.match(table_name)
+        if match:
+            months.append(datetime(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+def ensure_partition(connection, name: str, month: datetime) -> Table:
+    """Creates the month's partition if needed; returns the table to insert the month's rows into."""
+    if _native():
+        parent = archive_parent(name)
+        parent.create(connection, checkfirst=True)
+        connection.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(name, month)} PARTITION OF {parent.name} "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')")
+        return parent
+    table = partition_table(name, month)
+    table.create(connection, checkfirst=True)
+    return table
+
+
+# -------------------------- Query Routing --------------------------
+
+def select_range(name: str, start: datetime = None, end: datetime = None, where=None, hot_months: int = None):
+    """
+    SELECT of every column of the log's rows with start <= time < end, ordered by time, from the hot
+    table and the partitions overlapping the range; a bound left as None is open. `where`, if given,
+    is called with each table and returns extra criteria for it, e.g. lambda t: [t.c.access_point_id == 3].
+    Anything reading these logs should go through here, or it silently misses the archived months.
+    """
+    spec = PARTITIONED[name]
+    hot = spec.model.__table__
+
+    def branch(table):
+        time_column = table.c[spec.time_column]
+        criteria = list(where(table) if where else [])
+        if start is not None:
+            criteria.append(time_column >= start)
+        if end is not None:
+            criteria.append(time_column < end)
+        return select(*(table.c[column.name] for column in hot.columns)).where(*criteria)
+
+    branches = [branch(hot)]
+    if hot_months is None:
+        hot_months = current_app.config.get('LOG_HOT_MONTHS', 2)
+    if start is None or start < hot_cutoff(hot_months):
+        months = [month for month in list_partitions(name)
+                  if (end is None or month < end) and (start is None or add_months(month, 1) > start)]
+        if months and _native():
+            branches.append(branch(archive_parent(name))) # The planner prunes to the overlapping partitions
+        else:
+            branches.extend(branch(partition_table(name, month)) for month in months)
+    if len(branches) == 1:
+        return branches[0].order_by(hot.c[spec.time_column])
+    return union_all(*branches).order_by(literal_column(spec.time_column))
+
+
+# -------------------------- Maintenance --------------------------
+
+def roll(name: str, hot_months: int, now: datetime = None) -> dict:
+    """Moves rows older than the hot window into monthly partitions, one transaction per month. Returns {month: rows}."""
+    spec = PARTITIONED[name]
+    hot = spec.model.__table__
+    time_column = hot.c[spec.time_column]
+    cutoff = hot_cutoff(hot_months, now)
+    moved = {}
+    while True:
+        oldest = db.session.execute(select(func.min(time_column)).where(time_column < cutoff)).scalar()
+        if oldest is None:
+            return moved
+        month = month_start(oldest)
+        in_month = (time_column >= month, time_column < min(add_months(month, 1), cutoff))
+        connection = db.session.connection()
+        target = ensure_partition(connection, name, month)
+        columns = [column.name for column in hot.columns]
+        result = connection.execute(insert(target).from_select(columns, select(*hot.columns).where(*in_month)))
+        connection.execute(delete(hot).where(*in_month))
+        db.session.commit()
+        moved[month] = result.rowcount
+
+
+def _archive_value(value):
+    return value.isoformat() if isinstance(value, (datetime, date)) else value
+
+
+def archive_partition(name: str, month: datetime, directory: str, fmt: str = 'csv.gz') -> tuple:
+    """Writes a partition to <directory>/<partition>.<fmt>; returns (path, rows). The partition is left in place."""
+    if fmt not in ARCHIVE_FORMATS:
+        raise ValueError(f'Unknown archive format {fmt}; expected one of {", ".join(ARCHIVE_FORMATS)}')
+    table = partition_table(name, month)
+    header = [column.name for column in table.columns]
+    rows = db.session.execute(select(*table.columns).order_by(table.c.id).execution_options(yield_per=ARCHIVE_BATCH_SIZE))
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{table.name}.{fmt}')
+    tmp_path = f'{path}.tmp'
+    count = 0
+    if fmt == 'csv.gz':
+        with gzip.open(tmp_path, 'wt', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for row in rows:
+                writer.writerow([_archive_value(value) for value in row])
+                count += 1
+    else:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError('Parquet archives need pyarrow (pip install pyarrow); use csv.gz otherwise')
+        writer = None
+        for batch in rows.partitions():
+            arrow_batch = pyarrow.Table.from_pylist([dict(zip(header, row)) for row in batch])
+            writer = writer or pyarrow.parquet.ParquetWriter(tmp_path, arrow_batch.schema)
+            writer.write_table(arrow_batch)
+            count += len(batch)
+        if writer is None:
+            pyarrow.parquet.write_table(pyarrow.table({column: [] for column in header}), tmp_path)
+        else:
+            writer.close()
+    os.replace(tmp_path, path)
+    return path, count
+
+
+def drop_partition(name: str, month: datetime) -> None:
+    connection = db.session.connection()
+    if _native():
+        connection.exec_driver_sql(f'DROP TABLE IF EXISTS {partition_name(name, month)}')
+    else:
+        partition_table(name, month).drop(connection, checkfirst=True)
+    _partition_metadata.remove(partition_table(name, month))
+    db.session.commit()
+
+
+def enforce_retention(name: str, retention_months: int, archive_dir: str = None, fmt: str = 'csv.gz',
+                      now: datetime = None) -> list:
+    """Archives (when archive_dir is set) and drops partitions entirely older than the retention window. Returns their months."""
+    cutoff = add_months(month_start(now or datetime.utcnow()), -retention_months)
+    expired = [month for month in list_partitions(name) if add_months(month, 1) <= cutoff]
+    for month in expired:
+        if archive_dir:
+            archive_partition(name, month, archive_dir, fmt)
+        drop_partition(name, month)
+    return expired
+
+
+def maintain(now: datetime = None) -> dict:
+    """Rolls and applies retention to every partitioned log with the app's LOG_* settings."""
+    config = current_app.config
+    report = {}
+    for name in PARTITIONED:
+        moved = roll(name, config.get('LOG_HOT_MONTHS', 2), now)
+        dropped = enforce_retention(name, config.get('LOG_RETENTION_MONTHS', 24), config.get('LOG_ARCHIVE_DIR'),
+                                    config.get('LOG_ARCHIVE_FORMAT', 'csv.gz'), now)
+        report[name] = {'moved': moved, 'dropped': dropped}
+    return report
+
+
+@click.command('logs-maintain')
+@with_appcontext
+def logs_maintain_command():
+    """Moves old AccessLog/AuditLog rows into monthly partitions, archives expired ones and prunes minute rollups."""
+    for name, result in maintain().items():
+        for month, rows in result['moved'].items():
+            click.echo(f'{name}: moved {rows} rows into {partition_name(name, month)}')
+        for month in result['dropped']:
+            click.echo(f'{name}: dropped {partition_name(name, month)}')
+    pruned = prune_minute_rollups(current_app.config.get('SECURITY_MINUTE_ROLLUP_HOURS', 48))
+    click.echo(f'security_rollup: pruned {pruned} minute rows')
@@ -0,0 +1,155 @@
+"""
+Token-bucket rate limiting for expensive endpoints.
+
+Each (limit name, caller) pair owns a bucket that holds up to `capacity` tokens and refills at `rate`
+tokens per second; a request spends one token or is rejected with 429 and a Retry-After header.
+A check is a constant amount of arithmetic on one bucket, so it is O(1) regardless of traffic.
+
+Limits come from RATELIMIT_LIMITS as {name: {role or 'default': 'N/period'}}, where a role mapped to
+None is unlimited. Buckets live in process memory by default (per worker); set RATELIMIT_STORAGE_URL
+to redis://... to share them across workers and hosts (requires the `redis` package).
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, jsonify, request
+from flask_login import current_user
+from werkzeug.exceptions import TooManyRequests
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_limit(limit: str):
+    """'10/minute' -> (rate in tokens/second, capacity). The full allowance is available as a burst."""
+    count, _, period = limit.partition('/')
+    count = int(count)
+    if count <= 0 or period not in PERIODS:
+        raise ValueError(f'Invalid rate limit {limit!r}; expected e.g. "10/minute"')
+    return count / PERIODS[period], count
+
+
+class MemoryBackend:
+    """Per-process buckets. The least recently used buckets are dropped beyond max_keys to bound memory."""
+
+    def __init__(self, max_keys: int = 100000):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict() # key -> (tokens, last refill time)
+        self.max_keys = max_keys
+
+    def consume(self, key: str, rate: float, capacity: int, cost: int = 1):
+        """Returns (allowed, seconds until `cost` tokens are available)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                allowed, retry_after = True, 0.0
+            else:
+                allowed, retry_after = False, (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, retry_after
+
+    def reset(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+
+class RedisBackend:
+    """Shared buckets in Redis; the refill-and-spend runs as one Lua script so concurrent workers can't race."""
+
+    SCRIPT = """
+    local rate, capacity, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    local allowed, retry_after = 0, (cost - tokens) / rate
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed, retry_after = 1, 0
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(retry_after)}
+    """
+
+    def __init__(self, url: str, prefix: str = 'ratelimit:'):
+        import redis # Optional dependency, only needed for a shared backend
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+        self.prefix = prefix
+
+    def consume(self, key: str, rate: float, capacity: int, cost: int = 1):
+        allowed, retry_after = self._script(keys=[self.prefix + key], args=[rate, capacity, time.time(), cost])
+        return bool(allowed), float(retry_after)
+
+    def reset(self) -> None:
+        for key in self._client.scan_iter(self.prefix + '*'):
+            self._client.delete(key)
+
+
+BACKENDS = {'memory': lambda url: MemoryBackend(), 'redis': RedisBackend, 'rediss': RedisBackend}
+
+
+def get_backend():
+    """The app's bucket store, created from RATELIMIT_STORAGE_URL on first use."""
+    backend = current_app.extensions.get('ratelimit')
+    if backend is None:
+        url = current_app.config.get('RATELIMIT_STORAGE_URL', 'memory://')
+        scheme = url.split('://', 1)[0]
+        if scheme not in BACKENDS:
+            raise ValueError(f'Unsupported RATELIMIT_STORAGE_URL scheme: {scheme}')
+        backend = current_app.extensions.setdefault('ratelimit', BACKENDS[scheme](url))
+    return backend
+
+
+def _caller():
+    """(bucket identity, role) for the current request: the user when logged in, else the client address."""
+    if current_user.is_authenticated:
+        return f'user:{current_user.id}', current_user.role
+    return f'ip:{request.remote_addr}', 'anonymous'
+
+
+def check_rate_limit(name: str):
+    """Spends a token from the caller's `name` bucket; returns seconds to wait if over the limit, else None."""
+    if not current_app.config.get('RATELIMIT_ENABLED', True):
+        return None
+    limits = current_app.config.get('RATELIMIT_LIMITS', {}).get(name)
+    if not limits:
+        return None
+    identity, role = _caller()
+    limit = limits.get(role, limits.get('default'))
+    if limit is None:
+        return None
+    rate, capacity = parse_limit(limit)
+    allowed, retry_after = get_backend().consume(f'{name}:{identity}', rate, capacity)
+    return None if allowed else retry_after
+
+
+def rate_limit(name: str):
+    """
+    Decorator applying the RATELIMIT_LIMITS[name] limit to a view. Rejected JSON requests get a JSON 429,
+    everything else the standard 429 page; both carry Retry-After in whole seconds.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            retry_after = check_rate_limit(name)
+            if retry_after is not None:
+                retry_after = max(1, math.ceil(retry_after))
+                current_app.logger.info(f"Rate limit '{name}' hit by {_caller()[0]}; retry in {retry_after}s")
+                if request.is_json:
+                    response = jsonify({"error": "Too many requests. Please slow down.", "retry_after": retry_after})
+                    response.status_code = 429
+                    response.headers['Retry-After'] = str(retry_after)
+                    return response
+                raise TooManyRequests(retry_after=retry_after)
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
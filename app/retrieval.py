@@ -0,0 +1,376 @@
+"""
+Local retrieval index used to pick chatbot context.
+
+An in-memory inverted index over College, Course, Event, StudyGroup and Post text, scored with BM25
+(a length-normalized TF-IDF), holding at most CHATBOT_INDEX_MAX_PER_TYPE of the newest rows of each
+model. The first build runs in a background thread; until it is done, context comes from a few of the
+newest rows of each record type the question names, as before the index existed. After that the index
+is kept current incrementally: rows flushed in a session are re-rendered in after_flush and applied
+only once that session commits. Rows other worker processes insert are picked up every
+CHATBOT_INDEX_REFRESH_SECONDS by a background refresh that loads only ids above the highest one it
+has seen per model; their edits and deletions wait for the full rebuild every
+CHATBOT_INDEX_REBUILD_SECONDS, which reads into a separate structure that is swapped in when done.
+Requests keep searching the current index meanwhile, and updates committed while a refresh or rebuild
+runs are replayed after it.
+"""
+import heapq
+import math
+import re
+import threading
+import time
+from collections import Counter
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import db
+from app.models import College, Course, Event, StudyGroup, Post
+
+_TOKEN = re.compile(r'[a-z0-9]+')
+STOPWORDS = frozenset("""
+a about all an and any anything are as at be by can could do does for from get give has have how i in
+is it know list me my of on or please show so some tell that the there this to us want what when where
+which who will with would you your
+""".split())
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+SNIPPET_CHARS = 240 # Longest description/content excerpt carried into a context line
+
+
+def tokenize(text: str) -> list:
+    """Lowercased word tokens without stopwords, with a plural 's' stripped so 'events' matches 'event'."""
+    tokens = []
+    for token in _TOKEN.findall((text or '').lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count (about four characters per token), good enough for budgeting."""
+    return len(text) // 4 + 1
+
+
+def _excerpt(text: str) -> str:
+    text = ' '.join((text or '').split())
+    return text if len(text) <= SNIPPET_CHARS else text[:SNIPPET_CHARS].rsplit(' ', 1)[0] + '...'
+
+
+# -------------------------- Document Rendering --------------------------
+# Each renderer returns (indexed text, context line). The type word is part of the indexed text so
+# questions like "what events are coming up" still match on the record type.
+
+def _render_college(c):
+    return (f"college {c.name} {c.location or ''}",
+            f"College: {c.name}" + (f" ({c.location})" if c.location else ""))
+
+def _render_course(c):
+    line = f"Course {c.course_code}: {c.name}"
+    if c.instructor:
+        line += f", taught by {c.instructor}"
+    if c.description:
+        line += f". {_excerpt(c.description)}"
+    return f"course class {c.course_code} {c.name} {c.instructor or ''} {c.description or ''}", line
+
+def _render_event(e):
+    line = f"Event: {e.name} on {e.date_time:%Y-%m-%d %H:%M}"
+    if e.location:
+        line += f" at {e.location}"
+    if e.description:
+        line += f". {_excerpt(e.description)}"
+    return f"event {e.name} {e.location or ''} {e.description or ''}", line
+
+def _render_study_group(g):
+    line = f"Study group: {g.name}"
+    if g.description:
+        line += f". {_excerpt(g.description)}"
+    return f"study group {g.name} {g.description or ''}", line
+
+def _render_post(p):
+    return f"post {p.title} {p.content}", f"Post: {p.title}. {_excerpt(p.content)}"
+
+# model -> (type key, columns loaded for a rebuild, renderer)
+INDEXED_MODELS = {
+    College: ('college', (College.id, College.name, College.location), _render_college),
+    Course: ('course', (Course.id, Course.course_code, Course.name, Course.instructor, Course.description), _render_course),
+    Event: ('event', (Event.id, Event.name, Event.date_time, Event.location, Event.description), _render_event),
+    StudyGroup: ('study_group', (StudyGroup.id, StudyGroup.name, StudyGroup.description), _render_study_group),
+    Post: ('post', (Post.id, Post.title, Post.content), _render_post),
+}
+
+REBUILD_BATCH_SIZE = 1000
+FALLBACK_ROWS = 3 # Newest rows per named record type while the index is being built
+
+
+class RetrievalIndex:
+    """Thread-safe BM25 inverted index keyed by (type, id), capped at `max_per_type` documents per type."""
+
+    _STATE = ('_postings', '_doc_lengths', '_doc_terms', '_lines', '_total_length', '_type_ids', '_type_counts',
+              '_high_water')
+
+    def __init__(self, max_per_type: int = None):
+        self._lock = threading.RLock()
+        self._rebuild_lock = threading.Lock() # Held for the whole of a refresh or rebuild, so only one runs at a time
+        self._journal = None # While a refresh runs: [(key, (text, line) or None)] to replay after it
+        self.max_per_type = max_per_type
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._postings = {} # term -> {doc key: term frequency}
+            self._doc_lengths = {} # doc key -> number of tokens
+            self._doc_terms = {} # doc key -> distinct terms, so removal only touches its own postings
+            self._lines = {} # doc key -> context line
+            self._total_length = 0
+            self._type_ids = {} # type -> min-heap of ids, to evict the oldest past max_per_type (stale ids are skipped)
+            self._type_counts = Counter() # type -> documents held
+            self._high_water = {} # type -> highest id loaded from the database
+            self.built_at = None # Last full build
+            self.refreshed_at = None # Last full build or incremental refresh
+
+    @property
+    def is_built(self) -> bool:
+        return self.built_at is not None
+
+    @property
+    def is_tracking(self) -> bool:
+        """Whether committed changes must be applied: the index is built or being built."""
+        return self.built_at is not None or self._journal is not None
+
+    def __len__(self):
+        return len(self._doc_lengths)
+
+    def add(self, key, text: str, line: str) -> None:
+        """Adds or replaces a document; past max_per_type, the type's lowest id is evicted."""
+        tokens = tokenize(text)
+        type_key, doc_id = key
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((key, (text, line)))
+            if key in self._doc_lengths:
+                self._remove(key)
+            else:
+                heapq.heappush(self._type_ids.setdefault(type_key, []), doc_id)
+            counts = Counter(tokens)
+            for term, count in counts.items():
+                self._postings.setdefault(term, {})[key] = count
+            self._doc_terms[key] = tuple(counts)
+            self._doc_lengths[key] = len(tokens)
+            self._lines[key] = line
+            self._total_length += len(tokens)
+            self._type_counts[type_key] += 1
+            while self.max_per_type and self._type_counts[type_key] > self.max_per_type:
+                self._remove((type_key, heapq.heappop(self._type_ids[type_key])))
+
+    def remove(self, key) -> None:
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((key, None))
+            self._remove(key)
+
+    def _remove(self, key):
+        if key not in self._doc_lengths:
+            return
+        for term in self._doc_terms.pop(key):
+            docs = self._postings[term]
+            del docs[key]
+            if not docs:
+                del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(key)
+        del self._lines[key]
+        self._type_counts[key[0]] -= 1
+
+    def rebuild(self, blocking: bool = True) -> bool:
+        """
+        Reloads every indexed model from the database, in batches of plain column rows, into a new index
+        that replaces this one's contents when complete. Returns False without rebuilding if `blocking` is
+        False and another refresh or rebuild is already running.
+        """
+        if not self._rebuild_lock.acquire(blocking=blocking):
+            return False
+        try:
+            self._refresh(full=True)
+        finally:
+            self._rebuild_lock.release()
+        return True
+
+    def _load(self, since: dict):
+        """
+        Yields (key, (text, line)) for the newest max_per_type rows of each model, newest first; with
+        `since` ({type: id}), only rows above its ids.
+        """
+        for model, (type_key, columns, render) in INDEXED_MODELS.items():
+            query = db.session.query(*columns).order_by(model.id.desc())
+            if since and type_key in since:
+                query = query.filter(model.id > since[type_key])
+            if self.max_per_type:
+                query = query.limit(self.max_per_type)
+            for row in query.yield_per(REBUILD_BATCH_SIZE):
+                yield (type_key, row.id), render(row)
+
+    def _refresh(self, full: bool):
+        """
+        Full: loads everything into a new index and swaps it in. Otherwise adds the rows inserted since
+        the last load. Either way, commits applied meanwhile are replayed on top of what was loaded.
+        """
+        with self._lock:
+            self._journal = [] # Commits from here on may be missing from, or older in, the rows read below
+            since = None if full or not self.is_built else dict(self._high_water)
+        try:
+            fresh = RetrievalIndex(self.max_per_type) if full else None
+            high_water = {} if full else dict(since or {})
+            inserted = [] # Incremental: few rows, applied under the lock below
+            for key, document in self._load(since):
+                high_water[key[0]] = max(high_water.get(key[0], 0), key[1])
+                if full:
+                    fresh.add(key, *document)
+                else:
+                    inserted.append((key, document))
+            with self._lock:
+                target = fresh if full else self
+                journal, self._journal = self._journal, None
+                for key, document in inserted:
+                    target.add(key, *document)
+                for key, document in journal:
+                    if document is None:
+                        target.remove(key)
+                    else:
+                        target.add(key, *document)
+                target._high_water = high_water
+                if full:
+                    for name in self._STATE:
+                        setattr(self, name, getattr(target, name))
+                    self.built_at = time.monotonic()
+                self.refreshed_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._journal = None
+
+    def ensure_built(self) -> None:
+        """Builds the index if it never has been; concurrent callers wait for the one build."""
+        if not self.is_built:
+            with self._rebuild_lock:
+                if not self.is_built:
+                    self._refresh(full=True)
+
+    def refresh_in_background(self, app, full: bool = True):
+        """
+        Starts a full rebuild (or, with full=False, an incremental refresh) in a daemon thread under
+        `app`'s context and returns the thread, or None if one is already running.
+        """
+        if not self._rebuild_lock.acquire(blocking=False):
+            return None
+        def run():
+            try:
+                with app.app_context():
+                    self._refresh(full or not self.is_built)
+            except Exception:
+                app.logger.exception('Retrieval index refresh failed; still serving the previous index')
+            finally:
+                self._rebuild_lock.release()
+        thread = threading.Thread(target=run, name='retrieval-index-refresh', daemon=True)
+        thread.start()
+        return thread
+
+    def search(self, query: str, k: int = 5) -> list:
+        """Returns up to k (score, key, context line) tuples, best first. Only documents sharing a term score."""
+        terms = set(tokenize(query))
+        with self._lock:
+            n_docs = len(self._doc_lengths)
+            if not terms or not n_docs:
+                return []
+            avg_length = self._total_length / n_docs or 1
+            scores = {}
+            for term in terms:
+                docs = self._postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                for key, tf in docs.items():
+                    norm = K1 * (1 - B + B * self._doc_lengths[key] / avg_length)
+                    scores[key] = scores.get(key, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(score, key, self._lines[key]) for key, score in best]
+
+
+retrieval_index = RetrievalIndex()
+
+
+def _fit(lines, token_budget: int) -> list:
+    fitted, used = [], 0
+    for line in lines:
+        cost = estimate_tokens(line)
+        if used + cost > token_budget:
+            continue # A shorter, lower-ranked record may still fit
+        fitted.append(line)
+        used += cost
+    return fitted
+
+
+def fallback_context(query: str, token_budget: int) -> list:
+    """
+    Context while the index is first built: the FALLBACK_ROWS newest rows of each record type the
+    query names ('college', 'course', 'event', 'study group', 'post'), one small query per type.
+    """
+    terms = set(tokenize(query))
+    lines = []
+    for model, (type_key, columns, render) in INDEXED_MODELS.items():
+        if terms & set(type_key.split('_')):
+            lines.extend(render(row)[1] for row in db.session.query(*columns).order_by(model.id.desc()).limit(FALLBACK_ROWS))
+    return _fit(lines, token_budget)
+
+
+def retrieve_context(query: str, k: int, token_budget: int, max_age: float = None, rebuild_age: float = None,
+                     max_per_type: int = None) -> list:
+    """
+    Top-k context lines for `query` that fit within `token_budget` estimated tokens.
+    The first call starts the index build in the background and, like every call until it is done,
+    answers from fallback_context(). Once the index is older than `max_age` seconds a background
+    refresh picks up newly inserted rows, and past `rebuild_age` a full rebuild runs instead; this
+    and later calls search the current index until either finishes.
+    """
+    retrieval_index.max_per_type = max_per_type
+    if not retrieval_index.is_built:
+        retrieval_index.refresh_in_background(current_app._get_current_object())
+        return fallback_context(query, token_budget)
+    now = time.monotonic()
+    if rebuild_age and now - retrieval_index.built_at > rebuild_age:
+        retrieval_index.refresh_in_background(current_app._get_current_object())
+    elif max_age and now - retrieval_index.refreshed_at > max_age:
+        retrieval_index.refresh_in_background(current_app._get_current_object(), full=False)
+    return _fit((line for _score, _key, line in retrieval_index.search(query, k)), token_budget)
+
+
+# -------------------------- Incremental Updates --------------------------
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    if not retrieval_index.is_tracking:
+        return # The first build will read these rows from the database
+    pending = session.info.setdefault('retrieval_pending', {})
+    for obj in list(session.new) + list(session.dirty):
+        spec = INDEXED_MODELS.get(type(obj))
+        if spec:
+            pending[(spec[0], obj.id)] = spec[2](obj)
+    for obj in session.deleted:
+        spec = INDEXED_MODELS.get(type(obj))
+        if spec:
+            pending[(spec[0], obj.id)] = None
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    pending = session.info.pop('retrieval_pending', None)
+    for key, document in (pending or {}).items():
+        if document is None:
+            retrieval_index.remove(key)
+        else:
+            retrieval_index.add(key, *document)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('retrieval_pending', None)
@@ -0,0 +1,307 @@
+"""
+RFID gate scan ingestion.
+
+Readers post batches of scans to /rfid/scans, authenticated with RFID_INGEST_TOKEN. A batch is decided
+and logged without a query per scan: reader_ids and card_uids are resolved against the AccessDirectory
+below; the AccessLog rows go in with one executemany INSERT; and each card's last_used_datetime is
+moved to its latest scan in the batch with one executemany UPDATE. The batch's counts go into the
+security dashboard rollups (app/security_dashboard.py) with one more executemany. Once that commits,
+the batch goes through the anomaly detector (app/anomaly.py), whose findings are opened as
+SecurityIncidents in a second, short transaction; a batch that failed to commit never reaches the
+detector, so a retry of it reports the same anomalies.
+
+Scans from unknown readers or of unknown cards are denied but not logged, since AccessLog needs both.
+
+The directory is an in-memory copy of the RFIDCard and AccessPoint columns a decision needs, loaded
+when the app starts. Every committed change to those columns (cards issued, reassigned, lost or
+expired; readers added or disabled) bumps the 'access_directory' CacheVersion in the same transaction.
+The worker that made the change applies it to its own copy on commit; every other worker compares
+its copy's version with the database's at most every RFID_CACHE_CHECK_SECONDS and reloads when they
+differ. Bulk query.update()/delete() on those models also bumps the version, which makes every worker
+reload.
+"""
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from flask import Blueprint, abort, current_app, jsonify, request
+from sqlalchemy import bindparam, event, insert, inspect as sa_inspect, or_, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import object_session
+from app import db
+from app.database import RoutingSession
+from app.instrumentation import query_budget
+from app.models import AccessLog, AccessPoint, CacheVersion, RFIDCard
+from app.anomaly import current_detector, incident_for
+from app.security_dashboard import record_scans
+
+rfid_bp = Blueprint('rfid', __name__)
+
+CardState = namedtuple('CardState', 'id status expiry_date user_id')
+ReaderState = namedtuple('ReaderState', 'id is_active name latitude longitude', defaults=(None, None, None))
+
+DIRECTORY_VERSION = 'access_directory'
+
+_card_table = RFIDCard.__table__
+_touch_cards = update(_card_table)\
+    .where(_card_table.c.id == bindparam('card_id'))\
+    .where(or_(_card_table.c.last_used_datetime.is_(None), _card_table.c.last_used_datetime < bindparam('used_at')))\
+    .values(last_used_datetime=bindparam('used_at'))
+
+_version_table = CacheVersion.__table__
+
+
+def read_directory_version(connection=None) -> int:
+    """The committed directory version; 0 before the first change."""
+    statement = select(_version_table.c.version).where(_version_table.c.name == DIRECTORY_VERSION)
+    return (connection.execute(statement) if connection is not None else db.session.execute(statement)).scalar() or 0
+
+
+def bump_directory_version(connection) -> int:
+    """Increments the directory version inside the caller's transaction and returns the new value."""
+    result = connection.execute(update(_version_table).where(_version_table.c.name == DIRECTORY_VERSION)
+                                .values(version=_version_table.c.version + 1, updated_at=datetime.utcnow()))
+    if result.rowcount == 0:
+        connection.execute(insert(_version_table).values(name=DIRECTORY_VERSION, version=1, updated_at=datetime.utcnow()))
+    return read_directory_version(connection)
+
+
+class AccessDirectory:
+    """card_uid -> CardState and reader_id -> ReaderState for this process, at `version`."""
+
+    def __init__(self):
+        self.cards = {}
+        self.readers = {}
+        self.version = None
+        self.checked_at = None
+        self._keys = {'card': {}, 'reader': {}} # Row id -> card_uid / reader_id, to apply renames and deletes
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.version is not None
+
+    def load(self) -> None:
+        # The version is read first: a change committed while loading then shows up as a newer
+        # version at the next check, rather than being masked
+        version = read_directory_version()
+        cards = {uid: CardState(card_id, status, expiry_date, user_id) for uid, card_id, status, expiry_date, user_id
+                 in db.session.query(RFIDCard.card_uid, RFIDCard.id, RFIDCard.status, RFIDCard.expiry_date, RFIDCard.user_id)}
+        readers = {reader_id: ReaderState(*state) for reader_id, *state
+                   in db.session.query(AccessPoint.reader_id, AccessPoint.id, AccessPoint.is_active, AccessPoint.name,
+                                       AccessPoint.latitude, AccessPoint.longitude)}
+        keys = {'card': {state.id: uid for uid, state in cards.items()},
+                'reader': {state.id: reader_id for reader_id, state in readers.items()}}
+        with self._lock:
+            self.cards, self.readers, self._keys = cards, readers, keys
+            self.version, self.checked_at = version, time.monotonic()
+
+    def ensure_fresh(self, check_interval: float) -> None:
+        """Loads the directory if needed, and reloads it when another worker has changed it."""
+        if not self.loaded:
+            self.load()
+        elif time.monotonic() - self.checked_at >= check_interval:
+            self.checked_at = time.monotonic()
+            if read_directory_version() != self.version:
+                self.load()
+
+    def apply(self, changes, version) -> None:
+        """
+        Applies this worker's committed changes. They only bring the copy up to date if it was at the
+        version just before; otherwise another worker changed something too, so reload.
+        """
+        with self._lock:
+            if not self.loaded:
+                return
+            if version is None or self.version != version - 1 or any(kind == 'reload' for kind, *_ in changes):
+                self.version = None
+                return
+            for kind, row_id, key, state in changes:
+                target, keys = (self.cards if kind == 'card' else self.readers), self._keys[kind]
+                if row_id in keys:
+                    target.pop(keys.pop(row_id), None)
+                if state is not None:
+                    target[key], keys[row_id] = state, key
+            self.version = version
+
+    def clear(self) -> None:
+        with self._lock:
+            self.cards, self.readers, self.version, self.checked_at = {}, {}, None, None
+            self._keys = {'card': {}, 'reader': {}}
+
+
+directory = AccessDirectory()
+
+
+# -------------------------- Directory Invalidation --------------------------
+# Pending changes live in session.info until the transaction ends; the version is bumped once per transaction.
+
+_TRACKED = {
+    RFIDCard: ('card', 'card_uid', ('card_uid', 'status', 'expiry_date', 'user_id'),
+               lambda card: CardState(card.id, card.status, card.expiry_date, card.user_id)),
+    AccessPoint: ('reader', 'reader_id', ('reader_id', 'is_active', 'name', 'latitude', 'longitude'),
+                  lambda point: ReaderState(point.id, point.is_active, point.name, point.latitude, point.longitude)),
+}
+
+
+def _record_change(session, connection, change):
+    session.info.setdefault('access_directory_changes', []).append(change)
+    if 'access_directory_version' not in session.info:
+        session.info['access_directory_version'] = bump_directory_version(connection)
+
+
+def _after_write(mapper, connection, target, deleted=False):
+    kind, key_attr, attrs, to_state = _TRACKED[mapper.class_]
+    state = sa_inspect(target)
+    if not deleted and state.has_identity and not any(state.attrs[attr].history.has_changes() for attr in attrs):
+        return # e.g. only last_used_datetime changed
+    change = (kind, target.id, getattr(target, key_attr), None if deleted else to_state(target))
+    _record_change(object_session(target), connection, change)
+
+
+for _model in _TRACKED:
+    event.listen(_model, 'after_insert', _after_write)
+    event.listen(_model, 'after_update', _after_write)
+    event.listen(_model, 'after_delete', lambda mapper, connection, target: _after_write(mapper, connection, target, deleted=True))
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _bulk_directory_change(orm_execute_state):
+    mapper = orm_execute_state.bind_mapper
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and mapper is not None and mapper.class_ in _TRACKED:
+        session = orm_execute_state.session
+        _record_change(session, session.connection(), ('reload', None, None, None))
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _apply_directory_changes(session):
+    changes = session.info.pop('access_directory_changes', None)
+    version = session.info.pop('access_directory_version', None)
+    if changes:
+        directory.apply(changes, version)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_directory_changes(session):
+    session.info.pop('access_directory_changes', None)
+    session.info.pop('access_directory_version', None)
+
+
+def init_rfid(app) -> None:
+    """Preloads the directory when ingestion is enabled, so the first batch doesn't pay for it."""
+    if not app.config.get('RFID_INGEST_TOKEN'):
+        return
+    with app.app_context():
+        try:
+            directory.load()
+        except SQLAlchemyError as exc:
+            app.logger.warning(f'RFID directory not preloaded ({type(exc).__name__}); it will load on the first scan') # e.g. tables not created yet
+
+
+def decide(card: CardState, reader: ReaderState, scanned_at: datetime):
+    """(granted, denial_reason) for one scan."""
+    if not reader.is_active:
+        return False, 'Access point inactive'
+    if card.status != 'active':
+        return False, f'Card {card.status}'
+    if card.expiry_date is not None and scanned_at >= card.expiry_date:
+        return False, 'Card expired'
+    if card.user_id is None:
+        return False, 'Card not assigned'
+    return True, None
+
+
+def ingest_scans(scans) -> dict:
+    """
+    Decides, logs and commits a batch of (reader_id, card_uid, scanned_at) scans. Returns the counts and
+    one decision per scan, in order.
+    """
+    directory.ensure_fresh(current_app.config.get('RFID_CACHE_CHECK_SECONDS', 2))
+    cards, readers = directory.cards, directory.readers
+    logs, last_used, decisions, observed = [], {}, [], []
+    for reader_id, card_uid, scanned_at in scans:
+        reader, card = readers.get(reader_id), cards.get(card_uid)
+        if reader is None or card is None:
+            decisions.append({'card_uid': card_uid, 'granted': False,
+                              'reason': 'Unknown reader' if reader is None else 'Unknown card'})
+            if reader is not None:
+                observed.append((scanned_at, reader, None, False))
+            continue
+        granted, reason = decide(card, reader, scanned_at)
+        observed.append((scanned_at, reader, card_uid, granted))
+        logs.append({'rfid_card_id': card.id, 'access_point_id': reader.id, 'access_datetime': scanned_at,
+                     'access_granted': granted, 'denial_reason': reason})
+        if card.id not in last_used or scanned_at > last_used[card.id]:
+            last_used[card.id] = scanned_at
+        decisions.append({'card_uid': card_uid, 'granted': granted, 'reason': reason})
+
+    if logs:
+        db.session.execute(insert(AccessLog.__table__), logs) # Core, so rows with and without a denial_reason share one executemany
+        record_scans(db.session.connection(), logs) # Dashboard rollups, in the same transaction
+    if last_used:
+        db.session.execute(_touch_cards, [{'card_id': card_id, 'used_at': used_at} for card_id, used_at in last_used.items()])
+    db.session.commit()
+    # Only scans that are stored reach the detector: observing uses up its state (a burst's cool-down,
+    # a passback pair), so detecting a batch whose commit then failed would hide its anomalies on retry.
+    anomalies = current_detector().observe_batch(observed) if current_app.config.get('ANOMALY_DETECTION', True) else []
+    if anomalies:
+        anomalies = _open_incidents(anomalies)
+    granted = sum(1 for decision in decisions if decision['granted'])
+    return {'logged': len(logs), 'granted': granted, 'denied': len(decisions) - granted, 'incidents': len(anomalies),
+            'directory_version': directory.version, 'decisions': decisions}
+
+
+def _open_incidents(anomalies) -> list:
+    """
+    Commits a SecurityIncident per anomaly and returns the anomalies opened. The scans are already stored,
+    so a failure is logged with every anomaly rather than failing the batch, which a retry would log twice.
+    """
+    db.session.add_all([incident_for(anomaly) for anomaly in anomalies])
+    try:
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        details = '; '.join(f'{anomaly.kind} at {anomaly.detected_at:%Y-%m-%d %H:%M:%S}: {anomaly.description}' for anomaly in anomalies)
+        current_app.logger.exception(f'Could not open security incidents for {len(anomalies)} anomalies: {details}')
+        return []
+    return anomalies
+
+
+# -------------------------- Ingestion API --------------------------
+
+def _scan_time(value):
+    """ISO 8601 to naive UTC; now when missing. Raises ValueError when malformed."""
+    if value is None:
+        return datetime.utcnow()
+    if isinstance(value, str) and value[-1:] in ('Z', 'z'):
+        value = value[:-1] + '+00:00' # fromisoformat() only accepts a Z suffix from Python 3.11
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+@rfid_bp.route('/scans', methods=['POST'])
+@query_budget(10) # Directory version check, reload (version, cards, readers) when stale, log INSERT, rollup upsert,
+                  # last-used UPDATE; and when anomalies are found, incident INSERT and its rollup/tally upserts
+def ingest():
+    """
+    Body: {"scans": [{"reader_id": "GATE-1", "card_uid": "04A2...", "scanned_at": "2024-03-04T09:00:00Z"}, ...]}
+    scanned_at is optional and defaults to the time of receipt.
+    """
+    token = current_app.config.get('RFID_INGEST_TOKEN')
+    if not token or request.headers.get('Authorization') != f'Bearer {token}':
+        abort(403)
+    body = request.get_json(silent=True)
+    payload = body.get('scans') if isinstance(body, dict) else None
+    if not isinstance(payload, list):
+        return jsonify({'error': 'Expected {"scans": [...]}'}), 400
+    if len(payload) > current_app.config.get('RFID_MAX_BATCH', 5000):
+        return jsonify({'error': 'Too many scans in one batch'}), 413
+    scans = []
+    for index, scan in enumerate(payload):
+        try:
+            scans.append((str(scan['reader_id']), str(scan['card_uid']), _scan_time(scan.get('scanned_at'))))
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return jsonify({'error': f'Scan {index} needs reader_id, card_uid and an ISO 8601 scanned_at'}), 400
+    return jsonify(ingest_scans(scans))
@@ -1,8 +1,8 @@
-from flask import render_template, flash, redirect, url_for, request, abort
-from app import app, db
+from flask import render_template, flash, redirect, url_for, request, abort, jsonify, g, current_app
+from app import db, DeferredApp
 from app.forms import (
     LoginForm, RegistrationForm, PostForm, CommentForm,
-    CourseForm, StudyGroupForm, EventForm, get_college_courses,
+    CourseForm, StudyGroupForm, EventForm, get_college_courses, get_attended_courses, get_course_students,
     CollegeForm, ReportForm, ReportStatusUpdateForm, AdminEditUserForm,
     SearchForm, EditProfileForm, ReelForm, ReelCommentForm, # Added Reel forms
     TakeAttendanceForm, StudentAttendanceEntryForm, ViewAttendanceForm, # Added Attendance forms
@@ -11,15 +11,25 @@ from app.forms import (
 from app.models import (User, College, Post, Comment, Vote, VoteType, 
                         Course, StudyGroup, Event, Report, ReportStatus, Notification, # Added Notification
                         Reel, ReelComment, ReelLike, AttendanceRecord, CourseEnrollment) # Added Reel, Attendance and CourseEnrollment models
-from app.utils import get_target_score, send_notification # Added send_notification
+from app.utils import get_target_score, get_post_list_stats, send_notification, prefix_criteria # Added send_notification
+from app.ratelimit import rate_limit
+from app.database import replica_reads
+from app.instrumentation import perf_registry, query_budget
+from app.exports import export_response, attendance_export_query, ATTENDANCE_EXPORT_HEADER
+from app.timetable import check_enrollment, clash_message
 from flask_login import login_user, logout_user, current_user, login_required
-from sqlalchemy import or_
+from sqlalchemy import insert, or_
+from sqlalchemy.orm import contains_eager, joinedload
 from datetime import datetime, date # Added date
 
 
-@app.route('/')
-@app.route('/index')
+main = DeferredApp() # Routes below are added to the app by create_app()
+
+@main.route('/')
+@main.route('/index')
 @login_required
+@replica_reads
+@query_budget(7) # Page of 10 posts: user, count, posts, post stats, colleges, college post counts, unread count
 def index():
     page = request.args.get('page', 1, type=int)
     # Show posts from user's college first, then others, or just all recent if no college.
@@ -28,12 +38,15 @@ def index():
             .order_by(Post.timestamp.desc())
     else: # Or show all posts for guests or users without a college
         posts_query = Post.query.order_by(Post.timestamp.desc())
+    posts_query = posts_query.options(joinedload(Post.author), joinedload(Post.college))
     
     posts_pagination = posts_query.paginate(page=page, per_page=10) # Renamed for clarity
-    return render_template('index.html', title='Home', posts=posts_pagination.items, pagination=posts_pagination)
+    post_stats = get_post_list_stats([post.id for post in posts_pagination.items], current_user.id)
+    return render_template('index.html', title='Home', posts=posts_pagination.items, pagination=posts_pagination,
+                           post_stats=post_stats)
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@main.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -49,13 +62,13 @@ def login():
         return redirect(next_page) if next_page else redirect(url_for('index'))
     return render_template('login.html', title='Sign In', form=form) # We'll create this template later
 
-@app.route('/logout')
+@main.route('/logout')
 def logout():
     logout_user()
     flash('You have been logged out.', 'info')
     return redirect(url_for('index'))
 
-@app.route('/register', methods=['GET', 'POST'])
+@main.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -89,7 +102,7 @@ def register():
         return redirect(url_for('login'))
     return render_template('register.html', title='Register', form=form)
 
-@app.route('/create_post', methods=['GET', 'POST'])
+@main.route('/create_post', methods=['GET', 'POST'])
 @login_required
 def create_post():
     form = PostForm()
@@ -119,7 +132,8 @@ def create_post():
 #     ).scalar()
 #     return score or 0
 
-@app.route('/post/<int:post_id>', methods=['GET', 'POST'])
+@main.route('/post/<int:post_id>', methods=['GET', 'POST'])
+@replica_reads
 def view_post(post_id):
     post = Post.query.get_or_404(post_id)
     comment_form = CommentForm()
@@ -181,8 +195,10 @@ def view_post(post_id):
                            comment_form=comment_form, pagination=comments_pagination,
                            post_score=post_score, comment_scores=comment_scores)
 
-@app.route('/vote/<target_type>/<int:target_id>/<vote_action>', methods=['POST'])
+@main.route('/vote/<target_type>/<int:target_id>/<vote_action>', methods=['POST'])
 @login_required
+@rate_limit('vote')
+@query_budget(4)
 def vote(target_type, target_id, vote_action):
     if target_type not in ['post', 'comment']:
         abort(404)
@@ -228,7 +244,7 @@ def vote(target_type, target_id, vote_action):
         return redirect(url_for('view_post', post_id=target.post_id, _anchor=f'comment-{target_id}'))
 
 
-@app.route('/college/<int:college_id>/posts')
+@main.route('/college/<int:college_id>/posts')
 def college_posts(college_id):
     college = College.query.get_or_404(college_id)
     page = request.args.get('page', 1, type=int)
@@ -237,7 +253,7 @@ def college_posts(college_id):
 
 
 # Placeholder for college verification - can be expanded later
-@app.route('/verify_college_email/<token>')
+@main.route('/verify_college_email/<token>')
 @login_required
 def verify_college_email(token):
     # This would be part of a more complex email verification system
@@ -247,7 +263,7 @@ def verify_college_email(token):
     return redirect(url_for('index'))
 
 # Example of a protected route that requires a specific role
-@app.route('/admin')
+@main.route('/admin')
 @login_required
 def admin_dashboard():
     if current_user.role != User.ROLE_ADMIN:
@@ -261,7 +277,7 @@ def admin_dashboard():
 
 # -------------------------- Course Routes --------------------------
 
-@app.route('/college/<int:college_id>/courses', methods=['GET'])
+@main.route('/college/<int:college_id>/courses', methods=['GET'])
 def list_college_courses(college_id):
     college = College.query.get_or_404(college_id)
     page = request.args.get('page', 1, type=int)
@@ -279,7 +295,7 @@ def list_college_courses(college_id):
                            college=college, courses_pagination=courses_pagination, 
                            enrollment_info=enrollment_info)
 
-@app.route('/college/<int:college_id>/course/create', methods=['GET', 'POST'])
+@main.route('/college/<int:college_id>/course/create', methods=['GET', 'POST'])
 @login_required
 def create_course(college_id):
     college = College.query.get_or_404(college_id)
@@ -308,7 +324,7 @@ def create_course(college_id):
             return redirect(url_for('list_college_courses', college_id=college.id))
     return render_template('create_course.html', title='Create New Course', form=form, college=college)
 
-@app.route('/course/<int:course_id>', methods=['GET'])
+@main.route('/course/<int:course_id>', methods=['GET'])
 def view_course(course_id):
     course = Course.query.get_or_404(course_id)
     
@@ -327,7 +343,7 @@ def view_course(course_id):
 
 # -------------------------- Study Group Routes --------------------------
 
-@app.route('/college/<int:college_id>/studygroups', methods=['GET'])
+@main.route('/college/<int:college_id>/studygroups', methods=['GET'])
 def list_college_study_groups(college_id):
     college = College.query.get_or_404(college_id)
     page = request.args.get('page', 1, type=int)
@@ -338,8 +354,8 @@ def list_college_study_groups(college_id):
     return render_template('college_studygroups.html', title=f"Study Groups at {college.name}",
                            college=college, study_groups=studygroups_pagination)
 
-@app.route('/college/<int:college_id>/studygroup/create', methods=['GET', 'POST'])
-@app.route('/course/<int:course_id>/studygroup/create', methods=['GET', 'POST'], endpoint='create_study_group_for_course') # For creating from course page
+@main.route('/college/<int:college_id>/studygroup/create', methods=['GET', 'POST'])
+@main.route('/course/<int:course_id>/studygroup/create', methods=['GET', 'POST'], endpoint='create_study_group_for_course') # For creating from course page
 @login_required
 def create_study_group(college_id=None, course_id=None):
     target_college = None
@@ -381,7 +397,7 @@ def create_study_group(college_id=None, course_id=None):
                            form=form, college=target_college, course=target_course)
 
 
-@app.route('/studygroup/<int:group_id>', methods=['GET'])
+@main.route('/studygroup/<int:group_id>', methods=['GET'])
 def view_study_group(group_id):
     study_group = StudyGroup.query.get_or_404(group_id)
     return render_template('view_studygroup.html', title=study_group.name, group=study_group)
@@ -389,7 +405,7 @@ def view_study_group(group_id):
 
 # -------------------------- Event Routes --------------------------
 
-@app.route('/college/<int:college_id>/events', methods=['GET'])
+@main.route('/college/<int:college_id>/events', methods=['GET'])
 def list_college_events(college_id):
     college = College.query.get_or_404(college_id)
     page = request.args.get('page', 1, type=int)
@@ -399,7 +415,7 @@ def list_college_events(college_id):
     return render_template('college_events.html', title=f"Events at {college.name}",
                            college=college, events=events_pagination)
 
-@app.route('/college/<int:college_id>/event/create', methods=['GET', 'POST'])
+@main.route('/college/<int:college_id>/event/create', methods=['GET', 'POST'])
 @login_required
 def create_event(college_id):
     college = College.query.get_or_404(college_id)
@@ -423,7 +439,7 @@ def create_event(college_id):
         return redirect(url_for('view_event', event_id=event.id))
     return render_template('create_event.html', title='Create New Event', form=form, college=college)
 
-@app.route('/event/<int:event_id>', methods=['GET'])
+@main.route('/event/<int:event_id>', methods=['GET'])
 def view_event(event_id):
     event = Event.query.get_or_404(event_id)
     return render_template('view_event.html', title=event.name, event=event)
@@ -431,7 +447,7 @@ def view_event(event_id):
 
 # -------------------------- Admin College Management Routes --------------------------
 
-@app.route('/admin/colleges', methods=['GET'])
+@main.route('/admin/colleges', methods=['GET'])
 @login_required
 def admin_list_colleges():
     if not current_user.role == User.ROLE_ADMIN:
@@ -441,7 +457,7 @@ def admin_list_colleges():
     colleges = College.query.order_by(College.name).all()
     return render_template('admin/list_colleges.html', title="Manage Colleges", colleges=colleges)
 
-@app.route('/admin/college/create', methods=['GET', 'POST'])
+@main.route('/admin/college/create', methods=['GET', 'POST'])
 @login_required
 def admin_create_college():
     if not current_user.role == User.ROLE_ADMIN:
@@ -461,7 +477,7 @@ def admin_create_college():
             return redirect(url_for('admin_list_colleges'))
     return render_template('admin/create_edit_college.html', title="Create New College", form=form)
 
-@app.route('/admin/college/<int:college_id>/edit', methods=['GET', 'POST'])
+@main.route('/admin/college/<int:college_id>/edit', methods=['GET', 'POST'])
 @login_required
 def admin_edit_college(college_id):
     if not current_user.role == User.ROLE_ADMIN:
@@ -488,7 +504,7 @@ def admin_edit_college(college_id):
     return render_template('admin/create_edit_college.html', title=f"Edit College: {college.name}", form=form, college=college)
 
 # Optional: Delete route (requires careful consideration of cascading effects or setting FKs to null)
-# @app.route('/admin/college/<int:college_id>/delete', methods=['POST'])
+# @main.route('/admin/college/<int:college_id>/delete', methods=['POST'])
 # @login_required
 # def admin_delete_college(college_id):
 #     if not current_user.role == User.ROLE_ADMIN:
@@ -507,7 +523,7 @@ def admin_edit_college(college_id):
 
 # -------------------------- Reporting Routes --------------------------
 
-@app.route('/report/post/<int:post_id>', methods=['GET', 'POST'])
+@main.route('/report/post/<int:post_id>', methods=['GET', 'POST'])
 @login_required
 def report_post(post_id):
     post = Post.query.get_or_404(post_id)
@@ -536,7 +552,7 @@ def report_post(post_id):
     return render_template('report_content.html', title='Report Post', form=form,
                            target_post=post, cancel_url=url_for('view_post', post_id=post.id))
 
-@app.route('/report/comment/<int:comment_id>', methods=['GET', 'POST'])
+@main.route('/report/comment/<int:comment_id>', methods=['GET', 'POST'])
 @login_required
 def report_comment(comment_id):
     comment = Comment.query.get_or_404(comment_id)
@@ -567,7 +583,7 @@ def report_comment(comment_id):
 
 # -------------------------- Admin Report Management Routes --------------------------
 
-@app.route('/admin/reports', methods=['GET'])
+@main.route('/admin/reports', methods=['GET'])
 @login_required
 def admin_list_reports():
     if not current_user.role == User.ROLE_ADMIN:
@@ -581,7 +597,7 @@ def admin_list_reports():
                                      .paginate(page=page, per_page=10)
     return render_template('admin/list_reports.html', title="Pending Reports", reports=reports_pagination)
 
-@app.route('/admin/report/<int:report_id>/view', methods=['GET'])
+@main.route('/admin/report/<int:report_id>/view', methods=['GET'])
 @login_required
 def admin_view_report(report_id):
     if not current_user.role == User.ROLE_ADMIN:
@@ -594,7 +610,7 @@ def admin_view_report(report_id):
     return render_template('admin/view_report.html', title=f"View Report {report.id}", 
                            report=report, status_form=status_form)
 
-@app.route('/admin/report/<int:report_id>/update_status', methods=['POST'])
+@main.route('/admin/report/<int:report_id>/update_status', methods=['POST'])
 @login_required
 def admin_update_report_status(report_id):
     if not current_user.role == User.ROLE_ADMIN:
@@ -619,7 +635,7 @@ def admin_update_report_status(report_id):
 
 # -------------------------- Admin User Management Routes --------------------------
 
-@app.route('/admin/user/<int:user_id>/edit', methods=['GET', 'POST'])
+@main.route('/admin/user/<int:user_id>/edit', methods=['GET', 'POST'])
 @login_required
 def admin_edit_user(user_id):
     if not current_user.role == User.ROLE_ADMIN:
@@ -647,9 +663,28 @@ def admin_edit_user(user_id):
                            form=form, user_to_edit=user_to_edit)
 
 
+
+# -------------------------- Admin Performance Route --------------------------
+
+@main.route('/admin/perf', methods=['GET', 'POST'])
+@login_required
+def admin_perf():
+    if not current_user.role == User.ROLE_ADMIN:
+        flash('You do not have permission to access this page.', 'danger')
+        return redirect(url_for('index'))
+    if request.method == 'POST': # "Reset" button
+        perf_registry.reset()
+        flash('Performance statistics have been reset.', 'info')
+        return redirect(url_for('admin_perf'))
+    return render_template('admin/perf.html', title="Query Performance",
+                           routes=perf_registry.summary(), slow_queries=list(perf_registry.slow_queries),
+                           slow_query_ms=current_app.config.get('SQL_SLOW_QUERY_MS', 200))
+
 # -------------------------- Search Route --------------------------
 
-@app.route('/search')
+@main.route('/search')
+@rate_limit('search')
+@replica_reads
 def search():
     query = request.args.get('query', '').strip() # Get query from URL parameter
     # The search_form from context_processor is for rendering in base.html.
@@ -701,8 +736,9 @@ def search():
 
 # -------------------------- User Profile Route --------------------------
 
-@app.route('/user/<username>')
+@main.route('/user/<username>')
 @login_required # Or remove if profiles should be public
+@replica_reads
 def user_profile(username):
     user = User.query.filter_by(username=username).first_or_404()
     # Add pagination for posts and comments later if desired
@@ -722,8 +758,9 @@ def user_profile(username):
 
 # -------------------------- Notification Routes --------------------------
 
-@app.route('/notifications')
+@main.route('/notifications')
 @login_required
+@query_budget(5)
 def list_notifications():
     page = request.args.get('page', 1, type=int)
     notifications_pagination = Notification.query.filter_by(user_id=current_user.id)\
@@ -740,7 +777,7 @@ def list_notifications():
     return render_template('notifications.html', title="Your Notifications", 
                            notifications=notifications_pagination)
 
-@app.route('/notifications/mark_as_read/<int:notification_id>', methods=['POST'])
+@main.route('/notifications/mark_as_read/<int:notification_id>', methods=['POST'])
 @login_required
 def mark_notification_as_read(notification_id):
     notification = Notification.query.get_or_404(notification_id)
@@ -754,7 +791,7 @@ def mark_notification_as_read(notification_id):
     return redirect(request.referrer or url_for('list_notifications'))
 
 
-@app.route('/notifications/mark_all_as_read', methods=['POST'])
+@main.route('/notifications/mark_all_as_read', methods=['POST'])
 @login_required
 def mark_all_notifications_as_read():
     unread_notifications = Notification.query.filter_by(user_id=current_user.id, is_read=False).all()
@@ -765,7 +802,7 @@ def mark_all_notifications_as_read():
     return redirect(url_for('list_notifications'))
 
 # -------------------------- Edit Profile Route --------------------------
-@app.route('/edit_profile', methods=['GET', 'POST'])
+@main.route('/edit_profile', methods=['GET', 'POST'])
 @login_required
 def edit_profile():
     form = EditProfileForm(original_username=current_user.username)
@@ -783,7 +820,7 @@ def edit_profile():
     return render_template('edit_profile.html', title='Edit Profile', form=form)
 
 # -------------------------- Follow/Unfollow Routes --------------------------
-@app.route('/follow/<username>', methods=['POST'])
+@main.route('/follow/<username>', methods=['POST'])
 @login_required
 def follow(username):
     user = User.query.filter_by(username=username).first_or_404()
@@ -797,7 +834,7 @@ def follow(username):
     # send_notification(user.id, 'new_follower', {'follower_id': current_user.id, 'follower_username': current_user.username})
     return redirect(url_for('user_profile', username=username))
 
-@app.route('/unfollow/<username>', methods=['POST'])
+@main.route('/unfollow/<username>', methods=['POST'])
 @login_required
 def unfollow(username):
     user = User.query.filter_by(username=username).first_or_404()
@@ -810,15 +847,20 @@ def unfollow(username):
     return redirect(url_for('user_profile', username=username))
 
 # -------------------------- Before Request Handler (last_seen) -----------------
-@app.before_request
+@main.before_request
 def before_request_handler():
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
+        now = datetime.utcnow()
+        # Throttled: committing on every request costs an UPDATE plus a reload of the user, on every page
+        interval = current_app.config.get('LAST_SEEN_UPDATE_SECONDS', 60)
+        if current_user.last_seen is None or (now - current_user.last_seen).total_seconds() >= interval:
+            current_user.last_seen = now
+            db.session.commit()
+            g.query_budget_extra = 2 # This UPDATE and the user reload it causes don't count against @query_budget
 
 # -------------------------- Reel Routes ------------------------------------
 
-@app.route('/reels_feed', methods=['GET'])
+@main.route('/reels_feed', methods=['GET'])
 @login_required # Optional: make public if desired by removing decorator
 def reels_feed():
     page = request.args.get('page', 1, type=int)
@@ -830,7 +872,7 @@ def reels_feed():
     return render_template('reels_feed.html', title="Reels Feed", 
                            reels=reels_pagination.items, pagination=reels_pagination)
 
-@app.route('/create_reel', methods=['GET', 'POST'])
+@main.route('/create_reel', methods=['GET', 'POST'])
 @login_required
 def create_reel():
     form = ReelForm()
@@ -849,7 +891,7 @@ def create_reel():
         return redirect(url_for('reels_feed')) # Or view_reel for the new reel: url_for('view_reel', reel_id=reel.id)
     return render_template('create_reel.html', title='Create Reel', form=form)
 
-@app.route('/reel/<int:reel_id>', methods=['GET', 'POST'])
+@main.route('/reel/<int:reel_id>', methods=['GET', 'POST'])
 def view_reel(reel_id): # login_required not strictly needed for viewing, but is for commenting/liking
     reel = Reel.query.get_or_404(reel_id)
     comment_form = ReelCommentForm()
@@ -887,7 +929,7 @@ def view_reel(reel_id): # login_required not strictly needed for viewing, but is
                            reel=reel, comments=comments, comment_form=comment_form,
                            like_count=like_count, user_liked_reel=user_liked_reel)
 
-@app.route('/reel/<int:reel_id>/like', methods=['POST'])
+@main.route('/reel/<int:reel_id>/like', methods=['POST'])
 @login_required
 def like_reel(reel_id):
     reel = Reel.query.get_or_404(reel_id)
@@ -906,8 +948,9 @@ def like_reel(reel_id):
 
 # -------------------------- Attendance Routes ------------------------------
 
-@app.route('/course/<int:course_id>/take_attendance', methods=['GET', 'POST'])
+@main.route('/course/<int:course_id>/take_attendance', methods=['GET', 'POST'])
 @login_required
+@query_budget(6) # Independent of roster size, for GET and POST
 def take_attendance(course_id):
     course = Course.query.get_or_404(course_id)
     # Role Check: Allow Admin or Faculty
@@ -955,29 +998,32 @@ def take_attendance(course_id):
             
     elif form.validate_on_submit(): # POST request
         attendance_date = form.date.data
+        # One query for the whole roster rather than one per student
+        existing_records = {rec.user_id: rec for rec in AttendanceRecord.query.filter_by(
+            course_id=course.id,
+            date=attendance_date
+        )}
+        new_records = []
         for student_form_field in form.students:
             student_id = int(student_form_field.student_id.data) # Ensure student_id is int
             status = student_form_field.status.data
             
-            record = AttendanceRecord.query.filter_by(
-                user_id=student_id, 
-                course_id=course.id, 
-                date=attendance_date
-            ).first()
+            record = existing_records.get(student_id)
             
             if record:
                 record.status = status
                 record.marked_by_id = current_user.id
                 record.timestamp = datetime.utcnow()
             else:
-                record = AttendanceRecord(
+                new_records.append(dict(
                     user_id=student_id, 
                     course_id=course.id, 
                     date=attendance_date, 
                     status=status, 
                     marked_by_id=current_user.id
-                )
-                db.session.add(record)
+                ))
+        if new_records: # A single executemany; adding ORM objects would INSERT ... RETURNING row by row
+            db.session.execute(insert(AttendanceRecord), new_records)
         
         db.session.commit()
         flash('Attendance records have been saved/updated.', 'success')
@@ -992,8 +1038,67 @@ def take_attendance(course_id):
     return render_template('take_attendance.html', title=f'Take Attendance for {course.name}', form=form, course=course)
 
 
-@app.route('/course/<int:course_id>/view_attendance', methods=['GET', 'POST'])
+ATTENDANCE_PER_PAGE = 25
+ATTENDANCE_FILTER_DROPDOWN_LIMIT = 100 # Larger filter scopes switch to a typeahead
+TYPEAHEAD_RESULT_LIMIT = 20
+
+
+def _scope_attendance_filter(field, scope_query, model, selected_id):
+    """
+    Restricts a ViewAttendanceForm QuerySelectField to `scope_query`.
+    Scopes up to ATTENDANCE_FILTER_DROPDOWN_LIMIT rows are loaded as a regular dropdown. Larger scopes only
+    load the currently selected row and return True, telling the template to render a typeahead instead.
+    """
+    options = scope_query.limit(ATTENDANCE_FILTER_DROPDOWN_LIMIT + 1).all()
+    if len(options) <= ATTENDANCE_FILTER_DROPDOWN_LIMIT:
+        field.query = options
+        return False
+    field.query = scope_query.filter(model.id == selected_id).all() if selected_id else []
+    return True
+
+
+def _attendance_filters_from_args(id_arg):
+    """
+    Reads the attendance filters (a user or course id plus an optional date range) from the query string.
+    Malformed dates are flashed and ignored rather than failing the request.
+    """
+    filters = {}
+    filter_id = request.args.get(id_arg, type=int)
+    if filter_id:
+        filters[id_arg] = filter_id
+    for arg_name, label in (('start_date', 'start'), ('end_date', 'end')):
+        value = request.args.get(arg_name)
+        if not value:
+            continue
+        try:
+            filters[arg_name] = datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            flash(f'Invalid {label} date format. Please use YYYY-MM-DD.', 'warning')
+    return filters
+
+
+def _attendance_criteria(user_id=None, course_id=None, start_date=None, end_date=None):
+    """Translates attendance filters into SQLAlchemy criteria on AttendanceRecord."""
+    criteria = []
+    if user_id:
+        criteria.append(AttendanceRecord.user_id == user_id)
+    if course_id:
+        criteria.append(AttendanceRecord.course_id == course_id)
+    if start_date:
+        criteria.append(AttendanceRecord.date >= start_date)
+    if end_date:
+        criteria.append(AttendanceRecord.date <= end_date)
+    return criteria
+
+
+def _attendance_url_args(filters):
+    """Serializes attendance filters back into query-string arguments for pagination and export links."""
+    return {key: value.isoformat() if isinstance(value, date) else value for key, value in filters.items()}
+
+
+@main.route('/course/<int:course_id>/view_attendance', methods=['GET', 'POST'])
 @login_required
+@replica_reads
 def view_course_attendance(course_id):
     course = Course.query.get_or_404(course_id)
     # Permission: Allow Admin or Faculty to view course attendance
@@ -1014,52 +1119,62 @@ def view_course_attendance(course_id):
              return redirect(url_for('view_course', course_id=course.id))
 
     form = ViewAttendanceForm(request.form)
-    # Populate choices for the form's QuerySelectFields if they depend on context (e.g., students in this course)
-    # form.user_id.query = User.query.filter(User.attendance_records.any(course_id=course.id)).order_by(User.username) # More complex
-    # For now, the default query_factory in the form definition (all users) is used.
-
-    query = AttendanceRecord.query.filter_by(course_id=course.id)
+    # Only students enrolled in this course can be picked as a filter
+    user_filter_typeahead = _scope_attendance_filter(form.user_id, get_course_students(course.id), User,
+                                                     request.values.get('user_id', type=int))
 
+    filters = {}
     if form.validate_on_submit(): # This handles POST for form submission
         if form.user_id.data:
-            query = query.filter(AttendanceRecord.user_id == form.user_id.data.id)
+            filters['user_id'] = form.user_id.data.id
         if form.start_date.data:
-            query = query.filter(AttendanceRecord.date >= form.start_date.data)
+            filters['start_date'] = form.start_date.data
         if form.end_date.data:
-            query = query.filter(AttendanceRecord.date <= form.end_date.data)
+            filters['end_date'] = form.end_date.data
     elif request.method == 'GET': # Handle GET request with query parameters for filtering
-        if request.args.get('user_id'):
-             query = query.filter(AttendanceRecord.user_id == request.args.get('user_id'))
-        if request.args.get('start_date'):
-            try:
-                start_dt = datetime.strptime(request.args.get('start_date'), '%Y-%m-%d').date()
-                query = query.filter(AttendanceRecord.date >= start_dt)
-                form.start_date.data = start_dt # Pre-fill form
-            except ValueError:
-                flash('Invalid start date format. Please use YYYY-MM-DD.', 'warning')
-        if request.args.get('end_date'):
-            try:
-                end_dt = datetime.strptime(request.args.get('end_date'), '%Y-%m-%d').date()
-                query = query.filter(AttendanceRecord.date <= end_dt)
-                form.end_date.data = end_dt # Pre-fill form
-            except ValueError:
-                flash('Invalid end date format. Please use YYYY-MM-DD.', 'warning')
-        # Pre-fill other form fields from GET args if needed
-        if request.args.get('user_id'):
-            user_filter_id = request.args.get('user_id', type=int)
-            user_for_filter = User.query.get(user_filter_id)
+        filters = _attendance_filters_from_args('user_id')
+        # Pre-fill form fields from GET args
+        form.start_date.data = filters.get('start_date')
+        form.end_date.data = filters.get('end_date')
+        if filters.get('user_id'):
+            user_for_filter = User.query.get(filters['user_id'])
             if user_for_filter:
                 form.user_id.data = user_for_filter
 
-
-    attendance_records = query.order_by(AttendanceRecord.date.desc(), AttendanceRecord.student.has(User.username)).all()
+    # Join the student explicitly so the sort is a real ORDER BY on username (not a per-row EXISTS),
+    # and load student and marker in the same statement instead of lazily per table row.
+    page = request.args.get('page', 1, type=int)
+    records_pagination = AttendanceRecord.query\
+        .join(User, AttendanceRecord.user_id == User.id)\
+        .options(contains_eager(AttendanceRecord.student), joinedload(AttendanceRecord.marker))\
+        .filter(*_attendance_criteria(course_id=course.id, **filters))\
+        .order_by(AttendanceRecord.date.desc(), User.username.asc())\
+        .paginate(page=page, per_page=ATTENDANCE_PER_PAGE)
     
     return render_template('view_attendance_course.html', title=f'Attendance for {course.name}', 
-                           form=form, course=course, records=attendance_records)
+                           form=form, course=course, records=records_pagination.items,
+                           pagination=records_pagination, filter_args=_attendance_url_args(filters),
+                           user_filter_typeahead=user_filter_typeahead)
 
 
-@app.route('/user/<username>/attendance', methods=['GET', 'POST'])
+@main.route('/course/<int:course_id>/view_attendance/export.csv', methods=['GET'], defaults={'fmt': 'csv'})
+@main.route('/course/<int:course_id>/view_attendance/export.<fmt>', methods=['GET'])
 @login_required
+def export_course_attendance(course_id, fmt):
+    course = Course.query.get_or_404(course_id)
+    if current_user.role not in [User.ROLE_ADMIN, User.ROLE_FACULTY]:
+        flash('You do not have permission to view attendance for this course.', 'danger')
+        return redirect(url_for('view_course', course_id=course.id))
+
+    filters = _attendance_filters_from_args('user_id')
+    query = attendance_export_query(_attendance_criteria(course_id=course.id, **filters),
+                                    order_by=[AttendanceRecord.date.desc(), User.username.asc()])
+    return export_response(f'attendance_{course.course_code}', ATTENDANCE_EXPORT_HEADER, query, fmt)
+
+
+@main.route('/user/<username>/attendance', methods=['GET', 'POST'])
+@login_required
+@replica_reads
 def view_user_attendance(username):
     user_profile = User.query.filter_by(username=username).first_or_404()
 
@@ -1068,51 +1183,91 @@ def view_user_attendance(username):
         return redirect(url_for('index'))
 
     form = ViewAttendanceForm(request.form)
-    # Populate form.course_id.query dynamically if it should only show courses the user is in
-    # form.course_id.query = Course.query.join(AttendanceRecord).filter(AttendanceRecord.user_id == user_profile.id).distinct().order_by(Course.name)
-    # For now, the default query_factory (all courses) is used.
-
-    query = AttendanceRecord.query.filter_by(user_id=user_profile.id)
+    # Only courses this user has attendance records in can be picked as a filter
+    course_filter_typeahead = _scope_attendance_filter(form.course_id, get_attended_courses(user_profile.id), Course,
+                                                       request.values.get('course_id', type=int))
 
+    filters = {}
     if form.validate_on_submit(): # This handles POST for form submission
         if form.course_id.data:
-            query = query.filter(AttendanceRecord.course_id == form.course_id.data.id)
+            filters['course_id'] = form.course_id.data.id
         if form.start_date.data:
-            query = query.filter(AttendanceRecord.date >= form.start_date.data)
+            filters['start_date'] = form.start_date.data
         if form.end_date.data:
-            query = query.filter(AttendanceRecord.date <= form.end_date.data)
+            filters['end_date'] = form.end_date.data
     elif request.method == 'GET': # Handle GET request with query parameters
-        if request.args.get('course_id'):
-            query = query.filter(AttendanceRecord.course_id == request.args.get('course_id'))
-        if request.args.get('start_date'):
-            try:
-                start_dt_user = datetime.strptime(request.args.get('start_date'), '%Y-%m-%d').date()
-                query = query.filter(AttendanceRecord.date >= start_dt_user)
-                form.start_date.data = start_dt_user
-            except ValueError:
-                flash('Invalid start date format. Please use YYYY-MM-DD.', 'warning')
-        if request.args.get('end_date'):
-            try:
-                end_dt_user = datetime.strptime(request.args.get('end_date'), '%Y-%m-%d').date()
-                query = query.filter(AttendanceRecord.date <= end_dt_user)
-                form.end_date.data = end_dt_user
-            except ValueError:
-                flash('Invalid end date format. Please use YYYY-MM-DD.', 'warning')
-        if request.args.get('course_id'):
-            course_filter_id = request.args.get('course_id', type=int)
-            course_for_filter = Course.query.get(course_filter_id)
+        filters = _attendance_filters_from_args('course_id')
+        form.start_date.data = filters.get('start_date')
+        form.end_date.data = filters.get('end_date')
+        if filters.get('course_id'):
+            course_for_filter = Course.query.get(filters['course_id'])
             if course_for_filter:
                 form.course_id.data = course_for_filter
 
-
-    attendance_records = query.order_by(AttendanceRecord.course.has(Course.name), AttendanceRecord.date.desc()).all()
+    # Same approach as the course view: sort on a joined Course.name and eager-load per-row relationships.
+    page = request.args.get('page', 1, type=int)
+    records_pagination = AttendanceRecord.query\
+        .join(Course, AttendanceRecord.course_id == Course.id)\
+        .options(contains_eager(AttendanceRecord.course), joinedload(AttendanceRecord.marker))\
+        .filter(*_attendance_criteria(user_id=user_profile.id, **filters))\
+        .order_by(Course.name.asc(), AttendanceRecord.date.desc())\
+        .paginate(page=page, per_page=ATTENDANCE_PER_PAGE)
     
     return render_template('view_attendance_user.html', title=f'Attendance for {user_profile.username}',
-                           form=form, user_profile=user_profile, records=attendance_records)
+                           form=form, user_profile=user_profile, records=records_pagination.items,
+                           pagination=records_pagination, filter_args=_attendance_url_args(filters),
+                           course_filter_typeahead=course_filter_typeahead)
+
+
+@main.route('/user/<username>/attendance/export.csv', methods=['GET'], defaults={'fmt': 'csv'})
+@main.route('/user/<username>/attendance/export.<fmt>', methods=['GET'])
+@login_required
+def export_user_attendance(username, fmt):
+    user_profile = User.query.filter_by(username=username).first_or_404()
+    if current_user != user_profile and current_user.role != User.ROLE_ADMIN:
+        flash('You do not have permission to view this attendance report.', 'danger')
+        return redirect(url_for('index'))
+
+    filters = _attendance_filters_from_args('course_id')
+    query = attendance_export_query(_attendance_criteria(user_id=user_profile.id, **filters),
+                                    order_by=[Course.name.asc(), AttendanceRecord.date.desc()])
+    return export_response(f'attendance_{user_profile.username}', ATTENDANCE_EXPORT_HEADER, query, fmt)
+
+
+@main.route('/course/<int:course_id>/attendance/students.json', methods=['GET'])
+@login_required
+def course_attendance_student_lookup(course_id):
+    """Typeahead source for the student filter: enrolled students whose username starts with `q`."""
+    course = Course.query.get_or_404(course_id)
+    if current_user.role not in [User.ROLE_ADMIN, User.ROLE_FACULTY]:
+        abort(403)
+
+    query = get_course_students(course.id)
+    prefix = request.args.get('q', '').strip()
+    if prefix:
+        query = query.filter(prefix_criteria(User.username, prefix))
+    students = query.with_entities(User.id, User.username).limit(TYPEAHEAD_RESULT_LIMIT).all()
+    return jsonify([{'id': student_id, 'label': username} for student_id, username in students])
+
+
+@main.route('/user/<username>/attendance/courses.json', methods=['GET'])
+@login_required
+def user_attendance_course_lookup(username):
+    """Typeahead source for the course filter: attended courses whose name starts with `q`."""
+    user_profile = User.query.filter_by(username=username).first_or_404()
+    if current_user != user_profile and current_user.role != User.ROLE_ADMIN:
+        abort(403)
+
+    query = get_attended_courses(user_profile.id)
+    prefix = request.args.get('q', '').strip()
+    if prefix:
+        query = query.filter(prefix_criteria(Course.name, prefix))
+    courses = query.with_entities(Course.id, Course.name, Course.course_code).limit(TYPEAHEAD_RESULT_LIMIT).all()
+    return jsonify([{'id': course_id, 'label': f'{name} ({course_code})'} for course_id, name, course_code in courses])
 
 # -------------------------- Course Enrollment Routes -----------------------
 
-@app.route('/course/<int:course_id>/enroll', methods=['POST'])
+@main.route('/course/<int:course_id>/enroll', methods=['POST'])
 @login_required
 def enroll_in_course(course_id):
     course = Course.query.get_or_404(course_id)
@@ -1126,8 +1281,11 @@ def enroll_in_course(course_id):
         elif existing_enrollment.status == 'dropped':
             # Check capacity before re-enrolling a dropped student
             enrolled_count = CourseEnrollment.query.filter_by(course_id=course.id, status='enrolled').count()
+            clashes = check_enrollment(current_user.id, course.id)
             if course.capacity is not None and enrolled_count >= course.capacity:
                 flash(f'This course is currently full (capacity: {course.capacity}). You cannot re-enroll at this time.', 'warning')
+            elif clashes:
+                flash(clash_message(clashes), 'warning')
             else:
                 existing_enrollment.status = 'enrolled'
                 existing_enrollment.enrollment_date = datetime.utcnow()
@@ -1138,9 +1296,12 @@ def enroll_in_course(course_id):
     else:
         # New enrollment: Check capacity
         enrolled_count = CourseEnrollment.query.filter_by(course_id=course.id, status='enrolled').count()
+        clashes = check_enrollment(current_user.id, course.id)
         if course.capacity is not None and enrolled_count >= course.capacity:
             # Basic full check - could implement waitlist logic here if desired
             flash(f'This course is currently full (capacity: {course.capacity}). Enrollment is not possible at this time.', 'warning')
+        elif clashes:
+            flash(clash_message(clashes), 'warning')
         else:
             new_enrollment = CourseEnrollment(user_id=current_user.id, course_id=course.id, status='enrolled')
             db.session.add(new_enrollment)
@@ -1151,7 +1312,7 @@ def enroll_in_course(course_id):
 
 # -------------------------- Enrollment Management Route --------------------
 
-@app.route('/course/<int:course_id>/manage_enrollments', methods=['GET', 'POST'])
+@main.route('/course/<int:course_id>/manage_enrollments', methods=['GET', 'POST'])
 @login_required
 def manage_course_enrollments(course_id):
     course = Course.query.get_or_404(course_id)
@@ -1190,6 +1351,10 @@ def manage_course_enrollments(course_id):
                     if course.capacity is not None and enrolled_count >= course.capacity and is_newly_enrolling:
                         flash(f'Cannot enroll {student_to_enroll.username}. Course is full (capacity: {course.capacity}).', 'warning')
                         return redirect(url_for('manage_course_enrollments', course_id=course.id))
+                    clashes = check_enrollment(student_to_enroll.id, course.id) if is_newly_enrolling else []
+                    if clashes:
+                        flash(f'Cannot enroll {student_to_enroll.username}. {clash_message(clashes)}', 'warning')
+                        return redirect(url_for('manage_course_enrollments', course_id=course.id))
 
                 if enrollment:
                     enrollment.status = status
@@ -1226,6 +1391,10 @@ def manage_course_enrollments(course_id):
                 if course.capacity is not None and enrolled_count >= course.capacity:
                     flash(f'Cannot change status to "enrolled" for {enrollment_to_update.student.username}. Course is full.', 'warning')
                     return redirect(url_for('manage_course_enrollments', course_id=course.id))
+                clashes = check_enrollment(enrollment_to_update.user_id, course.id)
+                if clashes:
+                    flash(f'Cannot change status to "enrolled" for {enrollment_to_update.student.username}. {clash_message(clashes)}', 'warning')
+                    return redirect(url_for('manage_course_enrollments', course_id=course.id))
             
             enrollment_to_update.status = new_status
             enrollment_to_update.enrollment_date = datetime.utcnow() # Update timestamp
@@ -1278,7 +1447,7 @@ def manage_course_enrollments(course_id):
                            add_student_form=add_student_form,
                            change_status_form=change_status_form) # Pass for CSRF if used per row
 
-@app.route('/course/<int:course_id>/unenroll', methods=['POST'])
+@main.route('/course/<int:course_id>/unenroll', methods=['POST'])
 @login_required
 def unenroll_from_course(course_id):
     course = Course.query.get_or_404(course_id)
@@ -0,0 +1,308 @@
+"""
+Security dashboard backed by incrementally maintained rollups.
+
+SecurityRollup holds per-minute and per-hour counts of granted and denied scans and patrol entries
+per access point, and of incidents reported per severity. IncidentTally holds the current number of
+incidents per (status, severity). Neither is ever recomputed from the raw tables during normal use:
+
+* ingest_scans() (app/rfid.py) adds its batch's counts with one executemany upsert, in the same
+  transaction as the AccessLog insert.
+* AccessLog, SecurityPatrolLog and SecurityIncident rows written through the ORM are counted by mapper
+  events; the counts are merged per flush and upserted in the same transaction. An incident whose
+  status or severity changes moves between tallies.
+
+/security/dashboard then reads a few hundred rollup rows, whatever the size of the logs. Minute
+rollups are only needed for the last hour or so, and `flask logs-maintain` prunes those older than
+SECURITY_MINUTE_ROLLUP_HOURS; hour rollups are kept. `flask security-rollups-rebuild` recomputes
+everything from the raw tables, e.g. after deploying this on an existing database.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+import click
+from flask import Blueprint, abort, current_app, jsonify
+from flask.cli import with_appcontext
+from flask_login import current_user, login_required
+from sqlalchemy import delete, event, func, insert, select, update
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import object_session
+from app import db
+from app.database import RoutingSession
+from app.instrumentation import query_budget
+from app.models import (User, AccessLog, AccessPoint, IncidentTally, SecurityIncident, SecurityPatrolLog,
+                        SecurityRollup)
+
+security_bp = Blueprint('security', __name__)
+
+RESOLUTIONS = {'minute': timedelta(minutes=1), 'hour': timedelta(hours=1)}
+CLOSED_INCIDENT_STATUSES = ('resolved', 'closed')
+REBUILD_BATCH_SIZE = 5000
+
+_rollup_table = SecurityRollup.__table__
+_tally_table = IncidentTally.__table__
+
+
+def bucket_start(when: datetime, resolution: str) -> datetime:
+    if resolution == 'minute':
+        return when.replace(second=0, microsecond=0)
+    return when.replace(minute=0, second=0, microsecond=0)
+
+
+def count_event(counts: Counter, when: datetime, metric: str, key, amount: int = 1, minute_since: datetime = None) -> None:
+    """Adds one event to both resolutions (minute buckets only from `minute_since`, when given)."""
+    for resolution in RESOLUTIONS:
+        if resolution == 'minute' and minute_since is not None and when < minute_since:
+            continue
+        counts[(resolution, bucket_start(when, resolution), metric, str(key))] += amount
+
+
+def scan_metric(granted: bool) -> str:
+    return 'scan_granted' if granted else 'scan_denied'
+
+
+# -------------------------- Upserts --------------------------
+
+def _upsert(connection, table, rows) -> None:
+    """Adds each row's count to the row with the same primary key, creating it if needed."""
+    if not rows:
+        return
+    keys = [column.name for column in table.primary_key.columns]
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        statement = (sqlite_insert if dialect == 'sqlite' else pg_insert)(table)
+        statement = statement.on_conflict_do_update(index_elements=keys,
+                                                    set_={'count': table.c['count'] + statement.excluded['count']})
+        connection.execute(statement, rows)
+        return
+    for row in rows: # No portable upsert on other backends
+        criteria = [table.c[key] == row[key] for key in keys]
+        if connection.execute(update(table).where(*criteria).values(count=table.c['count'] + row['count'])).rowcount == 0:
+            connection.execute(insert(table).values(**row))
+
+
+def write_rollups(connection, counts: Counter) -> None:
+    _upsert(connection, _rollup_table, [
+        {'resolution': resolution, 'bucket_start': start, 'metric': metric, 'key': key, 'count': count}
+        for (resolution, start, metric, key), count in counts.items() if count])
+
+
+def write_tallies(connection, counts: Counter) -> None:
+    _upsert(connection, _tally_table, [
+        {'status': status, 'severity': severity, 'count': count}
+        for (status, severity), count in counts.items() if count])
+
+
+def record_scans(connection, logs) -> None:
+    """Counts a batch of AccessLog row dicts, as inserted by ingest_scans(), into the rollups."""
+    counts = Counter()
+    for log in logs:
+        count_event(counts, log['access_datetime'], scan_metric(log['access_granted']), log['access_point_id'])
+    write_rollups(connection, counts)
+
+
+# -------------------------- ORM Events --------------------------
+# Counts from mapper events accumulate in session.info and are written once per flush.
+
+def _pending(session):
+    return session.info.setdefault('security_rollups', (Counter(), Counter()))
+
+
+def _previous(target, attr):
+    """The attribute's value in the database, before any pending change."""
+    history = sa_inspect(target).attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(target, attr)
+
+
+@event.listens_for(AccessLog, 'after_insert')
+def _count_access_log(mapper, connection, target):
+    rollups, _ = _pending(object_session(target))
+    count_event(rollups, target.access_datetime, scan_metric(target.access_granted), target.access_point_id)
+
+
+@event.listens_for(SecurityPatrolLog, 'after_insert')
+def _count_patrol(mapper, connection, target):
+    if target.access_point_id is not None: # Coverage is tracked per access point
+        rollups, _ = _pending(object_session(target))
+        count_event(rollups, target.log_datetime, 'patrol', target.access_point_id)
+
+
+@event.listens_for(SecurityIncident, 'after_insert')
+def _count_incident(mapper, connection, target):
+    rollups, tallies = _pending(object_session(target))
+    count_event(rollups, target.incident_datetime, 'incident', target.severity)
+    tallies[(target.status, target.severity)] += 1
+
+
+@event.listens_for(SecurityIncident, 'after_update')
+def _move_incident(mapper, connection, target):
+    old = (_previous(target, 'status'), _previous(target, 'severity'))
+    new = (target.status, target.severity)
+    if old != new:
+        _, tallies = _pending(object_session(target))
+        tallies[old] -= 1
+        tallies[new] += 1
+
+
+@event.listens_for(SecurityIncident, 'after_delete')
+def _uncount_incident(mapper, connection, target):
+    _, tallies = _pending(object_session(target))
+    tallies[(_previous(target, 'status'), _previous(target, 'severity'))] -= 1
+
+
+def _keep_previous(target, value, oldvalue, initiator):
+    pass
+
+
+# active_history loads the old value on set even when the attribute has expired (e.g. after a commit),
+# so _previous() can tell which tally an updated incident leaves
+for _attribute in (SecurityIncident.status, SecurityIncident.severity):
+    event.listen(_attribute, 'set', _keep_previous, active_history=True)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _write_pending_rollups(session, flush_context):
+    pending = session.info.pop('security_rollups', None)
+    if pending:
+        rollups, tallies = pending
+        connection = session.connection()
+        write_rollups(connection, rollups)
+        write_tallies(connection, tallies)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_pending_rollups(session):
+    session.info.pop('security_rollups', None)
+
+
+# -------------------------- Maintenance --------------------------
+
+def prune_minute_rollups(keep_hours: int, now: datetime = None) -> int:
+    """Deletes minute rollups older than `keep_hours`; returns how many."""
+    cutoff = bucket_start((now or datetime.utcnow()) - timedelta(hours=keep_hours), 'minute')
+    result = db.session.execute(delete(_rollup_table).where(_rollup_table.c.resolution == 'minute',
+                                                            _rollup_table.c.bucket_start < cutoff))
+    db.session.commit()
+    return result.rowcount
+
+
+def rebuild_rollups(minute_hours: int, now: datetime = None) -> int:
+    """
+    Recomputes every rollup and tally from AccessLog (the hot table and its archived months),
+    SecurityPatrolLog and SecurityIncident, streaming the logs. Returns the number of rollup rows.
+    """
+    from app.partitioning import select_range # partitioning imports this module
+    minute_since = (now or datetime.utcnow()) - timedelta(hours=minute_hours)
+    rollups, tallies = Counter(), Counter()
+
+    def stream(statement):
+        return db.session.execute(statement.execution_options(yield_per=REBUILD_BATCH_SIZE))
+
+    for scan in stream(select_range('access_log')):
+        count_event(rollups, scan.access_datetime, scan_metric(scan.access_granted), scan.access_point_id,
+                    minute_since=minute_since)
+    for when, point_id in stream(select(SecurityPatrolLog.log_datetime, SecurityPatrolLog.access_point_id)):
+        if point_id is not None:
+            count_event(rollups, when, 'patrol', point_id, minute_since=minute_since)
+    for when, status, severity in stream(select(SecurityIncident.incident_datetime, SecurityIncident.status, SecurityIncident.severity)):
+        count_event(rollups, when, 'incident', severity, minute_since=minute_since)
+        tallies[(status, severity)] += 1
+
+    connection = db.session.connection()
+    connection.execute(delete(_rollup_table))
+    connection.execute(delete(_tally_table))
+    write_rollups(connection, rollups)
+    write_tallies(connection, tallies)
+    db.session.commit()
+    return len(rollups)
+
+
+@click.command('security-rollups-rebuild')
+@with_appcontext
+def security_rollups_rebuild_command():
+    """Recomputes the security dashboard rollups from the raw logs."""
+    rows = rebuild_rollups(current_app.config.get('SECURITY_MINUTE_ROLLUP_HOURS', 48))
+    click.echo(f'Rebuilt {rows} rollup rows')
+
+
+# -------------------------- Dashboard --------------------------
+
+def _gaps(patrolled, first_hour: datetime, hours: int, min_gap: int, now: datetime) -> list:
+    """Runs of at least `min_gap` consecutive hours, from `first_hour`, that aren't in `patrolled`."""
+    gaps, run_start = [], None
+    for index in range(hours + 1): # One past the end closes a run that reaches the current hour
+        hour = first_hour + timedelta(hours=index)
+        if index < hours and hour not in patrolled:
+            run_start = run_start or hour
+            continue
+        if run_start is not None and (hour - run_start) >= timedelta(hours=min_gap):
+            gaps.append({'start': run_start.isoformat(), 'end': min(hour, now).isoformat()})
+        run_start = None
+    return gaps
+
+
+def build_dashboard(now: datetime = None) -> dict:
+    config = current_app.config
+    now = now or datetime.utcnow()
+    window_hours = config.get('SECURITY_PATROL_WINDOW_HOURS', 24)
+    min_gap = config.get('SECURITY_PATROL_GAP_HOURS', 2)
+    first_minute = bucket_start(now, 'minute') - timedelta(minutes=59)
+    first_hour = bucket_start(now, 'hour') - timedelta(hours=window_hours - 1)
+
+    points = db.session.query(AccessPoint.id, AccessPoint.name, AccessPoint.is_active).order_by(AccessPoint.id).all()
+
+    last_hour = {}
+    for metric, key, count in db.session.execute(
+            select(_rollup_table.c.metric, _rollup_table.c.key, func.sum(_rollup_table.c['count']))
+            .where(_rollup_table.c.resolution == 'minute', _rollup_table.c.bucket_start >= first_minute,
+                   _rollup_table.c.metric.in_(['scan_granted', 'scan_denied']))
+            .group_by(_rollup_table.c.metric, _rollup_table.c.key)):
+        last_hour.setdefault(key, {'granted': 0, 'denied': 0})[metric[len('scan_'):]] = int(count)
+
+    by_hour = {first_hour + timedelta(hours=index): {'granted': 0, 'denied': 0} for index in range(window_hours)}
+    incidents_reported, patrolled = Counter(), {}
+    for start, metric, key, count in db.session.execute(
+            select(_rollup_table.c.bucket_start, _rollup_table.c.metric, _rollup_table.c.key, _rollup_table.c['count'])
+            .where(_rollup_table.c.resolution == 'hour', _rollup_table.c.bucket_start >= first_hour)):
+        if metric == 'patrol':
+            patrolled.setdefault(key, set()).add(start)
+        elif metric == 'incident':
+            incidents_reported[key] += count
+        elif start in by_hour:
+            by_hour[start][metric[len('scan_'):]] += count
+
+    open_incidents = Counter()
+    for severity, count in db.session.execute(
+            select(_tally_table.c.severity, _tally_table.c['count'])
+            .where(_tally_table.c.status.notin_(CLOSED_INCIDENT_STATUSES), _tally_table.c['count'] > 0)):
+        open_incidents[severity] += count
+
+    scans = [{'access_point_id': point_id, 'name': name, **last_hour[str(point_id)]}
+             for point_id, name, _ in points if str(point_id) in last_hour]
+    coverage = []
+    for point_id, name, is_active in points:
+        if not is_active:
+            continue
+        hours = patrolled.get(str(point_id), set())
+        coverage.append({'access_point_id': point_id, 'name': name,
+                         'last_patrol_hour': max(hours).isoformat() if hours else None,
+                         'gaps': _gaps(hours, first_hour, window_hours, min_gap, now)})
+    return {
+        'generated_at': now.isoformat(),
+        'scans_last_hour': sorted(scans, key=lambda row: (-row['denied'], row['access_point_id'])),
+        'scans_by_hour': [{'hour': hour.isoformat(), **counts} for hour, counts in by_hour.items()],
+        'open_incidents': dict(open_incidents),
+        'incidents_reported': dict(incidents_reported),
+        'patrol_coverage': coverage,
+    }
+
+
+@security_bp.route('/dashboard', methods=['GET'])
+@login_required
+@query_budget(5) # User, access points, minute rollups, hour rollups, incident tallies
+def dashboard():
+    if current_user.role not in (User.ROLE_ADMIN, User.ROLE_MANAGEMENT):
+        abort(403)
+    return jsonify(build_dashboard())
@@ -0,0 +1,128 @@
+"""
+Timetable clash detection over TimeSlot and CourseEnrollment.
+
+Two courses clash when time slots of theirs on the same day overlap; slots are half-open, so a class
+ending at 10:00 doesn't clash with one starting at 10:00. Slots are grouped into per-day lists sorted
+by start time, and sweep() walks a list once, comparing each slot only with the slots still running
+when it starts (a heap ordered by end time), so a typical timetable costs O(n log n) rather than a
+comparison or query per pair of courses.
+
+check_enrollment() runs when a student enrolls: one query loads the slots of the new course and of
+every course the student is enrolled in. scan_college() is the batch job behind `flask timetable-clashes`:
+one query for the college's slots, then its enrolled (student, course) pairs streamed in student order,
+each student's days swept in memory.
+"""
+import csv
+import heapq
+import sys
+from collections import defaultdict, namedtuple
+from itertools import groupby
+import click
+from flask.cli import with_appcontext
+from app import db
+from app.models import Course, CourseEnrollment, TimeSlot
+
+DAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+_DAY_NAMES = {day[:3].lower(): day for day in DAYS}
+
+SCAN_BATCH_SIZE = 5000
+
+# `start`/`end` are the overlapping part of the two slots
+Clash = namedtuple('Clash', 'course_id other_course_id day start end')
+StudentClash = namedtuple('StudentClash', 'user_id course_id other_course_id day start end')
+
+
+def normalize_day(value):
+    """'Monday', 'monday', 'Mon ' -> 'Monday'; None for anything unrecognised. day_of_week is free text."""
+    return _DAY_NAMES.get((value or '').strip()[:3].lower())
+
+
+def sweep(intervals):
+    """
+    Yields (earlier_course_id, course_id, overlap_start, overlap_end) for each overlapping pair of
+    (start, end, course_id) intervals from different courses. `intervals` must be sorted by start.
+    """
+    running = [] # Heap of (end, course_id) for intervals that started earlier
+    for start, end, course_id in intervals:
+        while running and running[0][0] <= start:
+            heapq.heappop(running)
+        for other_end, other_course_id in running:
+            if other_course_id != course_id:
+                yield other_course_id, course_id, start, min(end, other_end)
+        heapq.heappush(running, (end, course_id))
+
+
+def _slots_by_course(rows):
+    """(course_id, day_of_week, start, end) rows -> {course_id: {day: [(start, end), ...]}}."""
+    slots = defaultdict(lambda: defaultdict(list))
+    for course_id, day_of_week, start, end in rows:
+        day = normalize_day(day_of_week)
+        if day is not None and end > start:
+            slots[course_id][day].append((start, end))
+    return slots
+
+
+def _day_lists(slots, course_ids):
+    """Per-day sorted interval lists for a set of courses; only days with two or more slots can clash."""
+    days = defaultdict(list)
+    for course_id in course_ids:
+        for day, intervals in slots.get(course_id, {}).items():
+            days[day].extend((start, end, course_id) for start, end in intervals)
+    return {day: sorted(intervals) for day, intervals in days.items() if len(intervals) > 1}
+
+
+def check_enrollment(user_id, course_id):
+    """Clashes between `course_id` and the courses `user_id` is enrolled in, in day and time order."""
+    enrolled = db.session.query(CourseEnrollment.course_id)\
+        .filter(CourseEnrollment.user_id == user_id, CourseEnrollment.status == 'enrolled',
+                CourseEnrollment.course_id != course_id)
+    rows = db.session.query(TimeSlot.course_id, TimeSlot.day_of_week, TimeSlot.start_time, TimeSlot.end_time)\
+        .filter((TimeSlot.course_id == course_id) | TimeSlot.course_id.in_(enrolled.scalar_subquery()))
+    slots = _slots_by_course(rows)
+    if course_id not in slots:
+        return []
+    clashes = []
+    for day, intervals in _day_lists(slots, slots).items():
+        for first, second, start, end in sweep(intervals):
+            if course_id in (first, second):
+                clashes.append(Clash(course_id, second if first == course_id else first, day, start, end))
+    return sorted(clashes, key=lambda clash: (DAYS.index(clash.day), clash.start))
+
+
+def clash_message(clashes):
+    """Flash text naming the clashing courses."""
+    codes = dict(db.session.query(Course.id, Course.course_code)
+                 .filter(Course.id.in_({clash.other_course_id for clash in clashes})))
+    details = ', '.join(f"{codes.get(clash.other_course_id)} on {clash.day} "
+                        f"{clash.start.strftime('%H:%M')}-{clash.end.strftime('%H:%M')}" for clash in clashes)
+    return f'The course clashes with {details}.'
+
+
+def scan_college(college_id):
+    """Yields a StudentClash for each overlapping pair of slots in every student's timetable at the college."""
+    slots = _slots_by_course(
+        db.session.query(TimeSlot.course_id, TimeSlot.day_of_week, TimeSlot.start_time, TimeSlot.end_time)
+        .join(Course, TimeSlot.course_id == Course.id).filter(Course.college_id == college_id))
+    enrollments = db.session.query(CourseEnrollment.user_id, CourseEnrollment.course_id)\
+        .join(Course, CourseEnrollment.course_id == Course.id)\
+        .filter(Course.college_id == college_id, CourseEnrollment.status == 'enrolled')\
+        .order_by(CourseEnrollment.user_id)\
+        .yield_per(SCAN_BATCH_SIZE)
+    for user_id, rows in groupby(enrollments, key=lambda row: row[0]):
+        course_ids = [course_id for _, course_id in rows if course_id in slots]
+        if len(course_ids) < 2:
+            continue
+        for day, intervals in _day_lists(slots, course_ids).items():
+            for first, second, start, end in sweep(intervals):
+                yield StudentClash(user_id, first, second, day, start, end)
+
+
+@click.command('timetable-clashes')
+@click.option('--college-id', type=int, required=True)
+@with_appcontext
+def timetable_clashes_command(college_id):
+    """Writes every student timetable clash at a college as CSV."""
+    writer = csv.writer(sys.stdout)
+    writer.writerow(StudentClash._fields)
+    for clash in scan_college(college_id):
+        writer.writerow(clash)
@@ -1,6 +1,7 @@
 from app import db
 from app.models import Post, Comment, Vote, College, Report, ReportStatus, Notification # Import Notification
-from sqlalchemy import func
+from flask import has_request_context, request
+from sqlalchemy import func, select
 
 def get_target_score(target_model_name, target_id):
     """
@@ -14,9 +15,44 @@ def get_target_score(target_model_name, target_id):
         score = db.session.query(func.sum(Vote.vote_type)).filter(Vote.comment_id == target_id).scalar()
     return score or 0
 
+def get_post_list_stats(post_ids, user_id=None):
+    """
+    Returns {post_id: {'score', 'comments', 'user_vote'}} for a page of posts in a single query, instead of
+    calling get_target_score() and post.comments.count() per post. user_vote is the given user's vote_type or None.
+    """
+    if not post_ids:
+        return {}
+    score = select(func.coalesce(func.sum(Vote.vote_type), 0)).where(Vote.post_id == Post.id).scalar_subquery()
+    comments = select(func.count(Comment.id)).where(Comment.post_id == Post.id).scalar_subquery()
+    user_vote = select(Vote.vote_type).where(Vote.post_id == Post.id, Vote.user_id == user_id).scalar_subquery()
+    rows = db.session.query(Post.id, score, comments, user_vote).filter(Post.id.in_(post_ids))
+    return {post_id: {'score': post_score, 'comments': comment_count, 'user_vote': vote}
+            for post_id, post_score, comment_count, vote in rows}
+
+def _per_request(key, loader):
+    """
+    Calls loader() once per request, for helpers that the layout and the page template both use.
+    Kept in the WSGI environ rather than g, which outlives the request when an app context was already pushed.
+    """
+    if not has_request_context():
+        return loader()
+    cache = request.environ.setdefault('app.per_request', {})
+    if key not in cache:
+        cache[key] = loader()
+    return cache[key]
+
 def get_colleges_for_navbar():
-    """Returns a list of all colleges, e.g., for a navbar dropdown."""
-    return College.query.order_by(College.name).all()
+    """Returns a list of all colleges, e.g., for a navbar dropdown. Loaded once per request."""
+    return _per_request('navbar_colleges', lambda: College.query.order_by(College.name).all())
+
+def get_college_post_counts(colleges):
+    """Returns {college_id: number of posts} for the given colleges in one query."""
+    college_ids = [college.id for college in colleges]
+    if not college_ids:
+        return {}
+    rows = db.session.query(Post.college_id, func.count(Post.id)).filter(Post.college_id.in_(college_ids))\
+        .group_by(Post.college_id)
+    return dict(rows.all())
 
 def get_pending_reports_count():
     """Returns the count of reports with 'pending' status."""
@@ -31,6 +67,8 @@ def send_notification(user_id, name, payload_dict):
     """
     from app.models import Notification # Import here to avoid circular imports at startup
     from app import db # Import db instance
+    from app.metrics import count_notification
+    from flask import has_request_context
     import json
 
     notification = Notification(
@@ -39,6 +77,8 @@ def send_notification(user_id, name, payload_dict):
         payload_json=json.dumps(payload_dict)
     )
     db.session.add(notification)
+    if has_request_context():
+        count_notification() # Feeds the per-request notification_fanout histogram
     # db.session.commit() # Commit will be handled by the calling route's commit, or a background task
     # For now, let's assume the caller handles the commit. If not, uncommenting is an option.
     return notification
@@ -46,6 +86,17 @@ def send_notification(user_id, name, payload_dict):
 def get_unread_notifications_count():
     """Returns the count of unread notifications for the current user."""
     from flask_login import current_user
-    if current_user.is_authenticated:
-        return Notification.query.filter_by(user_id=current_user.id, is_read=False).count()
-    return 0
+    if not current_user.is_authenticated:
+        return 0
+    return _per_request('unread_notifications', # The navbar badge and the notifications page both ask
+                        lambda: Notification.query.filter_by(user_id=current_user.id, is_read=False).count())
+
+def prefix_criteria(column, prefix):
+    """
+    Returns criteria matching values of `column` that start with `prefix`.
+    Expressed as a half-open range rather than LIKE 'prefix%' so any b-tree index on the column
+    is used on every backend (SQLite only uses indexes for LIKE under case_sensitive_like).
+    Matching is therefore case-sensitive.
+    """
+    from sqlalchemy import and_
+    return and_(column >= prefix, column < prefix + '\uffff')
@@ -0,0 +1,156 @@
+"""
+Deterministic data generator for the benchmark database.
+
+The same (scale, seed) always produces the same rows, so results from different commits are comparable.
+Rows are written with Core executemany inserts in batches rather than through the ORM, which keeps the
+'full' scale (100k users, 1M posts/comments/votes) to minutes rather than hours.
+"""
+import random
+from datetime import date, datetime, timedelta
+from werkzeug.security import generate_password_hash
+
+SCALES = {
+    'tiny': dict(colleges=3, users=300, posts=2000, comments=4000, votes=4000, courses_per_college=5,
+                 enrollments_per_student=3, attendance_days=5, reels=200, notifications_per_user=3, follows_per_user=5),
+    'small': dict(colleges=10, users=10000, posts=100000, comments=100000, votes=100000, courses_per_college=40,
+                  enrollments_per_student=4, attendance_days=10, reels=5000, notifications_per_user=5, follows_per_user=10),
+    'full': dict(colleges=50, users=100000, posts=1000000, comments=1000000, votes=1000000, courses_per_college=100,
+                 enrollments_per_student=4, attendance_days=10, reels=50000, notifications_per_user=5, follows_per_user=10),
+}
+
+BENCH_PASSWORD = 'benchmark'
+BENCH_USERNAME = 'bench_faculty' # User 1: faculty at college 1, enrolled nowhere, used to drive every scenario
+BASE_TIME = datetime(2024, 1, 1)
+WORDS = ('exam campus library lecture project deadline hackathon club sports thesis lab professor internship '
+         'semester grades housing cafeteria event research startup robotics music theatre debate alumni').split()
+
+
+def _text(rng, n_words):
+    return ' '.join(rng.choice(WORDS) for _ in range(n_words))
+
+
+def _insert(table, rows, batch_size):
+    """Inserts an iterable of row dicts in batches, committing each batch."""
+    from app import db
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            db.session.execute(table.insert(), batch)
+            db.session.commit()
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+        db.session.commit()
+
+
+def generate(scale, seed: int = 42, batch_size: int = 5000, log=print) -> dict:
+    """
+    Populates the (empty) database for `scale`, a SCALES key or a dict with the same keys.
+    Returns the row counts per table. IDs are assigned densely from 1 in insertion order.
+    Models are imported here so that reading SCALES doesn't import the app.
+    """
+    from app.models import (User, College, Post, Comment, Vote, Course, CourseEnrollment, AttendanceRecord,
+                            Reel, Notification, followers)
+    params = SCALES[scale] if isinstance(scale, str) else scale
+    rng = random.Random(seed)
+    password_hash = generate_password_hash(BENCH_PASSWORD) # Hashing is slow; every user shares one
+    n_colleges, n_users = params['colleges'], params['users']
+    n_courses = n_colleges * params['courses_per_college']
+    counts = {}
+
+    log(f'colleges: {n_colleges}')
+    _insert(College.__table__, ({'id': i, 'name': f'College {i:03d}', 'location': f'City {i % 17}'}
+                                for i in range(1, n_colleges + 1)), batch_size)
+    counts['college'] = n_colleges
+
+    def user_rows():
+        for i in range(1, n_users + 1):
+            role = User.ROLE_FACULTY if i == 1 or i % 50 == 0 else User.ROLE_STUDENT
+            yield {'id': i, 'username': BENCH_USERNAME if i == 1 else f'user{i:06d}', 'email': f'user{i}@example.edu',
+                   'password_hash': password_hash, 'college_id': 1 if i == 1 else rng.randint(1, n_colleges),
+                   'role': role, 'is_college_verified': True, 'timestamp': BASE_TIME + timedelta(minutes=i),
+                   'last_seen': BASE_TIME + timedelta(days=30), 'bio': _text(rng, 8)}
+    log(f'users: {n_users}')
+    _insert(User.__table__, user_rows(), batch_size)
+    counts['user'] = n_users
+
+    def follow_rows():
+        for follower in range(1, n_users + 1):
+            for followed in sorted({rng.randint(1, n_users) for _ in range(params['follows_per_user'])} - {follower}):
+                yield {'follower_id': follower, 'followed_id': followed}
+    _insert(followers, follow_rows(), batch_size)
+
+    def post_rows():
+        for i in range(1, params['posts'] + 1):
+            yield {'id': i, 'title': _text(rng, 6).capitalize(), 'content': _text(rng, 40),
+                   'timestamp': BASE_TIME + timedelta(seconds=i * 30), 'user_id': rng.randint(1, n_users),
+                   'college_id': 1 if i % 10 == 0 else rng.randint(1, n_colleges)} # College 1 gets extra traffic
+    log(f'posts: {params["posts"]}')
+    _insert(Post.__table__, post_rows(), batch_size)
+    counts['post'] = params['posts']
+
+    def comment_rows():
+        for i in range(1, params['comments'] + 1):
+            # Skewed so a few posts are hot, which is where per-comment N+1 queries hurt
+            post_id = min(params['posts'], int(rng.paretovariate(1.2))) if i % 2 else rng.randint(1, params['posts'])
+            yield {'id': i, 'content': _text(rng, 15), 'timestamp': BASE_TIME + timedelta(seconds=i * 31),
+                   'user_id': rng.randint(1, n_users), 'post_id': post_id}
+    log(f'comments: {params["comments"]}')
+    _insert(Comment.__table__, comment_rows(), batch_size)
+    counts['comment'] = params['comments']
+
+    def vote_rows():
+        seen = set()
+        while len(seen) < params['votes']:
+            user_id, post_id = rng.randint(2, n_users), rng.randint(1, params['posts'])
+            if (user_id, post_id) in seen:
+                continue
+            seen.add((user_id, post_id))
+            yield {'user_id': user_id, 'post_id': post_id, 'vote_type': 1 if rng.random() < 0.8 else -1}
+    log(f'votes: {params["votes"]}')
+    _insert(Vote.__table__, vote_rows(), batch_size)
+    counts['vote'] = params['votes']
+
+    def course_rows():
+        for i in range(1, n_courses + 1):
+            college_id = (i - 1) // params['courses_per_college'] + 1
+            yield {'id': i, 'name': f'{_text(rng, 2).title()} {i}', 'course_code': f'C{i:05d}',
+                   'description': _text(rng, 20), 'instructor': f'Prof {i % 97}', 'college_id': college_id, 'capacity': 200}
+    _insert(Course.__table__, course_rows(), batch_size)
+    counts['course'] = n_courses
+
+    enrollments = []
+    for user_id in range(2, n_users + 1):
+        course_ids = {rng.randint(1, n_courses) for _ in range(params['enrollments_per_student'])}
+        if user_id <= 200:
+            course_ids.add(1) # Course 1 (taught at college 1) gets a full roster so take_attendance has real work to do
+        enrollments.extend((user_id, course_id) for course_id in sorted(course_ids))
+    log(f'enrollments: {len(enrollments)}')
+    _insert(CourseEnrollment.__table__, ({'user_id': u, 'course_id': c, 'status': 'enrolled',
+                                          'enrollment_date': BASE_TIME} for u, c in enrollments), batch_size)
+    counts['course_enrollment'] = len(enrollments)
+
+    statuses = ('present', 'present', 'present', 'absent', 'late', 'excused')
+    def attendance_rows():
+        for user_id, course_id in enrollments:
+            for day in range(params['attendance_days']):
+                yield {'user_id': user_id, 'course_id': course_id, 'date': date(2024, 1, 8) + timedelta(days=day),
+                       'status': rng.choice(statuses), 'marked_by_id': 1, 'timestamp': BASE_TIME}
+    log(f'attendance: {len(enrollments) * params["attendance_days"]}')
+    _insert(AttendanceRecord.__table__, attendance_rows(), batch_size)
+    counts['attendance_record'] = len(enrollments) * params['attendance_days']
+
+    _insert(Reel.__table__, ({'id': i, 'user_id': rng.randint(1, n_users), 'college_id': rng.randint(1, n_colleges),
+                              'video_url': f'https://videos.example.edu/{i}.mp4', 'caption': _text(rng, 10),
+                              'timestamp': BASE_TIME + timedelta(minutes=i), 'views_count': rng.randint(0, 5000)}
+                             for i in range(1, params['reels'] + 1)), batch_size)
+    counts['reel'] = params['reels']
+
+    n_notifications = n_users * params['notifications_per_user']
+    _insert(Notification.__table__, ({'user_id': i // params['notifications_per_user'] + 1, 'name': 'new_comment',
+                                      'payload_json': '{"post_id": %d}' % rng.randint(1, params['posts']),
+                                      'timestamp': BASE_TIME + timedelta(minutes=i), 'is_read': rng.random() < 0.5}
+                                     for i in range(n_notifications)), batch_size)
+    counts['notification'] = n_notifications
+    return counts
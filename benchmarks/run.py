@@ -0,0 +1,204 @@
+"""
+Benchmarks the hot routes against a generated database and writes the results as JSON.
+
+    python -m benchmarks.run --scale small --out results/abc123.json
+    python -m benchmarks.run --scale small --baseline results/main.json   # exits 1 on a regression
+    python -m benchmarks.run --compare results/main.json results/abc123.json
+
+The database is generated on the first run for a (scale, seed) and reused afterwards, so every commit is
+measured against identical data; delete the file after schema changes. Query counts come from the X-DB-Query-Count header
+(see app/instrumentation.py), so they are exact; latencies are medians over --repeat requests after warm-up.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from config import Config
+
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_{scale}_{seed}.db')
+
+# name -> (method, url); all requests are made as the generated faculty user at college 1.
+SCENARIOS = {
+    'index': ('GET', '/index'),
+    'view_post_hot': ('GET', '/post/1'), # Comment ids are Pareto-skewed toward post 1
+    'view_post_cold': ('GET', '/post/{cold_post}'),
+    'search': ('GET', '/search?query=hackathon'),
+    'vote': ('POST', '/vote/post/{cold_post}/upvote'), # Alternates between adding and removing the vote
+    'take_attendance': ('GET', '/course/1/take_attendance'),
+    'reels_feed': ('GET', '/reels_feed'),
+    'list_notifications': ('GET', '/notifications'),
+}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class BenchmarkConfig(Config):
+    RATELIMIT_ENABLED = False
+    SQL_DEBUG_HEADERS = True
+    WTF_CSRF_ENABLED = False
+
+
+def load_app(db_path):
+    """Builds the app against the SQLite file at `db_path`."""
+    from app import create_app, db
+
+    class BenchmarkDBConfig(BenchmarkConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{db_path}'
+    return create_app(BenchmarkDBConfig), db
+
+
+def prepare_database(app, db, scale, seed, db_path, log=print):
+    from benchmarks.datagen import generate
+    with app.app_context():
+        if os.path.exists(db_path) and db.inspect(db.engine).has_table('user'):
+            log(f'Reusing {db_path}')
+            return None
+        db.create_all()
+        started = time.perf_counter()
+        counts = generate(scale, seed=seed, log=log)
+        log(f'Generated in {time.perf_counter() - started:.1f}s')
+        return counts
+
+
+class ScenarioFailed(RuntimeError):
+    """A measured request didn't succeed, so its timings would describe an error page."""
+
+
+def run_scenarios(app, names, repeat, warmup, params) -> dict:
+    """
+    Times each scenario. Raises ScenarioFailed as soon as any request (warm-up included) answers with
+    anything but 2xx or 3xx.
+    """
+    from benchmarks.datagen import BENCH_USERNAME, BENCH_PASSWORD
+    client = app.test_client()
+    response = client.post('/login', data={'email_or_username': BENCH_USERNAME, 'password': BENCH_PASSWORD})
+    if response.status_code != 302:
+        raise RuntimeError(f'Login as {BENCH_USERNAME} failed with status {response.status_code}')
+    results = {}
+    for name in names:
+        method, url = SCENARIOS[name]
+        url = url.format(**params)
+        timings, queries, statuses = [], [], set()
+        for i in range(warmup + repeat):
+            started = time.perf_counter()
+            response = client.open(url, method=method)
+            elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code >= 400:
+                raise ScenarioFailed(f'{name}: {method} {url} returned {response.status_code}')
+            if i >= warmup:
+                timings.append(elapsed)
+                queries.append(int(response.headers.get('X-DB-Query-Count', -1)))
+                statuses.add(response.status_code)
+        results[name] = {'method': method, 'url': url, 'requests': repeat, 'status': sorted(statuses),
+                         'median_ms': round(statistics.median(timings), 3), 'p95_ms': round(_percentile(timings, 95), 3),
+                         'min_ms': round(min(timings), 3), 'max_ms': round(max(timings), 3),
+                         'queries': max(queries), 'queries_min': min(queries)}
+    return results
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """
+    Regressions in `current` relative to `baseline`: more queries on any route, or a median latency more
+    than `threshold` (a fraction) slower. Returns a list of human-readable lines; empty means no regressions.
+    """
+    regressions = []
+    for name, now in current['routes'].items():
+        before = baseline['routes'].get(name)
+        if before is None:
+            continue
+        if now['queries'] > before['queries']:
+            regressions.append(f"{name}: queries {before['queries']} -> {now['queries']}")
+        if before['median_ms'] and now['median_ms'] > before['median_ms'] * (1 + threshold):
+            regressions.append(f"{name}: median {before['median_ms']:.1f}ms -> {now['median_ms']:.1f}ms "
+                               f"(+{(now['median_ms'] / before['median_ms'] - 1) * 100:.0f}%)")
+    return regressions
+
+
+def print_table(results: dict, baseline: dict = None):
+    print(f"{'route':<20} {'status':<10} {'queries':>8} {'median ms':>10} {'p95 ms':>10}" + ('  vs baseline' if baseline else ''))
+    for name, row in results['routes'].items():
+        line = f"{name:<20} {','.join(map(str, row['status'])):<10} {row['queries']:>8} {row['median_ms']:>10.2f} {row['p95_ms']:>10.2f}"
+        before = (baseline or {}).get('routes', {}).get(name)
+        if before:
+            line += f"  queries {before['queries']}->{row['queries']}, median {before['median_ms']:.2f}->{row['median_ms']:.2f}"
+        print(line)
+
+
+def main(argv=None):
+    from benchmarks.datagen import SCALES
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=sorted(SCALES), default='tiny')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', help='SQLite file to generate or reuse (default: benchmarks/bench_<scale>_<seed>.db)')
+    parser.add_argument('--routes', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--out', help='Write results JSON here')
+    parser.add_argument('--baseline', help='Results JSON from an earlier commit to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed median slowdown before it counts as a regression')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='Only compare two results files')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        print_table(current, baseline)
+        regressions = compare(baseline, current, args.threshold)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        return 1 if regressions else 0
+
+    db_path = os.path.abspath(args.db or DEFAULT_DB.format(scale=args.scale, seed=args.seed))
+    app, db = load_app(db_path)
+    prepare_database(app, db, args.scale, args.seed, db_path)
+    params = {'cold_post': SCALES[args.scale]['posts'] // 2}
+    import sqlalchemy
+    results = {
+        'commit': _git_commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'scale': args.scale, 'seed': args.seed, 'repeat': args.repeat,
+    }
+    try:
+        results['routes'] = run_scenarios(app, args.routes, args.repeat, args.warmup, params)
+    except ScenarioFailed as exc:
+        print(f'FAILED {exc}', file=sys.stderr)
+        return 2
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if baseline:
+        regressions = compare(baseline, results, args.threshold)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
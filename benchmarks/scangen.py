@@ -0,0 +1,95 @@
+"""
+Synthetic RFID scan streams for the anomaly detector (app/anomaly.py), and a throughput benchmark for it.
+
+    python -m benchmarks.scangen --readers 50 --cards 20000 --scans 500000
+
+campus() lays readers out in a line, `spacing` meters apart. normal_traffic() produces scans that must
+raise no anomaly: every card stays at its home reader and scans there at most once per
+len(cards) / rate seconds. The inject_* helpers return the scans of one anomaly of their kind; mix them
+into normal traffic with dedicated cards (or unknown uids) so the expected anomalies are exactly the
+injected ones. Scans are (reader_id, card_uid, scanned_at) tuples, as ingest_scans() takes them, and
+the same seed always produces the same stream.
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+BASE_TIME = datetime(2024, 1, 1, 8)
+METERS_PER_DEGREE = 111320 # Of latitude; readers are laid out north-south so longitude doesn't matter
+
+
+def campus(readers: int, spacing: float = 200.0, origin=(12.9716, 77.5946)) -> list:
+    """AccessPoint column values for `readers` readers, each `spacing` meters north of the last."""
+    return [{'reader_id': f'R{index:03d}', 'name': f'Reader {index}',
+             'latitude': origin[0] + index * spacing / METERS_PER_DEGREE, 'longitude': origin[1]}
+            for index in range(readers)]
+
+
+def normal_traffic(reader_ids, card_uids, start: datetime = BASE_TIME, scans: int = 1000, rate: float = 50.0,
+                   min_repeat_seconds: float = 60.0, seed: int = 0) -> list:
+    """`scans` scans at `rate` per second of cards at their home readers; raises nothing."""
+    if len(card_uids) / rate < min_repeat_seconds:
+        raise ValueError(f'{len(card_uids)} cards at {rate}/s repeat a card within {min_repeat_seconds}s; use more cards')
+    rng = random.Random(seed)
+    order = list(card_uids)
+    rng.shuffle(order)
+    home = {card_uid: rng.choice(reader_ids) for card_uid in order}
+    step = timedelta(seconds=1 / rate)
+    return [(home[order[index % len(order)]], order[index % len(order)], start + index * step) for index in range(scans)]
+
+
+def inject_denial_burst(reader_id: str, at: datetime, count: int = 5, seconds: float = 10.0) -> list:
+    """`count` scans of unknown cards at one reader within `seconds`."""
+    return [(reader_id, f'UNKNOWN-{reader_id}-{at:%H%M%S}-{index}', at + timedelta(seconds=seconds * index / count))
+            for index in range(count)]
+
+
+def inject_impossible_travel(card_uid: str, from_reader: str, to_reader: str, at: datetime, seconds: float = 5.0) -> list:
+    return [(from_reader, card_uid, at), (to_reader, card_uid, at + timedelta(seconds=seconds))]
+
+
+def inject_passback(card_uid: str, reader_id: str, at: datetime, seconds: float = 5.0) -> list:
+    return [(reader_id, card_uid, at), (reader_id, card_uid, at + timedelta(seconds=seconds))]
+
+
+def decided(scans, readers) -> list:
+    """AnomalyDetector input for `scans`, with readers {reader_id: ReaderState}; cards named UNKNOWN-* are denied."""
+    return [(scanned_at, readers[reader_id], None if card_uid.startswith('UNKNOWN-') else card_uid,
+             not card_uid.startswith('UNKNOWN-')) for reader_id, card_uid, scanned_at in scans]
+
+
+def main(argv=None):
+    from app.anomaly import AnomalyDetector
+    from app.rfid import ReaderState
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=50)
+    parser.add_argument('--cards', type=int, default=20000)
+    parser.add_argument('--scans', type=int, default=500000)
+    parser.add_argument('--rate', type=float, default=200.0, help='Simulated scans per second')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    points = campus(args.readers)
+    readers = {point['reader_id']: ReaderState(index, True, point['name'], point['latitude'], point['longitude'])
+               for index, point in enumerate(points, start=1)}
+    cards = [f'CARD{index:06d}' for index in range(args.cards)]
+    scans = normal_traffic([point['reader_id'] for point in points], cards, scans=args.scans, rate=args.rate, seed=args.seed)
+    middle = scans[len(scans) // 2][2]
+    scans += inject_denial_burst(points[0]['reader_id'], middle)
+    scans += inject_impossible_travel('INJECTED-TRAVEL', points[0]['reader_id'], points[-1]['reader_id'], middle)
+    scans += inject_passback('INJECTED-PASSBACK', points[1]['reader_id'], middle)
+    observed = decided(scans, readers)
+
+    detector = AnomalyDetector()
+    started = time.perf_counter()
+    anomalies = detector.observe_batch(observed)
+    elapsed = time.perf_counter() - started
+    print(f'{len(observed)} scans in {elapsed:.2f}s ({len(observed) / elapsed:,.0f} scans/s); '
+          f'anomalies: {", ".join(sorted(anomaly.kind for anomaly in anomalies)) or "none"}')
+    return 0 if len(anomalies) == 3 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+Measures cold-start time: a fresh interpreter importing the app package, building it with create_app()
+and serving one request, as a serverless (vercel.json) instance does on its first hit.
+
+    python -m benchmarks.startup --runs 10 --out bench-results/startup.json
+    CHATBOT_ENABLED=0 python -m benchmarks.startup      # without the chatbot blueprint
+    python -m benchmarks.startup --importtime           # also list the slowest imports
+
+Each run is a separate process so nothing is cached in sys.modules; the OS file cache is warm after the
+first run, which the --warmup runs absorb.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, time
+started = time.perf_counter()
+from app import create_app
+from config import Config
+imported = time.perf_counter()
+application = create_app(Config)
+created = time.perf_counter()
+application.test_client().get('/metrics')
+served = time.perf_counter()
+print(json.dumps({'import_ms': (imported - started) * 1000, 'create_app_ms': (created - imported) * 1000,
+                  'first_request_ms': (served - created) * 1000}))
+"""
+
+
+def _child_env():
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', 'sqlite://') # Startup shouldn't depend on (or create) a database file
+    return env
+
+
+def run_once() -> dict:
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', PROBE], cwd=REPO_ROOT, env=_child_env(),
+                            capture_output=True, text=True, check=True)
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['process_ms'] = (time.perf_counter() - started) * 1000 # Includes interpreter startup and teardown
+    return timings
+
+
+def slowest_imports(limit: int = 15) -> list:
+    """The top-level-ish imports with the largest cumulative time, from python -X importtime."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'from app import create_app; create_app()'],
+                            cwd=REPO_ROOT, env=_child_env(), capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, self_us, cumulative_us, module = (part.strip() for part in line.replace('import time:', '|').split('|'))
+        rows.append({'module': module.strip(), 'cumulative_ms': int(cumulative_us) / 1000})
+    return sorted(rows, key=lambda row: row['cumulative_ms'], reverse=True)[:limit]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--importtime', action='store_true', help='Also report the slowest imports')
+    parser.add_argument('--out', help='Write results JSON here')
+    args = parser.parse_args(argv)
+
+    for _ in range(args.warmup):
+        run_once()
+    runs = [run_once() for _ in range(args.runs)]
+    results = {'runs': args.runs, 'chatbot_enabled': os.environ.get('CHATBOT_ENABLED', '1')}
+    for key in ('import_ms', 'create_app_ms', 'first_request_ms', 'process_ms'):
+        values = [run[key] for run in runs]
+        results[key] = {'median': round(statistics.median(values), 1), 'min': round(min(values), 1),
+                        'max': round(max(values), 1)}
+        print(f"{key:<18} median {results[key]['median']:>8.1f}  min {results[key]['min']:>8.1f}  max {results[key]['max']:>8.1f}")
+    if args.importtime:
+        results['slowest_imports'] = slowest_imports()
+        for row in results['slowest_imports']:
+            print(f"  {row['cumulative_ms']:>8.1f} ms  {row['module']}")
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,33 @@
 import pytest
-from app import app as flask_app, db
+from app import create_app, db
 from app.models import User, College, Post, Comment # Import your models
 from config import TestConfig # Import the TestConfig
+from app.instrumentation import perf_registry
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', "allow_query_budget_overrun: don't fail the test when a request exceeds its view's @query_budget")
+
+
+@pytest.fixture(autouse=True)
+def query_budget_guard(request):
+    """
+    Fails any test whose test-client requests issued more queries than the view's @query_budget allows
+    (declared next to the routes in app/routes.py), so N+1 regressions in views or templates show up in CI.
+    """
+    perf_registry.budget_violations.clear()
+    yield
+    violations = list(perf_registry.budget_violations)
+    if violations and not request.node.get_closest_marker('allow_query_budget_overrun'):
+        lines = [f"{v['path']} ({v['endpoint']}): {v['queries']} queries, budget {v['budget']}" for v in violations]
+        for v in violations:
+            lines.extend(f'    {n}x {statement}' for statement, n in v['duplicates'].items())
+        pytest.fail('Query budget exceeded:\n' + '\n'.join(lines), pytrace=False)
 
 @pytest.fixture(scope='session')
 def app():
     """Session-wide test Flask application."""
-    flask_app.config.from_object(TestConfig)
+    flask_app = create_app(TestConfig)
 
     # Establish an application context before creating the test database tables
     with flask_app.app_context():
@@ -0,0 +1,122 @@
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy.exc import OperationalError
+from app import db
+from app.anomaly import AnomalyDetector, current_detector, distance_meters
+from app.models import User, AccessLog, AccessPoint, IncidentTally, RFIDCard, SecurityIncident
+from app.rfid import ReaderState, directory, ingest_scans
+from benchmarks.scangen import (campus, decided, inject_denial_burst, inject_impossible_travel, inject_passback,
+                                normal_traffic)
+
+NOW = datetime(2024, 3, 4, 9, 0)
+POINTS = campus(4, spacing=500)
+READERS = {point['reader_id']: ReaderState(index, True, point['name'], point['latitude'], point['longitude'])
+           for index, point in enumerate(POINTS, start=1)}
+READER_IDS = list(READERS)
+
+
+def kinds(anomalies):
+    return [(anomaly.kind, anomaly.access_point_id, anomaly.card_uid) for anomaly in anomalies]
+
+
+def test_distance():
+    assert distance_meters(READERS['R000'], READERS['R002']) == pytest.approx(1000, rel=0.01)
+    assert distance_meters(READERS['R000'], ReaderState(9, True)) is None
+
+
+def test_normal_traffic_raises_nothing_and_injections_are_found():
+    scans = normal_traffic(READER_IDS, [f'CARD{i}' for i in range(500)], start=NOW, scans=5000, rate=5, seed=3)
+    injected_at = NOW + timedelta(minutes=5)
+    assert AnomalyDetector().observe_batch(decided(scans, READERS)) == []
+
+    scans += inject_denial_burst('R001', injected_at)
+    scans += inject_impossible_travel('TRAVELLER', 'R000', 'R003', injected_at, seconds=60) # 1.5km in a minute
+    scans += inject_passback('LENDER', 'R002', injected_at)
+    anomalies = AnomalyDetector().observe_batch(decided(scans, READERS))
+    assert sorted(kinds(anomalies)) == [('denial_burst', 2, None), ('impossible_travel', 4, 'TRAVELLER'), ('tailgating', 3, 'LENDER')]
+
+
+def test_thresholds():
+    detector = AnomalyDetector(denial_window=60, denial_threshold=3, max_speed=7, min_distance=100, passback_window=30)
+    reader, far = READERS['R000'], READERS['R001']
+    observe = lambda seconds, point, card, granted: kinds(detector.observe(NOW + timedelta(seconds=seconds), point, card, granted))
+
+    # Denials spread wider than the window never make a burst; one burst is reported per window
+    assert observe(0, reader, None, False) == observe(61, reader, None, False) == observe(90, reader, None, False) == []
+    assert observe(100, reader, None, False) == [('denial_burst', 1, None)]
+    assert observe(101, reader, None, False) == []
+
+    # 500m at 7 m/s takes ~72s
+    assert observe(200, reader, 'WALKER', True) == []
+    assert observe(280, far, 'WALKER', True) == []
+    assert observe(300, reader, 'WALKER', True) == [('impossible_travel', 1, 'WALKER')]
+
+    # A pair within the passback window is reported once; a third scan starts a new pair
+    assert observe(400, reader, 'LENDER', True) == []
+    assert observe(440, reader, 'LENDER', True) == []
+    assert observe(450, reader, 'LENDER', True) == [('tailgating', 1, 'LENDER')]
+    assert observe(455, reader, 'LENDER', True) == []
+
+
+@pytest.fixture
+def gates(app, init_database, monkeypatch):
+    monkeypatch.setitem(app.config, 'ANOMALY_DENIAL_THRESHOLD', 3)
+    user = User(username='anomaly_holder', email='anomaly_holder@example.com')
+    db.session.add(user)
+    db.session.commit()
+    db.session.add_all([AccessPoint(**point) for point in POINTS] + [RFIDCard(card_uid='CARD-1', user_id=user.id)])
+    db.session.commit()
+    directory.clear()
+    app.extensions.pop('anomaly_detector', None)
+    yield
+    directory.clear()
+    app.extensions.pop('anomaly_detector', None)
+
+
+def test_ingest_opens_incidents(app, gates, monkeypatch):
+    assert current_detector().denial_threshold == 3
+    result = ingest_scans(inject_denial_burst('R000', NOW, count=3) + inject_passback('CARD-1', 'R001', NOW))
+    assert result['incidents'] == 2
+    incidents = SecurityIncident.query.order_by(SecurityIncident.incident_type).all()
+    assert [(incident.incident_type, incident.severity, incident.location_description) for incident in incidents] == [
+        ('denial_burst', 'medium', 'Reader 0'), ('tailgating', 'medium', 'Reader 1')]
+    assert db.session.get(IncidentTally, ('reported', 'medium')).count == 2
+
+    # The detector remembers CARD-1 across batches
+    result = ingest_scans([('R003', 'CARD-1', NOW + timedelta(seconds=30))])
+    assert result['incidents'] == 1
+    assert SecurityIncident.query.filter_by(incident_type='impossible_travel').one().severity == 'high'
+
+    monkeypatch.setitem(app.config, 'ANOMALY_DETECTION', False)
+    assert ingest_scans(inject_denial_burst('R002', NOW, count=3))['incidents'] == 0
+
+
+def failing_commit(monkeypatch, on_call):
+    """Makes only the `on_call`th db.session.commit() from now raise, like a lost connection."""
+    commit, calls = db.session.commit, []
+    def commit_or_fail():
+        calls.append(None)
+        if len(calls) == on_call:
+            raise OperationalError('COMMIT', {}, Exception('connection lost'))
+        commit()
+    monkeypatch.setattr(db.session, 'commit', commit_or_fail)
+
+
+def test_failed_batch_is_not_observed_so_a_retry_reports_it(gates, monkeypatch):
+    batch = inject_denial_burst('R000', NOW, count=3) + inject_passback('CARD-1', 'R001', NOW)
+    failing_commit(monkeypatch, on_call=1)
+    with pytest.raises(OperationalError):
+        ingest_scans(batch)
+    db.session.rollback()
+    assert AccessLog.query.count() == 0
+
+    assert ingest_scans(batch)['incidents'] == 2
+    assert SecurityIncident.query.count() == 2
+
+
+def test_incident_commit_failure_keeps_the_scans(gates, monkeypatch, caplog):
+    failing_commit(monkeypatch, on_call=2)
+    result = ingest_scans(inject_passback('CARD-1', 'R001', NOW))
+    assert (result['logged'], result['incidents']) == (2, 0)
+    assert AccessLog.query.count() == 2 and SecurityIncident.query.count() == 0
+    assert 'Could not open security incidents for 1 anomalies: tailgating at 2024-03-04 09:00:05' in caplog.text
@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+from app import create_app
+from config import TestConfig
+
+
+class NoChatbotConfig(TestConfig):
+    CHATBOT_ENABLED = False
+
+
+def test_create_app_registers_routes_on_each_app():
+    first, second = create_app(TestConfig), create_app(TestConfig)
+    for flask_app in (first, second):
+        endpoints = set(flask_app.view_functions)
+        assert {'index', 'login', 'vote', 'chatbot.chat_api', 'metrics.metrics_endpoint'} <= endpoints
+    assert first.view_functions['index'] is second.view_functions['index']
+
+
+def test_chatbot_can_be_disabled():
+    flask_app = create_app(NoChatbotConfig)
+    assert 'chatbot' not in flask_app.blueprints
+    assert flask_app.test_client().post('/chatbot/chat', json={'message': 'hi'}).status_code == 404
+
+
+def test_gemini_client_is_imported_lazily():
+    probe = ("import sys, app.chatbot; "
+             "print(type(sys.modules['google.generativeai']).__name__)")
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', probe], cwd=repo_root, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '_LazyModule'
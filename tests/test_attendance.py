@@ -0,0 +1,203 @@
+import pytest
+from datetime import date, timedelta
+from app import db, routes
+from app.models import User, College, Course, CourseEnrollment, AttendanceRecord
+
+FIRST_DAY = date(2023, 9, 1)
+
+
+def login(client, username):
+    client.get('/logout')
+    return client.post('/login', data={'email_or_username': username, 'password': 'password'})
+
+
+@pytest.fixture
+def register(app, init_database):
+    college = College(name='Attendance College')
+    db.session.add(college)
+    db.session.commit()
+    faculty = User(username='att_faculty', email='att_faculty@example.com', role=User.ROLE_FACULTY, college_id=college.id)
+    students = [User(username=f'att_{name}', email=f'att_{name}@example.com', college_id=college.id)
+                for name in ('bob', 'alice')]
+    for user in [faculty] + students:
+        user.set_password('password')
+    courses = [Course(name='Biology', course_code='BIO1', college_id=college.id),
+               Course(name='Algebra', course_code='ALG1', college_id=college.id)]
+    db.session.add_all([faculty] + students + courses)
+    db.session.commit()
+    return faculty, students, courses
+
+
+@pytest.fixture
+def rendered(monkeypatch):
+    """Template contexts the views render, by template name; the tests look at records, not markup."""
+    contexts = {}
+    def capture(template, **context):
+        contexts[template] = context
+        return ''
+    monkeypatch.setattr(routes, 'render_template', capture)
+    return contexts
+
+
+def flashes(client):
+    with client.session_transaction() as session:
+        return [message for _, message in session.get('_flashes', [])]
+
+
+def mark(student, course, days, status='present', marker=None):
+    db.session.add_all([AttendanceRecord(user_id=student.id, course_id=course.id, date=FIRST_DAY + timedelta(days=day),
+                                         status=status, marked_by_id=marker.id if marker else None) for day in days])
+    db.session.commit()
+
+
+def test_course_attendance_is_paginated(client, register, rendered):
+    faculty, (bob, alice), (biology, _) = register
+    mark(bob, biology, range(30), marker=faculty) # One more page than ATTENDANCE_PER_PAGE
+    login(client, 'att_faculty')
+
+    assert client.get(f'/course/{biology.id}/view_attendance').status_code == 200
+    page = rendered['view_attendance_course.html']
+    assert (page['pagination'].total, page['pagination'].pages) == (30, 2)
+    assert [record.date for record in page['records']] == [FIRST_DAY + timedelta(days=day) for day in range(29, 4, -1)]
+    client.get(f'/course/{biology.id}/view_attendance?page=2')
+    assert [record.date for record in rendered['view_attendance_course.html']['records']] == [
+        FIRST_DAY + timedelta(days=day) for day in range(4, -1, -1)]
+
+    # Filters apply before paging and are carried into the pagination and export links
+    client.get(f'/course/{biology.id}/view_attendance?start_date=2023-09-25&end_date=bad')
+    page = rendered['view_attendance_course.html']
+    assert page['pagination'].total == 6
+    assert page['filter_args'] == {'start_date': '2023-09-25'}
+    assert flashes(client)[-1] == 'Invalid end date format. Please use YYYY-MM-DD.'
+
+
+def test_user_attendance_filters_by_course_and_dates(client, register, rendered):
+    faculty, (bob, alice), (biology, algebra) = register
+    mark(bob, biology, range(3))
+    mark(bob, algebra, range(3), status='absent')
+    login(client, 'att_bob')
+
+    client.get(f'/user/att_bob/attendance?course_id={algebra.id}&end_date=2023-09-02')
+    page = rendered['view_attendance_user.html']
+    assert [(record.course.name, record.date) for record in page['records']] == [
+        ('Algebra', FIRST_DAY + timedelta(days=1)), ('Algebra', FIRST_DAY)]
+    assert page['form'].course_id.data == algebra
+    assert page['course_filter_typeahead'] is False
+
+    response = client.get('/user/att_alice/attendance')
+    assert response.status_code == 302
+    assert flashes(client)[-1] == 'You do not have permission to view this attendance report.'
+
+
+def test_export_course_attendance_csv(client, register):
+    faculty, (bob, alice), (biology, _) = register
+    mark(bob, biology, [0, 7], marker=faculty)
+    mark(alice, biology, [7], status='absent', marker=faculty)
+    login(client, 'att_faculty')
+
+    response = client.get(f'/course/{biology.id}/view_attendance/export.csv?start_date=2023-09-08')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0] == 'date,student,course_code,course,status,marked_by,time_marked'
+    # Date descending, then username; the record before start_date is left out
+    assert [line.split(',')[:6] for line in lines[1:]] == [
+        ['2023-09-08', 'att_alice', 'BIO1', 'Biology', 'absent', 'att_faculty'],
+        ['2023-09-08', 'att_bob', 'BIO1', 'Biology', 'present', 'att_faculty']]
+
+    response = client.get(f'/course/{biology.id}/view_attendance/export.csv?user_id={bob.id}&end_date=2023-09-01')
+    assert [line.split(',')[:2] for line in response.get_data(as_text=True).splitlines()[1:]] == [['2023-09-01', 'att_bob']]
+
+    login(client, 'att_alice')
+    response = client.get(f'/course/{biology.id}/view_attendance/export.csv')
+    assert response.status_code == 302
+    assert flashes(client)[-1] == 'You do not have permission to view attendance for this course.'
+
+
+def test_export_user_attendance(client, register):
+    faculty, (bob, alice), (biology, algebra) = register
+    mark(bob, biology, [0])
+    mark(bob, algebra, [0, 1], status='late')
+    login(client, 'att_bob')
+
+    lines = client.get('/user/att_bob/attendance/export.csv').get_data(as_text=True).splitlines()
+    # Course name, then date descending
+    assert [line.split(',')[:5] for line in lines[1:]] == [
+        ['2023-09-02', 'att_bob', 'ALG1', 'Algebra', 'late'],
+        ['2023-09-01', 'att_bob', 'ALG1', 'Algebra', 'late'],
+        ['2023-09-01', 'att_bob', 'BIO1', 'Biology', 'present']]
+    response = client.get(f'/user/att_bob/attendance/export.csv?course_id={biology.id}')
+    assert len(response.get_data(as_text=True).splitlines()) == 2
+
+    assert client.get('/user/att_alice/attendance/export.csv').status_code == 302
+
+
+def test_filter_dropdowns_are_scoped(client, register, rendered, monkeypatch):
+    faculty, (bob, alice), (biology, algebra) = register
+    db.session.add_all([CourseEnrollment(user_id=bob.id, course_id=biology.id),
+                        CourseEnrollment(user_id=alice.id, course_id=biology.id, status='dropped')])
+    db.session.commit()
+    mark(bob, algebra, [0])
+    login(client, 'att_faculty')
+
+    client.get(f'/course/{biology.id}/view_attendance')
+    page = rendered['view_attendance_course.html']
+    assert page['user_filter_typeahead'] is False
+    assert page['form'].user_id.query == [alice, bob] # Enrolled in any status, nobody else
+
+    # Past the dropdown limit only the selected student is loaded, and the template gets a typeahead
+    monkeypatch.setattr(routes, 'ATTENDANCE_FILTER_DROPDOWN_LIMIT', 1)
+    client.get(f'/course/{biology.id}/view_attendance?user_id={bob.id}')
+    page = rendered['view_attendance_course.html']
+    assert page['user_filter_typeahead'] is True
+    assert page['form'].user_id.query == [bob]
+    client.get(f'/course/{biology.id}/view_attendance')
+    assert rendered['view_attendance_course.html']['form'].user_id.query == []
+
+    login(client, 'att_bob')
+    client.get('/user/att_bob/attendance')
+    assert rendered['view_attendance_user.html']['form'].course_id.query == [algebra] # Only courses with records
+
+
+def test_course_attendance_student_lookup(client, register):
+    faculty, (bob, alice), (biology, algebra) = register
+    alan = User(username='att_alan', email='att_alan@example.com')
+    alan.set_password('password')
+    db.session.add(alan)
+    db.session.commit()
+    db.session.add_all([CourseEnrollment(user_id=alice.id, course_id=biology.id),
+                        CourseEnrollment(user_id=bob.id, course_id=biology.id),
+                        CourseEnrollment(user_id=alan.id, course_id=algebra.id)]) # Matches the prefix, wrong course
+    db.session.commit()
+    login(client, 'att_faculty')
+
+    response = client.get(f'/course/{biology.id}/attendance/students.json?q=att_al')
+    assert response.status_code == 200
+    assert response.get_json() == [{'id': alice.id, 'label': 'att_alice'}]
+    assert client.get(f'/course/{biology.id}/attendance/students.json?q=zed').get_json() == []
+    assert [student['label'] for student in client.get(f'/course/{biology.id}/attendance/students.json').get_json()] == [
+        'att_alice', 'att_bob']
+    assert client.get(f'/course/{algebra.id}/attendance/students.json?q=att_al').get_json() == [
+        {'id': alan.id, 'label': 'att_alan'}]
+
+    login(client, 'att_alice')
+    assert client.get(f'/course/{biology.id}/attendance/students.json?q=att_al').status_code == 403
+
+
+def test_user_attendance_course_lookup(client, register):
+    faculty, (bob, alice), (biology, algebra) = register
+    alchemy = Course(name='Alchemy', course_code='ALC1', college_id=biology.college_id) # Matches the prefix, never attended
+    db.session.add(alchemy)
+    db.session.commit()
+    mark(bob, algebra, [0, 1])
+    mark(bob, biology, [0])
+    login(client, 'att_bob')
+
+    assert client.get('/user/att_bob/attendance/courses.json?q=Al').get_json() == [
+        {'id': algebra.id, 'label': 'Algebra (ALG1)'}]
+    assert [course['label'] for course in client.get('/user/att_bob/attendance/courses.json').get_json()] == [
+        'Algebra (ALG1)', 'Biology (BIO1)']
+    assert client.get('/user/att_bob/attendance/courses.json?q=al').get_json() == [] # Prefix match is case-sensitive
+
+    login(client, 'att_alice')
+    assert client.get('/user/att_bob/attendance/courses.json').status_code == 403
@@ -0,0 +1,104 @@
+import pytest
+from datetime import datetime, timedelta
+from app import db
+from app.availability import AvailabilityGrid, runs_of, resource_grid, advisor_grid
+from app.models import User, College, Resource, ResourceType, ResourceBooking, AppointmentSlot
+
+MONDAY = datetime(2024, 3, 4)
+
+
+def at(day, hour, minute=0):
+    return MONDAY + timedelta(days=day, hours=hour, minutes=minute)
+
+
+def test_runs_of():
+    assert runs_of(0b0111011, 1) == 0b0111011
+    assert runs_of(0b0111011, 2) == 0b0011001
+    assert runs_of(0b0111011, 3) == 0b0001000
+    assert runs_of(0b0111011, 4) == 0
+
+
+def test_grid_marks_buckets_and_answers_queries():
+    grid = AvailabilityGrid(at(0, 9), at(0, 12)) # 12 buckets of 15 minutes
+    grid.add('a')
+    grid.add('b')
+    grid.mark_busy('a', at(0, 9, 50), at(0, 10, 5)) # Touches 09:45-10:15
+    grid.mark_busy('b', at(0, 11), at(0, 13)) # Runs past the end of the grid
+    assert grid.windows(grid.free['a']) == [(at(0, 9), at(0, 9, 45)), (at(0, 10, 15), at(0, 12))]
+    assert grid.windows(grid.all_free()) == [(at(0, 9), at(0, 9, 45)), (at(0, 10, 15), at(0, 11))]
+    assert grid.first_fit(grid.all_free(), timedelta(minutes=40)) == at(0, 9)
+    assert grid.first_fit(grid.all_free(), timedelta(minutes=50)) is None
+    assert grid.first_fit(grid.free['a'], timedelta(minutes=50)) == at(0, 10, 15)
+    assert grid.first_fit_any(timedelta(hours=1)) == (at(0, 9), 'b')
+
+    grid.add('c', free=False)
+    grid.mark_free('c', at(0, 9, 10), at(0, 10)) # Only 09:15-10:00 is covered completely
+    assert grid.windows(grid.free['c']) == [(at(0, 9, 15), at(0, 10))]
+    assert grid.windows(grid.all_free()) == [(at(0, 9, 15), at(0, 9, 45))]
+
+
+@pytest.fixture
+def campus(app, init_database):
+    college = College(name='Grid College')
+    room_type = ResourceType(name='Lab')
+    db.session.add_all([college, room_type])
+    db.session.commit()
+    student = User(username='grid_student', email='grid_student@example.com', college_id=college.id)
+    student.set_password('password')
+    advisors = [User(username=f'advisor{i}', email=f'advisor{i}@example.com', college_id=college.id,
+                     role=User.ROLE_FACULTY) for i in range(2)]
+    labs = [Resource(name=f'Lab {i}', resource_type_id=room_type.id, college_id=college.id) for i in range(2)]
+    db.session.add_all([student] + advisors + labs)
+    db.session.commit()
+    return student, advisors, labs
+
+
+def test_resource_and_advisor_grids(campus):
+    student, (first, second), (lab, other_lab) = campus
+    db.session.add_all([
+        ResourceBooking(resource_id=lab.id, user_id=student.id, start_time=at(0, 0), end_time=at(0, 10)),
+        ResourceBooking(resource_id=lab.id, user_id=student.id, start_time=at(2, 8), end_time=at(2, 9), status='cancelled'),
+        ResourceBooking(resource_id=other_lab.id, user_id=student.id, start_time=at(6, 23), end_time=at(7, 2)), # Into next week
+        AppointmentSlot(provider_id=first.id, start_time=at(1, 14), end_time=at(1, 15)),
+        AppointmentSlot(provider_id=first.id, start_time=at(1, 15), end_time=at(1, 16), is_booked=True),
+        AppointmentSlot(provider_id=second.id, start_time=at(1, 14, 30), end_time=at(1, 17)),
+    ])
+    db.session.commit()
+
+    rooms = resource_grid([lab.id, other_lab.id], MONDAY, MONDAY + timedelta(days=7))
+    assert rooms.size == 672
+    assert rooms.windows(rooms.free[lab.id]) == [(at(0, 10), at(7, 0))]
+    assert rooms.windows(rooms.free[other_lab.id]) == [(at(0, 0), at(6, 23))]
+
+    advisors = advisor_grid([first.id, second.id, student.id], MONDAY, MONDAY + timedelta(days=7))
+    assert advisors.windows(advisors.free[first.id]) == [(at(1, 14), at(1, 15))]
+    assert advisors.free[student.id] == 0
+    assert advisors.first_fit(advisors.all_free([first.id, second.id]), timedelta(minutes=30)) == at(1, 14, 30)
+
+
+def test_grid_endpoints(client, campus):
+    student, (first, second), (lab, other_lab) = campus
+    db.session.add_all([
+        ResourceBooking(resource_id=lab.id, user_id=student.id, start_time=at(0, 0), end_time=at(0, 10)),
+        AppointmentSlot(provider_id=second.id, start_time=at(3, 9), end_time=at(3, 10)),
+    ])
+    db.session.commit()
+    response = client.post('/login', data={'email_or_username': 'grid_student', 'password': 'password'})
+    assert response.status_code == 302
+
+    response = client.get('/availability/resources', query_string={'week': '2024-03-06', 'duration': 60})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['start'] == '2024-03-04T00:00:00' and body['bucket_minutes'] == 15
+    assert [entity['name'] for entity in body['entities']] == ['Lab 0', 'Lab 1']
+    assert body['entities'][0]['free'] == [{'start': '2024-03-04T10:00:00', 'end': '2024-03-11T00:00:00'}]
+    assert int(body['entities'][1]['bitmap'], 16) == (1 << 672) - 1
+    assert body['first_fit'] == {'all': '2024-03-04T10:00:00', 'any': {'id': other_lab.id, 'start': '2024-03-04T00:00:00'}}
+
+    response = client.get('/availability/advisors', query_string={'week': '2024-03-04'})
+    assert response.status_code == 200
+    entities = {entity['id']: entity['free'] for entity in response.get_json()['entities']}
+    assert entities == {first.id: [], second.id: [{'start': '2024-03-07T09:00:00', 'end': '2024-03-07T10:00:00'}]}
+
+    assert client.get('/availability/resources', query_string={'resource_id': 9999}).status_code == 404
+    assert client.get('/availability/resources', query_string={'week': 'next'}).status_code == 400
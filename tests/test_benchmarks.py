@@ -0,0 +1,51 @@
+import pytest
+from app import db
+from app.models import User, Post, Vote, CourseEnrollment
+from benchmarks.datagen import BENCH_USERNAME, generate
+from benchmarks.run import SCENARIOS, ScenarioFailed, compare, run_scenarios
+
+MICRO = dict(colleges=2, users=30, posts=60, comments=80, votes=100, courses_per_college=2,
+             enrollments_per_student=2, attendance_days=2, reels=5, notifications_per_user=1, follows_per_user=2)
+
+
+def _fingerprint():
+    return (db.session.query(Post.title, Post.user_id, Post.college_id).order_by(Post.id).all(),
+            db.session.query(Vote.user_id, Vote.post_id, Vote.vote_type).order_by(Vote.id).all())
+
+
+def test_generate_counts_and_bench_user(app, init_database):
+    counts = generate(MICRO, seed=1, batch_size=25, log=lambda message: None)
+    assert counts['user'] == User.query.count() == 30
+    assert counts['vote'] == Vote.query.count() == 100
+    assert counts['course_enrollment'] == CourseEnrollment.query.count()
+    user = User.query.filter_by(username=BENCH_USERNAME).one()
+    assert user.role == User.ROLE_FACULTY and user.college_id == 1
+    assert user.check_password('benchmark')
+
+
+def test_generate_is_deterministic(app, init_database):
+    generate(MICRO, seed=7, log=lambda message: None)
+    first = _fingerprint()
+    db.drop_all()
+    db.create_all()
+    generate(MICRO, seed=7, log=lambda message: None)
+    assert _fingerprint() == first
+
+
+def test_compare_flags_query_and_latency_regressions():
+    baseline = {'routes': {'index': {'queries': 5, 'median_ms': 10.0}, 'search': {'queries': 3, 'median_ms': 20.0}}}
+    current = {'routes': {'index': {'queries': 6, 'median_ms': 11.0}, 'search': {'queries': 3, 'median_ms': 30.0},
+                          'new_route': {'queries': 99, 'median_ms': 1.0}}}
+    regressions = compare(baseline, current, threshold=0.2)
+    assert regressions == ['index: queries 5 -> 6', 'search: median 20.0ms -> 30.0ms (+50%)']
+    assert compare(baseline, baseline, threshold=0.2) == []
+
+
+def test_every_scenario_succeeds_and_failures_abort_the_run(app, init_database):
+    generate(MICRO, seed=3, log=lambda message: None)
+    results = run_scenarios(app, list(SCENARIOS), repeat=1, warmup=0, params={'cold_post': MICRO['posts'] // 2})
+    assert {name: row['status'] for name, row in results.items() if row['status'] not in ([200], [302])} == {}
+
+    # A scenario that errors must not produce timings that look like a result
+    with pytest.raises(ScenarioFailed, match='view_post_cold: GET /post/999999 returned 404'):
+        run_scenarios(app, ['index', 'view_post_cold'], repeat=1, warmup=0, params={'cold_post': 999999})
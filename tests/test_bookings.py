@@ -0,0 +1,116 @@
+import pytest
+from datetime import datetime, timedelta
+from app import db
+from app.bookings import BookingConflict, book_resource, find_free_windows
+from app.models import User, College, Resource, ResourceType, ResourceBooking
+
+DAY = datetime(2024, 3, 4)
+
+
+def at(hour, minute=0):
+    return DAY + timedelta(hours=hour, minutes=minute)
+
+
+@pytest.fixture
+def rooms(app, init_database):
+    college = College(name='Booking College')
+    other_college = College(name='Other College')
+    room_type = ResourceType(name='Room')
+    db.session.add_all([college, other_college, room_type])
+    db.session.commit()
+    user = User(username='booker', email='booker@example.com', college_id=college.id)
+    user.set_password('password')
+    rooms = [Resource(name=f'Room {i}', resource_type_id=room_type.id, college_id=college.id) for i in range(3)]
+    elsewhere = Resource(name='Elsewhere', resource_type_id=room_type.id, college_id=other_college.id)
+    db.session.add_all([user] + rooms + [elsewhere])
+    db.session.commit()
+    return user, rooms, elsewhere
+
+
+def _login(client, username):
+    response = client.post('/login', data={'email_or_username': username, 'password': 'password'})
+    assert response.status_code == 302
+
+
+def test_book_resource_rejects_overlaps(rooms):
+    user, (room, other_room, _), _ = rooms
+    book_resource(room.id, user.id, at(10), at(11))
+    with pytest.raises(BookingConflict) as excinfo:
+        book_resource(room.id, user.id, at(10, 30), at(12))
+    assert [(b.start_time, b.end_time) for b in excinfo.value.conflicts] == [(at(10), at(11))]
+    with pytest.raises(BookingConflict):
+        book_resource(room.id, user.id, at(9), at(13)) # Encloses the existing booking
+    # Touching intervals, another resource and cancelled bookings don't conflict
+    book_resource(room.id, user.id, at(11), at(12))
+    book_resource(other_room.id, user.id, at(10), at(11))
+    ResourceBooking.query.filter_by(resource_id=room.id, start_time=at(10)).update({'status': 'cancelled'})
+    db.session.commit()
+    book_resource(room.id, user.id, at(10, 15), at(10, 45))
+    assert ResourceBooking.query.filter(ResourceBooking.status != 'cancelled').count() == 3
+    with pytest.raises(ValueError):
+        book_resource(room.id, user.id, at(15), at(15))
+
+
+def test_find_free_windows_sweeps_each_resource(rooms):
+    user, (room, other_room, empty_room), _ = rooms
+    for resource_id, start, end, status in [
+            (room.id, at(8), at(10), 'confirmed'), # Starts before the window
+            (room.id, at(11), at(12), 'confirmed'),
+            (room.id, at(12), at(12, 20), 'pending_approval'), # Leaves a 10 minute gap before the next
+            (room.id, at(12, 30), at(14), 'confirmed'),
+            (room.id, at(15), at(16), 'cancelled'),
+            (other_room.id, at(9), at(18), 'confirmed')]: # Covers the whole window
+        db.session.add(ResourceBooking(resource_id=resource_id, user_id=user.id, start_time=start, end_time=end, status=status))
+    db.session.commit()
+
+    windows = find_free_windows([room.id, other_room.id, empty_room.id], at(9), at(17))
+    assert windows[room.id] == [(at(10), at(11)), (at(12, 20), at(12, 30)), (at(14), at(17))]
+    assert windows[other_room.id] == []
+    assert windows[empty_room.id] == [(at(9), at(17))]
+
+    windows = find_free_windows([room.id], at(9), at(17), min_duration=timedelta(minutes=30))
+    assert windows[room.id] == [(at(10), at(11)), (at(14), at(17))]
+    assert find_free_windows([], at(9), at(17)) == {}
+
+
+def test_booking_api(client, rooms):
+    user, (room, _, _), elsewhere = rooms
+    _login(client, 'booker')
+    payload = {'start_time': at(10).isoformat(), 'end_time': at(11).isoformat(), 'purpose': 'Study group'}
+
+    response = client.post(f'/resources/{room.id}/bookings', json=payload)
+    assert response.status_code == 201
+    assert response.get_json()['booking']['start_time'] == '2024-03-04T10:00:00'
+
+    response = client.post(f'/resources/{room.id}/bookings',
+                           json={'start_time': '2024-03-04T10:30:00+00:00', 'end_time': '2024-03-04T11:30:00+00:00'})
+    assert response.status_code == 409
+    assert response.get_json()['conflicts'] == [{'start_time': '2024-03-04T10:00:00', 'end_time': '2024-03-04T11:00:00'}]
+    response = client.post(f'/resources/{room.id}/bookings', # Z suffix, which fromisoformat() rejects before Python 3.11
+                           json={'start_time': '2024-03-04T10:30:00Z', 'end_time': '2024-03-04T11:30:00Z'})
+    assert response.status_code == 409
+
+    assert client.post(f'/resources/{room.id}/bookings', json={'start_time': 'soon'}).status_code == 400
+    assert client.post(f'/resources/{elsewhere.id}/bookings', json=payload).status_code == 404 # Another college's room
+
+
+def test_availability_api(client, rooms):
+    user, (room, other_room, empty_room), elsewhere = rooms
+    book_resource(room.id, user.id, at(10), at(11))
+    _login(client, 'booker')
+
+    response = client.get('/resources/availability', query_string={'start': at(9).isoformat(), 'end': at(12).isoformat()})
+    assert response.status_code == 200
+    resources = {r['resource_id']: r['free'] for r in response.get_json()['resources']}
+    assert set(resources) == {room.id, other_room.id, empty_room.id} # Not the other college's room
+    assert resources[room.id] == [{'start': '2024-03-04T09:00:00', 'end': '2024-03-04T10:00:00'},
+                                  {'start': '2024-03-04T11:00:00', 'end': '2024-03-04T12:00:00'}]
+
+    response = client.get('/resources/availability', query_string={'resource_id': room.id, 'min_minutes': 61,
+                                                                   'start': at(9).isoformat(), 'end': at(12).isoformat()})
+    assert response.get_json()['resources'] == [{'resource_id': room.id, 'name': 'Room 0', 'free': []}]
+
+    assert client.get('/resources/availability', query_string={'resource_id': elsewhere.id, 'start': at(9).isoformat(),
+                                                               'end': at(12).isoformat()}).status_code == 404
+    assert client.get('/resources/availability', query_string={'start': at(9).isoformat(),
+                                                               'end': (at(9) + timedelta(days=60)).isoformat()}).status_code == 400
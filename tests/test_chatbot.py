@@ -1,12 +1,32 @@
 import pytest
 import json
+import http.server
+import threading
 from unittest.mock import patch, MagicMock, ANY # ANY is useful for context_data matching
 
 # Assuming 'client' fixture is defined in conftest.py
 # Assuming 'app' can be imported for application context needs
-from app import app as flask_app # Renaming to avoid conflict with 'app' fixture if any
-from app.chatbot import get_gemini_response
-from app.models import College, Course, Event # Required for mocking DB interactions
+from app.chatbot import get_gemini_response, reset_llm_clients
+from app.metrics import chatbot_llm_duration, chatbot_llm_errors, chatbot_llm_retries
+from app.chatbot_cache import response_cache
+from app.retrieval import retrieval_index
+from datetime import datetime
+from app import db, create_app
+from config import TestConfig
+from app.models import User, College, Course, Event # Required for seeding retrieval context
+from google.api_core import exceptions as core_exceptions
+
+@pytest.fixture(autouse=True)
+def fresh_llm_clients(init_database):
+    # The model registry caches GenerativeModel instances, which would bypass the genai mocks below.
+    reset_llm_clients()
+    for metric in (chatbot_llm_duration, chatbot_llm_errors, chatbot_llm_retries):
+        metric.reset()
+    response_cache.clear()
+    retrieval_index.reset() # Each test gets a fresh database: build the index from it now, not in the background
+    retrieval_index.rebuild()
+    yield
+    reset_llm_clients()
 
 # Helper to simulate Flask's url_for in tests if not using client fixture directly
 # or if it's needed for non-client related URL generation (less common in tests).
@@ -78,81 +98,63 @@ def test_get_gemini_response_with_context_mocked_api(mock_genai_model, app): # a
     assert "Some context" in called_prompt
     assert "User query" in called_prompt
 
-# 3.e. Test Chat API - College Keyword Mocked
-@patch('app.chatbot.get_gemini_response') # Mock our helper to isolate chat_api logic
-@patch('app.chatbot.College.query') # Mock the SQLAlchemy query object for College
-def test_chat_api_with_college_keyword_mocked(mock_college_query, mock_get_gemini, client):
-    """Test chat_api with 'college' keyword, mocking DB and Gemini call."""
-    # Configure the mock for College.query.limit().all()
-    mock_college_instance = MagicMock(spec=College) # Use spec for better mocking
-    mock_college_instance.name = 'Test College 1'
-    mock_college_query.limit.return_value.all.return_value = [mock_college_instance]
-    
-    mock_get_gemini.return_value = "Response about colleges" # Mocked response from our helper
-    
+# 3.e. Test Chat API - context comes from the retrieval index
+def _seed_catalog(db):
+    user = User(username='organizer', email='organizer@example.com', role=User.ROLE_FACULTY)
+    user.set_password('password')
+    college = College(name='Test College 1', location='Springfield')
+    db.session.add_all([user, college])
+    db.session.flush()
+    db.session.add_all([
+        Course(name='Intro to Databases', course_code='CS101', description='Relational modelling and SQL.',
+               instructor='Dr. Codd', college_id=college.id),
+        Course(name='Medieval History', course_code='HI200', description='Europe from 500 to 1500.',
+               college_id=college.id),
+        Event(name='Big Test Event', description='Annual hackathon.', date_time=datetime(2030, 1, 1, 10, 0),
+              location='Main Hall', user_id=user.id, college_id=college.id),
+    ])
+    db.session.commit()
+
+@patch('app.chatbot.get_gemini_response')
+def test_chat_api_with_college_keyword(mock_get_gemini, app, client):
+    with app.app_context():
+        _seed_catalog(db)
+    mock_get_gemini.return_value = "Response about colleges"
+
     response = client.post("/chatbot/chat", json={'message': 'tell me about colleges'})
     assert response.status_code == 200
     assert response.get_json()['response'] == "Response about colleges"
-    
-    # Check that get_gemini_response was called with context_data including the college name
-    mock_get_gemini.assert_called_once()
+
     args, kwargs = mock_get_gemini.call_args
-    assert args[0] == 'tell me about colleges' # user_message
-    assert 'context_data' in kwargs
-    assert 'Test College 1' in kwargs['context_data']
-    assert 'colleges in the system' in kwargs['context_data'] # Check for the specific context phrase
+    assert args[0] == 'tell me about colleges'
+    assert 'College: Test College 1 (Springfield)' in kwargs['context_data']
 
-# 3.f. Test Chat API - Course Keyword Mocked
 @patch('app.chatbot.get_gemini_response')
-@patch('app.chatbot.Course.query')
-def test_chat_api_with_course_keyword_mocked(mock_course_query, mock_get_gemini, client):
-    """Test chat_api with 'course' keyword, mocking DB and Gemini call."""
-    mock_course_instance = MagicMock(spec=Course)
-    mock_course_instance.name = 'Test Course 101'
-    # If your context string includes related info like college name, mock that too:
-    # mock_course_instance.college = MagicMock(name='Associated College')
-    mock_course_query.limit.return_value.all.return_value = [mock_course_instance]
-    
+def test_chat_api_retrieves_relevant_course_only(mock_get_gemini, app, client):
+    with app.app_context():
+        _seed_catalog(db)
     mock_get_gemini.return_value = "Response about courses"
-    
-    response = client.post("/chatbot/chat", json={'message': 'any courses available?'})
-    assert response.status_code == 200
-    assert response.get_json()['response'] == "Response about courses"
-    
-    mock_get_gemini.assert_called_once()
-    args, kwargs = mock_get_gemini.call_args
-    assert args[0] == 'any courses available?'
-    assert 'context_data' in kwargs
-    assert 'Test Course 101' in kwargs['context_data']
-    assert 'available courses' in kwargs['context_data']
 
-# 3.f. Test Chat API - Event Keyword Mocked
+    client.post("/chatbot/chat", json={'message': 'any courses about SQL databases?'})
+    context_data = mock_get_gemini.call_args[1]['context_data']
+    assert context_data.splitlines()[1].startswith('- Course CS101: Intro to Databases')
+    assert 'Medieval History' not in context_data.splitlines()[1]
+
 @patch('app.chatbot.get_gemini_response')
-@patch('app.chatbot.Event.query')
-def test_chat_api_with_event_keyword_mocked(mock_event_query, mock_get_gemini, client):
-    """Test chat_api with 'event' keyword, mocking DB and Gemini call."""
-    mock_event_instance = MagicMock(spec=Event)
-    mock_event_instance.name = 'Big Test Event'
-    # Mock date_time if your context string uses it, ensuring it's a datetime object for strftime
-    # from datetime import datetime
-    # mock_event_instance.date_time = datetime(2024, 1, 1, 10, 0, 0) 
-    
-    # Mocking the chain: query.order_by().limit().all()
-    mock_event_query.order_by.return_value.limit.return_value.all.return_value = [mock_event_instance]
-    
+def test_chat_api_with_event_keyword(mock_get_gemini, app, client):
+    with app.app_context():
+        _seed_catalog(db)
     mock_get_gemini.return_value = "Response about events"
-    
-    response = client.post("/chatbot/chat", json={'message': 'what events are happening?'})
-    assert response.status_code == 200
-    assert response.get_json()['response'] == "Response about events"
-    
-    mock_get_gemini.assert_called_once()
-    args, kwargs = mock_get_gemini.call_args
-    assert args[0] == 'what events are happening?'
-    assert 'context_data' in kwargs
-    assert 'Big Test Event' in kwargs['context_data']
-    assert 'recent or upcoming events' in kwargs['context_data']
-    mock_event_query.order_by.assert_called_once() # Verify ordering was attempted
+
+    client.post("/chatbot/chat", json={'message': 'what events are happening?'})
+    context_data = mock_get_gemini.call_args[1]['context_data']
+    assert 'Event: Big Test Event on 2030-01-01 10:00 at Main Hall' in context_data
+
+@patch('app.chatbot.get_gemini_response')
+def test_chat_api_no_matching_records_sends_no_context(mock_get_gemini, client):
+    mock_get_gemini.return_value = "Hello!"
+    client.post("/chatbot/chat", json={'message': 'hello there'})
+    mock_get_gemini.assert_called_once_with('hello there', context_data=None)
 
 # 3.g. Test get_gemini_response - No API Key
 def test_get_gemini_response_no_api_key(app): # app fixture for app context
@@ -190,6 +192,167 @@ def test_get_gemini_response_api_failure(mock_genai_model, app):
     assert response_text == "Sorry, I encountered an error trying to respond. Please try again later."
     mock_logger_error.assert_called_with("Gemini API call failed: Simulated API Failure")
 
+# --- Streaming endpoint, exercised against a local fake LLM server ---
+
+class FakeGeminiHandler(http.server.BaseHTTPRequestHandler):
+    """Speaks just enough of the Gemini REST API: a JSON array of chunks for streamGenerateContent."""
+    chunks = ["Hello", ", world"]
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests += 1
+        if self.server.mode == 'fail' or (self.server.mode == 'flaky' and self.server.requests == 1):
+            self.send_response(500)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(b'{"error": {"code": 500, "message": "boom", "status": "INTERNAL"}}')
+            return
+        body = [{"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]} for text in self.chunks]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        if ':streamGenerateContent' in self.path:
+            self.wfile.write(json.dumps(body).encode())
+        else:
+            self.wfile.write(json.dumps(body[0]).encode())
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def fake_llm(app):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FakeGeminiHandler)
+    server.mode = 'ok'
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    original = {key: app.config.get(key) for key in ('GEMINI_API_ENDPOINT', 'GEMINI_API_KEY')}
+    app.config['GEMINI_API_ENDPOINT'] = f'http://127.0.0.1:{server.server_port}'
+    app.config['GEMINI_API_KEY'] = 'fake-test-key'
+    yield server
+    app.config.update(original)
+    server.shutdown()
+
+def _sse_events(data):
+    events = []
+    for raw in data.decode().strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in raw.split('\n'))
+        events.append((lines.get('event', 'message'), json.loads(lines['data'])))
+    return events
+
+def test_chat_stream_api_streams_chunks(client, fake_llm):
+    response = client.post("/chatbot/chat/stream", json={"message": "Hi"})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = _sse_events(response.data)
+    assert events == [('message', {'text': 'Hello'}), ('message', {'text': ', world'}), ('done', {})]
+
+def test_chat_stream_api_upstream_error(client, fake_llm):
+    fake_llm.mode = 'fail'
+    with patch('app.chatbot.current_app.logger.error') as mock_logger_error:
+        response = client.post("/chatbot/chat/stream", json={"message": "Hi"})
+        events = _sse_events(response.data)
+    assert events[-1] == ('error', {'error': "Sorry, I encountered an error trying to respond. Please try again later."})
+    mock_logger_error.assert_called_once()
+
+def test_chat_stream_api_no_message(client):
+    response = client.post("/chatbot/chat/stream", json={})
+    assert response.status_code == 400
+
+def test_chat_stream_api_concurrency_limit(client, fake_llm):
+    slots = threading.BoundedSemaphore(1)
+    with patch('app.chatbot._stream_slots', slots):
+        slots.acquire() # Simulate a stream already in flight
+        response = client.post("/chatbot/chat/stream", json={"message": "Hi"})
+        assert response.status_code == 503
+        assert response.headers['Retry-After']
+        slots.release()
+        response = client.post("/chatbot/chat/stream", json={"message": "Hi"})
+        assert response.status_code == 200
+        response.get_data()
+        response.close()
+        assert slots.acquire(blocking=False) # The finished stream gave its slot back
+
+# --- Client registry, retries and metrics ---
+
+def _metric_values(metric):
+    """{label values: value} for a counter, or the observation count for a histogram."""
+    return {tuple(labels): value['count'] if isinstance(value, dict) else value for labels, value in metric.snapshot()}
+
+@patch('app.chatbot.genai.GenerativeModel')
+def test_gemini_model_is_reused_across_calls(mock_genai_model, app):
+    mock_genai_model.return_value.generate_content.return_value.text = "Test response"
+    with app.app_context():
+        get_gemini_response("first")
+        get_gemini_response("second")
+    mock_genai_model.assert_called_once()
+    assert mock_genai_model.return_value.generate_content.call_count == 2
+    assert _metric_values(chatbot_llm_duration) == {('generate', 'ok'): 2}
+
+@patch('app.chatbot.genai.GenerativeModel')
+def test_get_gemini_response_retries_transient_errors(mock_genai_model, app):
+    mock_model_instance = mock_genai_model.return_value
+    success = MagicMock(text="Recovered")
+    mock_model_instance.generate_content.side_effect = [core_exceptions.ServiceUnavailable("busy"), success]
+    with app.app_context():
+        response_text = get_gemini_response("query")
+    assert response_text == "Recovered"
+    assert mock_model_instance.generate_content.call_count == 2
+    assert _metric_values(chatbot_llm_retries) == {('generate',): 1}
+    assert _metric_values(chatbot_llm_errors) == {}
+
+@patch('app.chatbot.genai.GenerativeModel')
+def test_get_gemini_response_gives_up_after_max_retries(mock_genai_model, app):
+    mock_model_instance = mock_genai_model.return_value
+    mock_model_instance.generate_content.side_effect = core_exceptions.ServiceUnavailable("busy")
+    with app.app_context():
+        response_text = get_gemini_response("query")
+    assert response_text == "Sorry, I encountered an error trying to respond. Please try again later."
+    assert mock_model_instance.generate_content.call_count == app.config['CHATBOT_MAX_RETRIES'] + 1
+    assert _metric_values(chatbot_llm_errors) == {('generate', 'ServiceUnavailable'): 1}
+    assert _metric_values(chatbot_llm_retries) == {('generate',): app.config['CHATBOT_MAX_RETRIES']}
+
+def test_chat_stream_api_retries_against_fake_server(client, fake_llm):
+    fake_llm.mode = 'flaky'
+    response = client.post("/chatbot/chat/stream", json={"message": "Hi"})
+    assert _sse_events(response.data)[-1] == ('done', {})
+    assert fake_llm.requests == 2
+
+# --- Response cache ---
+
+@patch('app.chatbot.get_gemini_response')
+def test_chat_api_serves_repeat_questions_from_cache(mock_get_gemini, client):
+    mock_get_gemini.return_value = "Nothing scheduled."
+    first = client.post("/chatbot/chat", json={'message': 'What is on this week?'})
+    second = client.post("/chatbot/chat", json={'message': '  what is on THIS week '})
+    assert first.headers['X-Chatbot-Cache'] == 'miss'
+    assert second.headers['X-Chatbot-Cache'] == 'hit'
+    assert second.get_json()['response'] == "Nothing scheduled."
+    mock_get_gemini.assert_called_once()
+
+@patch('app.chatbot.get_gemini_response')
+def test_chat_api_does_not_cache_errors(mock_get_gemini, client):
+    mock_get_gemini.return_value = "Sorry, I encountered an error trying to respond. Please try again later."
+    client.post("/chatbot/chat", json={'message': 'Hi'})
+    client.post("/chatbot/chat", json={'message': 'Hi'})
+    assert mock_get_gemini.call_count == 2
+
+@patch('app.chatbot.get_gemini_response')
+def test_chat_api_cache_invalidated_by_college_change(mock_get_gemini, app, client, init_database):
+    mock_get_gemini.return_value = "There are no colleges yet."
+    client.post("/chatbot/chat", json={'message': 'Hi'})
+    assert len(response_cache) == 1
+    with app.app_context():
+        init_database.session.add(College(name='New College', location='Somewhere'))
+        init_database.session.commit()
+    assert len(response_cache) == 0
+
+def test_chat_stream_api_replays_cached_answer(client, fake_llm):
+    client.post("/chatbot/chat/stream", json={"message": "Hi"}).get_data()
+    response = client.post("/chatbot/chat/stream", json={"message": "hi!"})
+    assert response.headers['X-Chatbot-Cache'] == 'hit'
+    assert _sse_events(response.data) == [('message', {'text': 'Hello, world'}), ('done', {})]
+    assert fake_llm.requests == 1
+
 # Final check on app import name
 # If your conftest.py provides 'app' as the Flask app instance,
 # then the parameter 'app' in test functions is correct.
@@ -231,6 +394,7 @@ def test_get_gemini_response_api_failure(mock_genai_model, app):
 # @patch('app.chatbot.current_app', flask_app) # This might not work directly for current_app
 # A better way without 'app' fixture is to push context manually:
 def test_get_gemini_response_no_api_key_no_fixture():
+    flask_app = create_app(TestConfig) # A standalone app from the factory, without the conftest fixture
     with flask_app.test_request_context(): # Pushes app and request context
         original_api_key = flask_app.config.get('GEMINI_API_KEY')
         try:
@@ -0,0 +1,44 @@
+from unittest.mock import patch
+from app.chatbot_cache import ResponseCache, normalize_query, context_fingerprint
+
+
+def test_normalize_query():
+    assert normalize_query("  What EVENTS are coming up?! ") == "what events are coming up"
+
+
+def test_cache_key_includes_context_fingerprint():
+    cache = ResponseCache()
+    cache.set("what courses", "Some available courses: Math.", "Math", ttl=60, max_entries=10)
+    assert cache.get("What courses?", "Some available courses: Math.") == "Math"
+    assert cache.get("What courses?", "Some available courses: Physics.") is None
+    assert context_fingerprint(None) == context_fingerprint("")
+
+
+def test_cache_entries_expire():
+    cache = ResponseCache()
+    with patch('app.chatbot_cache.time.monotonic', return_value=100.0):
+        cache.set("hi", None, "Hello", ttl=10, max_entries=10)
+    with patch('app.chatbot_cache.time.monotonic', return_value=109.0):
+        assert cache.get("hi") == "Hello"
+    with patch('app.chatbot_cache.time.monotonic', return_value=111.0):
+        assert cache.get("hi") is None
+    assert len(cache) == 0
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ResponseCache()
+    cache.set("a", None, "A", ttl=60, max_entries=2)
+    cache.set("b", None, "B", ttl=60, max_entries=2)
+    cache.get("a")
+    cache.set("c", None, "C", ttl=60, max_entries=2)
+    assert cache.get("b") is None
+    assert cache.get("a") == "A" and cache.get("c") == "C"
+
+
+def test_near_duplicate_match_is_opt_in():
+    cache = ResponseCache()
+    cache.set("what events are coming up", "ctx", "Hackathon", ttl=60, max_entries=10)
+    assert cache.get("what events are coming up soon", "ctx") is None
+    assert cache.get("what events are coming up soon", "ctx", similarity=0.7) == "Hackathon"
+    assert cache.get("what events are coming up soon", "other ctx", similarity=0.7) is None
+    assert cache.get("how do i reset my password", "ctx", similarity=0.7) is None
@@ -0,0 +1,134 @@
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine
+from app.database import apply_database_profile, install_sqlite_pragmas, resolve_profile_name
+from config import Config
+
+
+def _app_for(uri, profile=None):
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['DATABASE_PROFILE'] = profile
+    return app
+
+
+def test_profile_inferred_from_url():
+    assert resolve_profile_name({'SQLALCHEMY_DATABASE_URI': 'sqlite:///app.db'}) == 'sqlite-dev'
+    assert resolve_profile_name({'SQLALCHEMY_DATABASE_URI': 'postgresql://u:p@db/app'}) == 'postgres'
+    assert resolve_profile_name({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'DATABASE_PROFILE': 'SQLite-Prod-WAL'}) == 'sqlite-prod-wal'
+
+
+def test_postgres_profile_sets_pool_options():
+    app = _app_for('postgresql://u:p@db/app')
+    apply_database_profile(app)
+    options = app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    assert options['pool_pre_ping'] is True
+    assert options['pool_size'] == 10 and options['pool_recycle'] == 1800
+    assert 'statement_timeout' in options['connect_args']['options']
+
+
+def test_explicit_engine_options_win():
+    app = _app_for('postgresql://u:p@db/app')
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_size': 3}
+    apply_database_profile(app)
+    assert app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_size'] == 3
+
+
+@pytest.mark.parametrize('uri, profile, message', [
+    ('sqlite:///app.db', 'postgres', 'is for postgresql'),
+    ('postgresql://u:p@db/app', 'sqlite-prod-wal', 'is for sqlite'),
+    ('sqlite:///app.db', 'mysql-fast', 'Unknown DATABASE_PROFILE'),
+])
+def test_invalid_profile_rejected_at_startup(uri, profile, message):
+    with pytest.raises(ValueError, match=message):
+        apply_database_profile(_app_for(uri, profile))
+
+
+def test_sqlite_pool_sizing_rejected():
+    app = _app_for('sqlite:///app.db', 'sqlite-dev')
+    app.config['DATABASE_PROFILES'] = {'sqlite-dev': {'backend': 'sqlite', 'engine_options': {'pool_size': 5}}}
+    with pytest.raises(ValueError, match='pool_size'):
+        apply_database_profile(app)
+
+
+def test_wal_pragmas_applied_on_connect(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'wal.db'}")
+    install_sqlite_pragmas(engine, Config.DATABASE_PROFILES['sqlite-prod-wal']['sqlite_pragmas'])
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+        assert connection.exec_driver_sql('PRAGMA synchronous').scalar() == 1 # NORMAL
+        assert connection.exec_driver_sql('PRAGMA busy_timeout').scalar() == 5000
+        assert connection.exec_driver_sql('PRAGMA mmap_size').scalar() == 256 * 1024 * 1024
+    engine.dispose()
+
+
+# --- Read replica routing, against two local SQLite files ---
+
+import time
+from unittest.mock import patch
+from flask import jsonify
+from flask_sqlalchemy import SQLAlchemy
+from app.database import RoutingSession, init_replica_routing, replica_reads
+
+
+@pytest.fixture
+def routed_app(tmp_path):
+    app = Flask(__name__)
+    app.config.update(SECRET_KEY='test', TESTING=True, DATABASE_STICKY_SECONDS=5,
+                      SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'primary.db'}",
+                      SQLALCHEMY_BINDS={'replica_0': f"sqlite:///{tmp_path / 'replica.db'}"})
+    db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+    init_replica_routing(app)
+
+    class Item(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        name = db.Column(db.String(50))
+
+    with app.app_context():
+        db.create_all()
+        db.metadata.create_all(db.engines['replica_0']) # Stand-in for replication
+        db.session.add(Item(name='on-primary'))
+        db.session.commit()
+        with db.engines['replica_0'].begin() as connection:
+            connection.execute(Item.__table__.insert(), {'name': 'on-replica'})
+
+    def names():
+        return jsonify(sorted(item.name for item in Item.query.all()))
+
+    app.add_url_rule('/items', 'items', replica_reads(names))
+    app.add_url_rule('/items/primary', 'items_primary', names)
+
+    @app.route('/items', methods=['POST'])
+    @replica_reads
+    def add_item():
+        db.session.add(Item(name='new'))
+        db.session.commit()
+        return names()
+
+    @app.route('/items/pending')
+    @replica_reads
+    def pending_read():
+        db.session.add(Item(name='pending'))
+        return names()
+
+    return app
+
+
+def test_get_routes_read_from_replica(routed_app):
+    client = routed_app.test_client()
+    assert client.get('/items').get_json() == ['on-replica']
+    assert client.get('/items/primary').get_json() == ['on-primary'] # Not opted in
+
+
+def test_pending_writes_keep_reads_on_primary(routed_app):
+    assert routed_app.test_client().get('/items/pending').get_json() == ['on-primary', 'pending']
+
+
+def test_sticky_primary_window_after_write(routed_app):
+    client = routed_app.test_client()
+    assert client.post('/items').get_json() == ['new', 'on-primary']
+    assert client.get('/items').get_json() == ['new', 'on-primary'] # Read-your-writes
+    assert routed_app.test_client().get('/items').get_json() == ['on-replica'] # Other users unaffected
+    with patch('app.database.time.time', return_value=time.time() + 6):
+        assert client.get('/items').get_json() == ['on-replica']
@@ -0,0 +1,105 @@
+import json
+import pytest
+from datetime import date, datetime
+from app import db
+from app.models import User, College, Course, CourseEnrollment
+from app.exports import csv_lines, ndjson_lines
+
+REGISTERED = datetime(2024, 1, 2, 9, 30)
+
+
+def login(client, username):
+    client.get('/logout')
+    return client.post('/login', data={'email_or_username': username, 'password': 'password'})
+
+
+def test_csv_lines_streams_header_then_rows():
+    lines = list(csv_lines(['id', 'name'], iter([(1, 'a,b'), (2, 'c')])))
+    assert lines == ['id,name\r\n', '1,"a,b"\r\n', '2,c\r\n']
+
+
+def test_ndjson_lines_serializes_dates():
+    lines = list(ndjson_lines(['id', 'day'], iter([(1, date(2024, 1, 2))])))
+    assert len(lines) == 1
+    assert json.loads(lines[0]) == {'id': 1, 'day': '2024-01-02'}
+
+
+@pytest.fixture
+def roster(app, init_database):
+    college = College(name='Export College')
+    db.session.add(college)
+    db.session.commit()
+    users = {name: User(username=f'export_{name}', email=f'export_{name}@example.com', role=role, college_id=college.id,
+                        timestamp=REGISTERED, last_seen=REGISTERED)
+             for name, role in (('admin', User.ROLE_ADMIN), ('manager', User.ROLE_MANAGEMENT),
+                                ('bea', User.ROLE_STUDENT), ('abe', User.ROLE_STUDENT))}
+    for user in users.values():
+        user.set_password('password')
+    courses = [Course(name='Export Course', course_code='EXP101', college_id=college.id),
+               Course(name='Other Course', course_code='OTH101', college_id=college.id)]
+    db.session.add_all(list(users.values()) + courses)
+    db.session.commit()
+    db.session.add_all([
+        CourseEnrollment(user_id=users['bea'].id, course_id=courses[0].id, enrollment_date=REGISTERED, grade_points=3.5),
+        CourseEnrollment(user_id=users['abe'].id, course_id=courses[0].id, enrollment_date=REGISTERED, status='dropped'),
+        CourseEnrollment(user_id=users['abe'].id, course_id=courses[1].id, enrollment_date=REGISTERED),
+    ])
+    db.session.commit()
+    return users, courses
+
+
+def test_export_roles(client, roster):
+    assert client.get('/export/users.csv').status_code == 302 # To the login page
+
+    login(client, 'export_bea')
+    assert client.get('/export/users.csv').status_code == 403
+    assert client.get('/export/enrollments.csv').status_code == 403
+
+    login(client, 'export_manager')
+    assert client.get('/export/users.csv').status_code == 403
+    assert client.get('/export/enrollments.csv').status_code == 200
+
+
+def test_export_users_csv(client, roster):
+    users, _ = roster
+    login(client, 'export_admin')
+
+    response = client.get('/export/users.csv?role=student')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=users.csv'
+    assert response.get_data(as_text=True) == (
+        'id,username,email,college,role,is_college_verified,registered,last_seen\r\n'
+        f"{users['bea'].id},export_bea,export_bea@example.com,Export College,student,False,2024-01-02 09:30:00,2024-01-02 09:30:00\r\n"
+        f"{users['abe'].id},export_abe,export_abe@example.com,Export College,student,False,2024-01-02 09:30:00,2024-01-02 09:30:00\r\n")
+
+    lines = client.get('/export/users.csv').get_data(as_text=True).splitlines()
+    assert [line.split(',')[1] for line in lines[1:]] == ['export_admin', 'export_manager', 'export_bea', 'export_abe']
+
+
+def test_export_enrollments_ndjson(client, roster):
+    _, (course, other) = roster
+    login(client, 'export_admin')
+
+    response = client.get(f'/export/enrollments.ndjson?course_id={course.id}')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=enrollments.ndjson'
+    # Ordered by course code, then student
+    assert [json.loads(line) for line in response.get_data(as_text=True).splitlines()] == [
+        {'course_code': 'EXP101', 'course': 'Export Course', 'student': 'export_abe', 'email': 'export_abe@example.com',
+         'status': 'dropped', 'enrollment_date': '2024-01-02T09:30:00', 'grade_points': None},
+        {'course_code': 'EXP101', 'course': 'Export Course', 'student': 'export_bea', 'email': 'export_bea@example.com',
+         'status': 'enrolled', 'enrollment_date': '2024-01-02T09:30:00', 'grade_points': 3.5}]
+
+    response = client.get('/export/enrollments.csv?status=enrolled')
+    assert response.get_data(as_text=True).splitlines()[1:] == [
+        'EXP101,Export Course,export_bea,export_bea@example.com,enrolled,2024-01-02 09:30:00,3.5',
+        'OTH101,Other Course,export_abe,export_abe@example.com,enrolled,2024-01-02 09:30:00,']
+
+
+def test_export_unknown_report_or_format(client, roster):
+    login(client, 'export_admin')
+    assert client.get('/export/not_a_report.csv').status_code == 404
+    assert client.get('/export/users.xlsx').status_code == 404
@@ -0,0 +1,65 @@
+import pytest
+from unittest.mock import patch
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from app import db
+from app.instrumentation import QueryStats, perf_registry
+from app.retrieval import retrieval_index
+
+
+def test_query_stats_flags_duplicate_statements():
+    stats = QueryStats()
+    stats.record('SELECT * FROM user WHERE id = ?', 0.001)
+    stats.record('SELECT * FROM user WHERE id = ?', 0.002)
+    stats.record('SELECT * FROM post', 0.003)
+    assert stats.count == 3
+    assert stats.total_time == pytest.approx(0.006)
+    assert stats.duplicates == {'SELECT * FROM user WHERE id = ?': 2}
+
+
+@pytest.fixture
+def instrumented_app(app):
+    original = {key: app.config.get(key) for key in ('SQL_DEBUG_HEADERS', 'SQL_SLOW_QUERY_MS')}
+    app.config['SQL_DEBUG_HEADERS'] = True
+    perf_registry.reset()
+    yield app
+    app.config.update(original)
+    perf_registry.reset()
+
+
+@patch('app.chatbot.get_gemini_response', return_value="Hi!")
+def test_request_query_headers_and_aggregates(mock_get_gemini, instrumented_app, init_database):
+    retrieval_index.reset() # The next chat request answers from fallback context: a query per record type it names
+    message = 'Which colleges, courses, events, study groups and posts are there?'
+    response = instrumented_app.test_client().post('/chatbot/chat', json={'message': message})
+    with retrieval_index._rebuild_lock: # The index build that request started in the background
+        pass
+    assert int(response.headers['X-DB-Query-Count']) >= 5
+    assert float(response.headers['X-DB-Time-ms']) >= 0
+    assert response.headers['X-DB-Duplicate-Queries'] == '0'
+    route = next(row for row in perf_registry.summary() if row['endpoint'] == 'chatbot.chat_api')
+    assert route['requests'] == 1 and route['queries'] == int(response.headers['X-DB-Query-Count'])
+
+
+@patch('app.chatbot.get_gemini_response', return_value="Hi!")
+def test_slow_queries_logged_with_endpoint(mock_get_gemini, instrumented_app, init_database):
+    retrieval_index.reset()
+    instrumented_app.config['SQL_SLOW_QUERY_MS'] = 0 # Everything counts as slow
+    with patch.object(instrumented_app.logger, 'warning') as mock_warning:
+        instrumented_app.test_client().post('/chatbot/chat', json={'message': 'any events?'})
+        with retrieval_index._rebuild_lock:
+            pass
+    assert 'in chatbot.chat_api: SELECT' in mock_warning.call_args_list[0][0][0]
+    assert perf_registry.slow_queries[0]['endpoint'] == 'chatbot.chat_api'
+
+
+def test_failed_statements_leave_nothing_on_the_connection(app, init_database):
+    with app.app_context():
+        info = db.session.connection().info
+        before = {key: len(value) if isinstance(value, list) else value for key, value in info.items()}
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                db.session.execute(text('SELECT * FROM no_such_table'))
+            db.session.rollback()
+        assert db.session.connection().info is info # Same pooled connection
+        assert {key: len(value) if isinstance(value, list) else value for key, value in info.items()} == before
@@ -0,0 +1,147 @@
+import pytest
+from datetime import datetime, timedelta
+from decimal import Decimal
+from app import db
+from app.library import (CirculationError, checkout, checkout_batch, expire_holds, return_batch, return_loan,
+                         sweep_overdue)
+from app.models import User, Book, BookCategory, BookReservation, Fine, LibraryLoan, Notification
+
+NOW = datetime(2024, 3, 4, 10, 0)
+
+
+@pytest.fixture
+def shelf(app, init_database):
+    category = BookCategory(name='Computing')
+    librarian = User(username='librarian', email='librarian@example.com', role=User.ROLE_MANAGEMENT)
+    librarian.set_password('password')
+    readers = [User(username=f'reader{i}', email=f'reader{i}@example.com') for i in range(3)]
+    for reader in readers:
+        reader.set_password('password')
+    db.session.add_all([category, librarian] + readers)
+    db.session.commit()
+    books = [Book(title='SICP', author='Abelson', isbn='111', category_id=category.id, total_copies=1, available_copies=1),
+             Book(title='TAOCP', author='Knuth', isbn='222', category_id=category.id, total_copies=2, available_copies=2)]
+    db.session.add_all(books)
+    db.session.commit()
+    return readers, books
+
+
+def copies(book):
+    return db.session.query(Book.available_copies).filter_by(id=book.id).scalar()
+
+
+def test_checkout_and_return(shelf):
+    (first, second, _), (sicp, _) = shelf
+    loan = checkout(sicp.id, first.id, now=NOW)
+    assert loan.due_date == NOW + timedelta(days=14)
+    assert copies(sicp) == 0
+    with pytest.raises(CirculationError):
+        checkout(sicp.id, second.id, now=NOW) # Last copy already out
+    with pytest.raises(CirculationError):
+        checkout(sicp.id, first.id, now=NOW)
+
+    assert return_loan(loan.id, now=NOW + timedelta(days=1)) is None
+    assert copies(sicp) == 1
+    assert db.session.get(LibraryLoan, loan.id).status == 'returned'
+    with pytest.raises(CirculationError):
+        return_loan(loan.id) # Can't put the copy back twice
+    assert copies(sicp) == 1
+
+
+def test_return_hands_copy_to_oldest_reservation(shelf):
+    (first, second, third), (sicp, _) = shelf
+    loan = checkout(sicp.id, first.id, now=NOW)
+    db.session.add_all([BookReservation(book_id=sicp.id, user_id=third.id, reservation_date=NOW + timedelta(hours=2)),
+                        BookReservation(book_id=sicp.id, user_id=second.id, reservation_date=NOW + timedelta(hours=1))])
+    db.session.commit()
+
+    reservation_id = return_loan(loan.id, now=NOW + timedelta(days=1))
+    held = db.session.get(BookReservation, reservation_id)
+    assert (held.user_id, held.status, held.expiry_date) == (second.id, 'available', NOW + timedelta(days=4))
+    assert copies(sicp) == 0 # Held, not on the shelf
+    assert Notification.query.filter_by(user_id=second.id, name='book_reservation_available').count() == 1
+    with pytest.raises(CirculationError):
+        checkout(sicp.id, third.id, now=NOW + timedelta(days=1))
+
+    checkout(sicp.id, second.id, now=NOW + timedelta(days=2)) # Takes the held copy
+    assert db.session.get(BookReservation, reservation_id).status == 'fulfilled'
+    assert copies(sicp) == 0
+
+
+def test_expired_hold_passes_to_next_reservation(shelf):
+    (first, second, third), (sicp, _) = shelf
+    loan = checkout(sicp.id, first.id, now=NOW)
+    db.session.add(BookReservation(book_id=sicp.id, user_id=second.id, reservation_date=NOW))
+    db.session.commit()
+    return_loan(loan.id, now=NOW)
+    assert expire_holds(now=NOW + timedelta(days=2)) == 0
+    assert expire_holds(now=NOW + timedelta(days=4)) == 1
+    assert copies(sicp) == 1 # Nobody else waiting
+    assert BookReservation.query.filter_by(user_id=second.id).one().status == 'expired'
+
+
+def test_batches(shelf):
+    (first, second, _), (sicp, taocp) = shelf
+    results = checkout_batch(first.id, [sicp.id, taocp.id, taocp.id], now=NOW)
+    assert [result.error is None for result in results] == [True, True, False] # One copy each per patron
+    assert (copies(sicp), copies(taocp)) == (0, 1)
+
+    results = return_batch(first.id, [sicp.id, taocp.id, taocp.id], now=NOW + timedelta(days=3))
+    assert [result.error is None for result in results] == [True, True, False]
+    assert (copies(sicp), copies(taocp)) == (1, 2)
+
+
+def test_scanner_station(client, shelf):
+    (first, _, _), (sicp, taocp) = shelf
+    payload = {'user_id': first.id, 'isbns': ['111', '999', '222']}
+    client.post('/login', data={'email_or_username': 'reader0', 'password': 'password'})
+    assert client.post('/library/circulation/checkout', json=payload).status_code == 403
+
+    client.get('/logout')
+    client.post('/login', data={'email_or_username': 'librarian', 'password': 'password'})
+    response = client.post('/library/circulation/checkout', json=payload)
+    assert response.status_code == 200
+    assert [(item['isbn'], item['ok'], item['error']) for item in response.get_json()['items']] == [
+        ('111', True, None), ('999', False, 'Unknown ISBN'), ('222', True, None)]
+    assert LibraryLoan.query.filter_by(user_id=first.id, status='active').count() == 2
+
+    response = client.post('/library/circulation/return', json={'user_id': first.id, 'isbns': ['222']})
+    assert response.get_json()['succeeded'] == 1
+    assert client.post('/library/circulation/return', json={'user_id': first.id, 'isbns': []}).status_code == 400
+    assert client.post('/library/circulation/return', json={'user_id': 999, 'isbns': ['111']}).status_code == 404
+
+
+def test_overdue_sweep_is_set_based_and_idempotent(app, shelf):
+    (first, second, third), (sicp, taocp) = shelf
+    late = checkout(sicp.id, first.id, now=NOW - timedelta(days=20)) # Due 6 days ago
+    very_late = checkout(taocp.id, first.id, now=NOW - timedelta(days=100))
+    on_time = checkout(taocp.id, second.id, now=NOW - timedelta(days=3))
+    returned_late = LibraryLoan(book_id=sicp.id, user_id=third.id, loan_date=NOW - timedelta(days=18),
+                                due_date=NOW - timedelta(days=4), return_date=NOW - timedelta(days=1), status='returned')
+    db.session.add(returned_late)
+    db.session.commit()
+
+    report = sweep_overdue(now=NOW, chunk_size=2)
+    assert (report.marked, report.fines_created, report.fines_updated, report.digests) == (2, 3, 0, 1)
+    assert report.chunks == 2 and set(report.timings) == {'fines', 'digests', 'holds'}
+    assert {loan.id: loan.status for loan in LibraryLoan.query} == {
+        late.id: 'overdue', very_late.id: 'overdue', on_time.id: 'active', returned_late.id: 'returned'}
+    fines = {fine.loan_id: fine.amount for fine in Fine.query}
+    assert fines == {late.id: Decimal('3.00'), very_late.id: Decimal('20.00'), returned_late.id: Decimal('1.50')}
+    digest = Notification.query.filter_by(user_id=first.id, name='library_overdue_digest').one()
+    assert digest.get_payload()['total_fines'] == '23.00'
+    assert [loan['loan_id'] for loan in digest.get_payload()['overdue_loans']] == [very_late.id, late.id]
+
+    # Same day again: nothing changes
+    assert sweep_overdue(now=NOW + timedelta(hours=1))[:4] == (0, 0, 0, 0)
+    assert Fine.query.count() == 3
+
+    # A day later the unpaid fine grows, a paid one is left alone, and a new digest goes out
+    Fine.query.filter_by(loan_id=returned_late.id).update({'paid_status': 'paid'})
+    db.session.commit()
+    report = sweep_overdue(now=NOW + timedelta(days=1))
+    assert (report.marked, report.fines_created, report.fines_updated, report.digests) == (0, 0, 1, 1)
+    assert db.session.query(Fine.amount).filter_by(loan_id=late.id).scalar() == Decimal('3.50')
+
+    result = app.test_cli_runner().invoke(args=['library-overdue'])
+    assert result.exit_code == 0 and 'Timings: fines' in result.output
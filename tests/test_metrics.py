@@ -0,0 +1,91 @@
+import os
+import pytest
+from unittest.mock import patch
+from app.chatbot_cache import response_cache
+from app.metrics import MetricsRegistry, collect, flush, mark_process_dead, render_text, registry
+from app.retrieval import retrieval_index
+
+
+def test_render_counter_gauge_histogram():
+    reg = MetricsRegistry()
+    requests = reg.counter('requests_total', 'Requests.', ('route',))
+    in_flight = reg.gauge('in_flight', 'In flight.')
+    latency = reg.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1))
+    requests.inc(route='a"b')
+    requests.inc(2, route='a"b')
+    in_flight.inc()
+    for value in (0.05, 0.5, 5):
+        latency.observe(value)
+    text = render_text(reg.snapshot())
+    assert '# TYPE requests_total counter' in text
+    assert 'requests_total{route="a\\"b"} 3.0' in text
+    assert 'in_flight 1.0' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1.0"} 2' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in text
+    assert 'latency_seconds_count 3' in text
+
+
+def test_labels_and_types_are_checked():
+    reg = MetricsRegistry()
+    counter = reg.counter('c_total', 'C.', ('route',))
+    with pytest.raises(ValueError):
+        counter.inc(status='200')
+    with pytest.raises(ValueError):
+        counter.inc(-1, route='a')
+    assert reg.counter('c_total', 'C.', ('route',)) is counter
+    with pytest.raises(ValueError):
+        reg.gauge('c_total', 'C.')
+
+
+def test_multiprocess_snapshots_are_merged(tmp_path):
+    reg = MetricsRegistry()
+    hits = reg.counter('hits_total', 'Hits.')
+    busy = reg.gauge('busy', 'Busy.')
+    latency = reg.histogram('lat', 'Latency.', buckets=(1,))
+    with patch('app.metrics.registry', reg):
+        # Another worker's snapshot
+        hits.inc(5)
+        busy.set(2)
+        latency.observe(0.5)
+        with patch('app.metrics.os.getpid', return_value=999999):
+            flush(str(tmp_path))
+        reg.reset()
+        # This worker
+        hits.inc(1)
+        busy.set(1)
+        latency.observe(3)
+        text = render_text(collect(str(tmp_path)))
+        assert 'hits_total 6.0' in text and 'busy 3.0' in text
+        assert 'lat_bucket{le="1.0"} 1' in text and 'lat_count 2' in text
+
+        mark_process_dead(999999, str(tmp_path))
+        text = render_text(collect(str(tmp_path)))
+        assert 'hits_total 6.0' in text and 'busy 1.0' in text # Dead worker's gauge no longer counts
+    assert set(os.listdir(tmp_path)) == {'metrics_999999.json', f'metrics_{os.getpid()}.json'}
+
+
+@patch('app.chatbot.get_gemini_response', return_value="Hi!")
+def test_metrics_endpoint_reports_requests(mock_get_gemini, app, client, init_database):
+    registry.reset()
+    response_cache.clear() # The first request must be a miss even if an earlier test cached this message
+    retrieval_index.rebuild() # Otherwise the first request builds it in a background thread, on this test's database
+    client.post('/chatbot/chat', json={'message': 'hello'})
+    client.post('/chatbot/chat', json={'message': 'hello'})
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    text = response.get_data(as_text=True)
+    assert 'http_requests_total{endpoint="chatbot.chat_api",method="POST",status="200"} 2.0' in text
+    assert 'http_request_duration_seconds_count{endpoint="chatbot.chat_api",method="POST"} 2' in text
+    assert 'cache_requests_total{cache="chatbot",result="hit"} 1.0' in text
+    assert 'db_queries_per_request_count{endpoint="chatbot.chat_api"} 2' in text
+
+
+def test_metrics_endpoint_token(app, client):
+    app.config['METRICS_TOKEN'] = 'secret'
+    try:
+        assert client.get('/metrics').status_code == 403
+        assert client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code == 200
+    finally:
+        app.config['METRICS_TOKEN'] = None
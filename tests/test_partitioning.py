@@ -0,0 +1,116 @@
+import csv
+import gzip
+import pytest
+from datetime import datetime
+from app import db
+from app.models import User, AccessLog, AccessPoint, AuditLog, RFIDCard, SecurityRollup
+from app.partitioning import (PARTITIONED, add_months, archive_partition, drop_partition, enforce_retention,
+                              hot_cutoff, list_partitions, maintain, roll, select_range)
+from app.security_dashboard import rebuild_rollups
+
+NOW = datetime(2024, 6, 15, 12, 0)
+
+
+def test_month_arithmetic():
+    assert add_months(datetime(2024, 1, 1), -1) == datetime(2023, 12, 1)
+    assert add_months(datetime(2024, 11, 1), 3) == datetime(2025, 2, 1)
+    assert hot_cutoff(2, NOW) == datetime(2024, 5, 1)
+    assert hot_cutoff(1, NOW) == datetime(2024, 6, 1)
+
+
+@pytest.fixture
+def access_history(app, init_database):
+    user = User(username='scanner', email='scanner@example.com')
+    db.session.add(user)
+    db.session.commit()
+    card = RFIDCard(card_uid='HIST-1', user_id=user.id)
+    point = AccessPoint(name='Library', reader_id='LIB-1')
+    db.session.add_all([card, point])
+    db.session.commit()
+    times = [datetime(2024, 2, 10), datetime(2024, 2, 20), datetime(2024, 3, 5), datetime(2024, 5, 31, 23), NOW]
+    db.session.add_all([AccessLog(rfid_card_id=card.id, access_point_id=point.id, access_datetime=t, access_granted=True)
+                        for t in times])
+    db.session.add(AuditLog(user_id=user.id, action_type='login', action_datetime=datetime(2024, 1, 3)))
+    db.session.commit()
+    yield times
+    db.session.rollback()
+    for name in PARTITIONED:
+        for month in list_partitions(name):
+            drop_partition(name, month)
+
+
+def test_roll_moves_old_months_and_routes_queries(access_history):
+    times = access_history
+    assert roll('access_log', hot_months=2, now=NOW) == {datetime(2024, 2, 1): 2, datetime(2024, 3, 1): 1}
+    assert list_partitions('access_log') == [datetime(2024, 2, 1), datetime(2024, 3, 1)]
+    assert [row.access_datetime for row in AccessLog.query.order_by(AccessLog.access_datetime)] == times[3:]
+    assert roll('access_log', hot_months=2, now=NOW) == {} # Nothing left to move
+
+    everything = db.session.execute(select_range('access_log', datetime(2024, 1, 1), datetime(2024, 7, 1), hot_months=2)).all()
+    assert [row.access_datetime for row in everything] == times
+    assert len({row.id for row in everything}) == len(times)
+
+    february = db.session.execute(select_range('access_log', datetime(2024, 2, 15), datetime(2024, 3, 1), hot_months=2)).all()
+    assert [row.access_datetime for row in february] == [times[1]]
+
+    filtered = select_range('access_log', datetime(2024, 1, 1), datetime(2024, 7, 1), hot_months=2,
+                            where=lambda table: [table.c.access_granted.is_(False)])
+    assert db.session.execute(filtered).all() == []
+
+    # Open bounds reach every partition
+    assert [row.access_datetime for row in db.session.execute(select_range('access_log', end=datetime(2024, 3, 1), hot_months=2))] == times[:2]
+    assert [row.access_datetime for row in db.session.execute(select_range('access_log', hot_months=2))] == times
+
+    # A recent window only touches the hot table
+    recent = select_range('access_log', datetime(2024, 6, 1), datetime(2024, 7, 1), hot_months=2)
+    assert 'access_log_2024' not in str(recent)
+    assert [row.access_datetime for row in db.session.execute(recent)] == [NOW]
+
+
+def test_archive_and_retention(app, access_history, tmp_path, monkeypatch):
+    roll('access_log', hot_months=2, now=NOW)
+    path, rows = archive_partition('access_log', datetime(2024, 2, 1), str(tmp_path))
+    assert rows == 2
+    with gzip.open(path, 'rt', newline='') as f:
+        archived = list(csv.DictReader(f))
+    assert [row['access_datetime'] for row in archived] == ['2024-02-10T00:00:00', '2024-02-20T00:00:00']
+    with pytest.raises(ValueError):
+        archive_partition('access_log', datetime(2024, 2, 1), str(tmp_path), fmt='xml')
+
+    assert enforce_retention('access_log', retention_months=3, archive_dir=str(tmp_path / 'expired'), now=NOW) == [datetime(2024, 2, 1)]
+    assert list_partitions('access_log') == [datetime(2024, 3, 1)]
+    assert (tmp_path / 'expired' / 'access_log_2024_02.csv.gz').exists()
+
+    monkeypatch.setitem(app.config, 'LOG_RETENTION_MONTHS', 4)
+    report = maintain(now=NOW)
+    assert report['audit_log'] == {'moved': {datetime(2024, 1, 1): 1}, 'dropped': [datetime(2024, 1, 1)]}
+    assert report['access_log'] == {'moved': {}, 'dropped': []}
+    assert AuditLog.query.count() == 0
+
+
+def test_readers_include_archived_months(app, client, access_history):
+    times = access_history
+    admin = User(username='log_admin', email='log_admin@example.com', role=User.ROLE_ADMIN)
+    admin.set_password('password')
+    db.session.add(admin)
+    db.session.commit()
+    app.config['LOG_HOT_MONTHS'] = 2
+    roll('access_log', hot_months=2, now=NOW)
+    roll('audit_log', hot_months=2, now=NOW)
+    assert AccessLog.query.count() == 2 and AuditLog.query.count() == 0 # Only the hot window is left in place
+
+    rebuild_rollups(48, now=NOW)
+    hours = {row.bucket_start: row.count for row in SecurityRollup.query.filter_by(resolution='hour', metric='scan_granted')}
+    assert hours == {time: 1 for time in times}
+
+    client.post('/login', data={'email_or_username': 'log_admin', 'password': 'password'})
+    response = client.get('/export/access_log.csv?start_date=2024-02-15&end_date=2024-05-31')
+    assert response.status_code == 200
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0] == 'id,rfid_card_id,access_point_id,access_datetime,access_granted,denial_reason,timestamp'
+    # Spans the February and March partitions and the hot table; end_date is inclusive
+    assert [line.split(',')[3] for line in lines[1:]] == ['2024-02-20 00:00:00', '2024-03-05 00:00:00', '2024-05-31 23:00:00']
+
+    response = client.get('/export/audit_log.ndjson')
+    assert [row.split('"action_datetime": ')[1][:21] for row in response.get_data(as_text=True).splitlines()] == [
+        '"2024-01-03T00:00:00"']
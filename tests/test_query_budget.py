@@ -0,0 +1,159 @@
+import json
+import pytest
+from datetime import date
+from app import db
+from app.instrumentation import perf_registry
+from app.models import User, College, Course, CourseEnrollment, Post, Comment, Vote, Notification, AttendanceRecord
+from app.utils import get_post_list_stats
+
+
+@pytest.fixture
+def voter(app, init_database):
+    college = College(name='Budget College')
+    db.session.add(college)
+    db.session.commit()
+    user = User(username='voter', email='voter@example.com', college_id=college.id)
+    user.set_password('password')
+    other = User(username='other', email='other@example.com', college_id=college.id)
+    db.session.add_all([user, other])
+    db.session.commit()
+    posts = [Post(title=f'Post {i}', content='content', user_id=other.id, college_id=college.id) for i in range(3)]
+    db.session.add_all(posts)
+    db.session.commit()
+    return user, other, posts
+
+
+def _login(client, username):
+    response = client.post('/login', data={'email_or_username': username, 'password': 'password'})
+    assert response.status_code == 302
+
+
+def test_budgets_are_declared_on_the_routes(app):
+    assert app.view_functions['index'].query_budget == 7
+    assert app.view_functions['vote'].query_budget == 4
+    assert app.view_functions['list_notifications'].query_budget == 5
+    assert app.view_functions['take_attendance'].query_budget == 6
+    assert not hasattr(app.view_functions['logout'], 'query_budget')
+
+
+def test_post_list_stats(voter):
+    user, other, (first, second, third) = voter
+    db.session.add_all([Vote(user_id=user.id, post_id=first.id, vote_type=1),
+                        Vote(user_id=other.id, post_id=first.id, vote_type=1),
+                        Vote(user_id=other.id, post_id=second.id, vote_type=-1),
+                        Comment(content='a', user_id=other.id, post_id=first.id),
+                        Comment(content='b', user_id=user.id, post_id=first.id)])
+    db.session.commit()
+    stats = get_post_list_stats([first.id, second.id, third.id], user.id)
+    assert stats[first.id] == {'score': 2, 'comments': 2, 'user_vote': 1}
+    assert stats[second.id] == {'score': -1, 'comments': 0, 'user_vote': None}
+    assert stats[third.id] == {'score': 0, 'comments': 0, 'user_vote': None}
+    assert get_post_list_stats([], user.id) == {}
+
+
+def test_vote_within_budget(app, voter):
+    user, other, posts = voter
+    client = app.test_client()
+    _login(client, user.username)
+    for action in ('upvote', 'upvote', 'downvote'): # Add, remove, add again
+        response = client.post(f'/vote/post/{posts[0].id}/{action}')
+        assert response.status_code == 302
+    assert not perf_registry.budget_violations
+
+
+@pytest.mark.allow_query_budget_overrun
+def test_over_budget_request_is_recorded(app, voter, monkeypatch):
+    user, other, posts = voter
+    client = app.test_client()
+    _login(client, user.username)
+    monkeypatch.setattr(app.view_functions['vote'], 'query_budget', 1)
+    client.post(f'/vote/post/{posts[0].id}/upvote')
+    violation = perf_registry.budget_violations[0]
+    assert violation['endpoint'] == 'vote' and violation['budget'] == 1
+    assert violation['queries'] > 1 and violation['path'] == f'/vote/post/{posts[0].id}/upvote'
+
+
+def _queries(endpoint):
+    """Most queries one request to `endpoint` issued so far; the autouse guard fails the test if over budget."""
+    return next(row['max_queries'] for row in perf_registry.summary() if row['endpoint'] == endpoint)
+
+
+@pytest.fixture
+def campus(app, init_database):
+    perf_registry.reset()
+    colleges = [College(name=f'Campus {i}') for i in range(2)]
+    db.session.add_all(colleges)
+    db.session.commit()
+    faculty = User(username='campus_faculty', email='campus_faculty@example.com', role=User.ROLE_FACULTY,
+                   college_id=colleges[0].id)
+    faculty.set_password('password')
+    authors = [User(username=f'author{i}', email=f'author{i}@example.com', college_id=colleges[i % 2].id) for i in range(6)]
+    db.session.add_all([faculty] + authors)
+    db.session.commit()
+    yield faculty, authors, colleges
+    perf_registry.reset()
+
+
+def test_index_renders_a_full_page_within_budget(app, campus):
+    faculty, authors, colleges = campus
+    posts = [Post(title=f'Budget post {i}', content='x' * 250, user_id=authors[i % 6].id, college_id=colleges[0].id)
+             for i in range(12)] # More than a page, from several authors
+    db.session.add_all(posts)
+    db.session.commit()
+    db.session.add_all([Vote(user_id=faculty.id, post_id=post.id, vote_type=1) for post in posts[::2]] +
+                       [Comment(content='c', user_id=authors[0].id, post_id=post.id) for post in posts[::3]])
+    db.session.commit()
+    client = app.test_client()
+    _login(client, faculty.username)
+
+    response = client.get('/index')
+    assert response.status_code == 200
+    assert response.get_data(as_text=True).count('Budget post') == 10
+    assert _queries('index') <= 7
+    assert not perf_registry.budget_violations
+
+
+def test_notifications_render_within_budget(app, campus):
+    faculty, authors, _ = campus
+    db.session.add_all([Notification(user_id=faculty.id, name='new_comment_on_post', is_read=i % 2 == 0,
+                                     payload_json=json.dumps({'post_id': i, 'comment_id': i, 'post_title': f'Thread {i}',
+                                                              'commenter_username': authors[i % 6].username}))
+                        for i in range(8)] +
+                       [Notification(user_id=faculty.id, name='book_reservation_available', payload_json='{}')])
+    db.session.commit()
+    client = app.test_client()
+    _login(client, faculty.username)
+
+    response = client.get('/notifications')
+    assert response.status_code == 200
+    assert response.get_data(as_text=True).count('commented on your post') == 8
+    assert _queries('list_notifications') <= 5
+    assert not perf_registry.budget_violations
+
+
+def test_take_attendance_within_budget_for_a_roster(app, campus):
+    faculty, students, colleges = campus
+    course = Course(name='Budget Course', course_code='BUD1', college_id=colleges[0].id)
+    db.session.add(course)
+    db.session.commit()
+    db.session.add_all([CourseEnrollment(user_id=student.id, course_id=course.id) for student in students])
+    db.session.add(AttendanceRecord(user_id=students[0].id, course_id=course.id, date=date.today(), status='late'))
+    db.session.commit()
+    client = app.test_client()
+    _login(client, faculty.username)
+
+    response = client.get(f'/course/{course.id}/take_attendance')
+    assert response.status_code == 200
+    assert all(student.username in response.get_data(as_text=True) for student in students)
+
+    form = {'course_id': course.id, 'date': date.today().isoformat()}
+    for index, student in enumerate(students):
+        form[f'students-{index}-student_id'] = student.id
+        form[f'students-{index}-username'] = student.username
+        form[f'students-{index}-status'] = 'absent' if index % 2 else 'present'
+    response = client.post(f'/course/{course.id}/take_attendance', data=form, follow_redirects=True)
+    assert response.status_code == 200 # The redirect back renders the saved roster
+    assert AttendanceRecord.query.filter_by(course_id=course.id).count() == 6
+    assert AttendanceRecord.query.filter_by(course_id=course.id, status='absent').count() == 3
+    assert _queries('take_attendance') <= 6
+    assert not perf_registry.budget_violations
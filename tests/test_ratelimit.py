@@ -0,0 +1,62 @@
+import pytest
+from unittest.mock import patch
+from app.ratelimit import MemoryBackend, parse_limit
+
+
+def test_parse_limit():
+    assert parse_limit('10/minute') == (10 / 60, 10)
+    assert parse_limit('2/second') == (2, 2)
+    with pytest.raises(ValueError):
+        parse_limit('10/fortnight')
+
+
+def test_memory_backend_token_bucket():
+    backend = MemoryBackend()
+    with patch('app.ratelimit.time.monotonic', return_value=100.0):
+        assert backend.consume('k', rate=1, capacity=2) == (True, 0.0)
+        assert backend.consume('k', rate=1, capacity=2) == (True, 0.0)
+        allowed, retry_after = backend.consume('k', rate=1, capacity=2)
+        assert not allowed and retry_after == pytest.approx(1.0)
+        assert backend.consume('other', rate=1, capacity=2)[0] # Buckets are independent
+    with patch('app.ratelimit.time.monotonic', return_value=101.5):
+        assert backend.consume('k', rate=1, capacity=2)[0] # Refilled 1.5 tokens
+        assert not backend.consume('k', rate=1, capacity=2)[0]
+
+
+def test_memory_backend_bounds_key_count():
+    backend = MemoryBackend(max_keys=2)
+    for key in ('a', 'b', 'c'):
+        backend.consume(key, rate=1, capacity=1)
+    assert backend.consume('a', rate=1, capacity=1)[0] # 'a' was evicted, so it starts with a full bucket
+
+
+@pytest.fixture
+def limited_app(app):
+    original = {key: app.config.get(key) for key in ('RATELIMIT_ENABLED', 'RATELIMIT_LIMITS')}
+    app.config['RATELIMIT_ENABLED'] = True
+    app.config['RATELIMIT_LIMITS'] = {'chatbot': {'default': '2/minute', 'admin': None}}
+    app.extensions.pop('ratelimit', None)
+    yield app
+    app.config.update(original)
+    app.extensions.pop('ratelimit', None)
+
+
+@patch('app.chatbot.build_context_data', return_value=None)
+@patch('app.chatbot.get_gemini_response', return_value="Hi!")
+def test_chat_api_returns_429_with_retry_after(mock_get_gemini, mock_context, limited_app):
+    client = limited_app.test_client()
+    for message in ('one', 'two'):
+        assert client.post('/chatbot/chat', json={'message': message}).status_code == 200
+    response = client.post('/chatbot/chat', json={'message': 'three'})
+    assert response.status_code == 429
+    assert 1 <= int(response.headers['Retry-After']) <= 30
+    assert response.get_json()['retry_after'] == int(response.headers['Retry-After'])
+    assert mock_get_gemini.call_count == 2
+
+
+@patch('app.chatbot.build_context_data', return_value=None)
+@patch('app.chatbot.get_gemini_response', return_value="Hi!")
+def test_rate_limit_disabled_by_config(mock_get_gemini, mock_context, app):
+    client = app.test_client()
+    for message in ('one', 'two', 'three'):
+        assert client.post('/chatbot/chat', json={'message': message}).status_code == 200
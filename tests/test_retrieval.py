@@ -0,0 +1,159 @@
+from sqlalchemy import delete, insert, update
+from app import db
+from app.models import College, Course, Post, User
+from app.retrieval import INDEXED_MODELS, RetrievalIndex, retrieval_index, retrieve_context, tokenize
+
+
+def test_tokenize_drops_stopwords_and_plurals():
+    assert tokenize("What events are coming up in the Labs?") == ['event', 'coming', 'up', 'lab']
+    assert tokenize("class") == ['class']
+
+
+def test_search_ranks_by_relevance():
+    index = RetrievalIndex()
+    index.add(('course', 1), 'course CS101 Intro to Databases SQL', 'Course CS101')
+    index.add(('course', 2), 'course HI200 Medieval History', 'Course HI200')
+    index.add(('post', 1), 'post Where do I learn SQL? I want to learn databases', 'Post: SQL')
+    results = index.search('SQL databases', k=5)
+    assert {key for _score, key, _line in results} == {('course', 1), ('post', 1)}
+    assert index.search('databases course', k=1)[0][1] == ('course', 1)
+    assert index.search('astronomy', k=5) == []
+
+
+def test_add_replaces_and_remove_forgets():
+    index = RetrievalIndex()
+    index.add(('college', 1), 'college Old Name', 'College: Old Name')
+    index.add(('college', 1), 'college New Name', 'College: New Name')
+    assert len(index) == 1
+    assert index.search('old', k=5) == []
+    assert index.search('new', k=5)[0][2] == 'College: New Name'
+    index.remove(('college', 1))
+    assert len(index) == 0 and index.search('new', k=5) == []
+
+
+def test_retrieve_context_respects_token_budget(app, init_database):
+    with app.app_context():
+        college = College(name='Budget College', location='Here')
+        user = User(username='poster', email='poster@example.com')
+        user.set_password('password')
+        db.session.add_all([college, user])
+        db.session.flush()
+        db.session.add(Post(title='Budget tips', content='budget ' * 500, user_id=user.id, college_id=college.id))
+        db.session.commit()
+        retrieval_index.reset()
+        retrieval_index.rebuild()
+
+        lines = retrieve_context('budget', k=5, token_budget=20)
+        assert lines == ['College: Budget College (Here)'] # The post's line alone exceeds the budget
+        assert len(retrieve_context('budget', k=5, token_budget=500)) == 2
+
+
+def test_index_follows_commits_and_ignores_rollbacks(app, init_database):
+    with app.app_context():
+        retrieval_index.reset()
+        retrieval_index.rebuild() # The (empty) index
+        college = College(name='Incremental College', location='Nowhere')
+        db.session.add(college)
+        db.session.commit()
+        assert retrieve_context('incremental', k=5, token_budget=100) == ['College: Incremental College (Nowhere)']
+
+        college.name = 'Renamed College'
+        db.session.flush()
+        db.session.rollback()
+        assert retrieve_context('renamed', k=5, token_budget=100) == []
+
+        db.session.delete(db.session.get(College, college.id))
+        db.session.commit()
+        assert retrieve_context('incremental', k=5, token_budget=100) == []
+
+
+def test_rebuild_swaps_in_and_keeps_updates_made_meanwhile(app, init_database, monkeypatch):
+    index = RetrievalIndex()
+    index.add(('college', 99), 'college Stale', 'College: Stale')
+    _, columns, render = INDEXED_MODELS[College]
+    def render_while_committing(row):
+        # Another session commits while the rebuild is still reading rows
+        assert index.search('stale', k=5) != [] # Searches still see the old index
+        assert index.rebuild(blocking=False) is False # Only one rebuild at a time
+        index.add(('post', 7), 'post Late arrival', 'Post: Late arrival')
+        index.remove(('college', row.id))
+        return render(row)
+    with app.app_context():
+        db.session.add(College(name='Listed College'))
+        db.session.commit()
+        monkeypatch.setitem(INDEXED_MODELS, College, ('college', columns, render_while_committing))
+        assert index.rebuild() is True
+    assert index.search('stale', k=5) == [] # Gone from the database, so gone from the index
+    assert index.search('listed', k=5) == [] # Deleted while the rebuild ran
+    assert [line for _score, _key, line in index.search('late', k=5)] == ['Post: Late arrival']
+
+
+def test_index_keeps_the_newest_documents_per_type():
+    index = RetrievalIndex(max_per_type=2)
+    for post_id in (3, 1, 2):
+        index.add(('post', post_id), f'post shared {post_id}', f'Post {post_id}')
+    index.add(('post', 3), 'post shared edited', 'Post 3') # Replacing a document doesn't count twice
+    index.add(('college', 1), 'college shared', 'College 1')
+    assert sorted(key for _score, key, _line in index.search('shared', k=10)) == [('college', 1), ('post', 2), ('post', 3)]
+    index.remove(('post', 3))
+    index.add(('post', 4), 'post shared 4', 'Post 4')
+    index.add(('post', 5), 'post shared 5', 'Post 5')
+    assert sorted(key for _score, key, _line in index.search('shared', k=10)) == [('college', 1), ('post', 4), ('post', 5)]
+
+
+def test_first_build_runs_in_background_with_fallback_context(app, init_database):
+    with app.app_context():
+        db.session.add_all([College(name=f'Fallback College {n}') for n in range(4)])
+        db.session.flush()
+        db.session.add(Course(name='Fallback Seminar', course_code='FB1', college_id=1))
+        db.session.commit()
+        retrieval_index.reset()
+
+        with retrieval_index._rebuild_lock: # The build started by the first call can't finish yet
+            # Until the index is ready, the newest few rows of each record type the question names
+            assert retrieve_context('which colleges?', k=5, token_budget=100) == [
+                'College: Fallback College 3', 'College: Fallback College 2', 'College: Fallback College 1']
+            assert retrieve_context('fallback', k=5, token_budget=100) == [] # Names no record type
+            assert not retrieval_index.is_built
+        retrieval_index.refresh_in_background(app).join(5)
+        assert retrieval_index.is_built
+        assert retrieve_context('fallback seminar', k=5, token_budget=100)[0] == 'Course FB1: Fallback Seminar'
+
+
+def test_stale_index_refreshes_incrementally_then_rebuilds(app, init_database):
+    with app.app_context():
+        db.session.add(College(name='Existing College'))
+        db.session.commit()
+        retrieval_index.reset()
+        retrieval_index.rebuild()
+        # Like other workers' writes: no session events, so only a database read can pick them up
+        db.session.execute(insert(College).values(name='Background College'))
+        db.session.execute(update(College).where(College.name == 'Existing College').values(name='Edited College'))
+        db.session.commit()
+        retrieval_index.refreshed_at -= 60
+
+        with retrieval_index._rebuild_lock: # A refresh is running: requests don't wait for it or start another
+            assert retrieve_context('background', k=5, token_budget=100, max_age=30) == []
+            assert retrieval_index.refresh_in_background(app) is None
+        retrieval_index.refresh_in_background(app, full=False).join(5)
+        # Only ids above the last one loaded were read, so the edit waits for the full rebuild
+        assert retrieve_context('background', k=5, token_budget=100, max_age=30) == ['College: Background College']
+        assert retrieve_context('edited', k=5, token_budget=100, max_age=30) == []
+
+        db.session.execute(delete(College).where(College.name == 'Background College'))
+        db.session.commit()
+        retrieval_index.built_at -= 120
+        retrieve_context('anything', k=5, token_budget=100, max_age=30, rebuild_age=90)
+        with retrieval_index._rebuild_lock: # Wait for the rebuild that call started
+            assert retrieve_context('edited', k=5, token_budget=100) == ['College: Edited College']
+            assert retrieve_context('background', k=5, token_budget=100) == []
+
+
+def test_refresh_loads_only_the_newest_rows(app, init_database):
+    with app.app_context():
+        db.session.execute(insert(College), [{'name': f'Capped College {n}'} for n in range(5)])
+        db.session.commit()
+        index = RetrievalIndex(max_per_type=2)
+        index.rebuild()
+        assert sorted(line for _score, _key, line in index.search('capped', k=10)) == [
+            'College: Capped College 3', 'College: Capped College 4']
@@ -0,0 +1,125 @@
+import pytest
+from datetime import datetime, timedelta
+from app import db
+from app.models import User, AccessLog, AccessPoint, RFIDCard
+from app.rfid import (CardState, ReaderState, bump_directory_version, decide, directory, ingest_scans,
+                      read_directory_version)
+
+NOW = datetime(2024, 3, 4, 9, 0)
+TOKEN = {'Authorization': 'Bearer reader-secret'}
+
+
+def test_decide():
+    reader = ReaderState(1, True)
+    assert decide(CardState(1, 'active', None, 7), reader, NOW) == (True, None)
+    assert decide(CardState(1, 'active', None, 7), ReaderState(1, False), NOW) == (False, 'Access point inactive')
+    assert decide(CardState(1, 'lost', None, 7), reader, NOW) == (False, 'Card lost')
+    assert decide(CardState(1, 'active', NOW, 7), reader, NOW) == (False, 'Card expired')
+    assert decide(CardState(1, 'active', NOW + timedelta(days=1), None), reader, NOW) == (False, 'Card not assigned')
+
+
+@pytest.fixture
+def gates(app, init_database, monkeypatch):
+    monkeypatch.setitem(app.config, 'RFID_INGEST_TOKEN', 'reader-secret')
+    user = User(username='card_holder', email='card_holder@example.com')
+    db.session.add(user)
+    db.session.commit()
+    db.session.add_all([
+        AccessPoint(name='Main gate', reader_id='GATE-1'),
+        AccessPoint(name='Old gate', reader_id='GATE-2', is_active=False),
+        RFIDCard(card_uid='CARD-OK', user_id=user.id),
+        RFIDCard(card_uid='CARD-LOST', user_id=user.id, status='lost'),
+    ])
+    db.session.commit()
+    directory.clear()
+    yield user
+    directory.clear()
+
+
+def test_ingest_logs_batch_and_coalesces_last_used(gates):
+    result = ingest_scans([('GATE-1', 'CARD-OK', NOW), ('GATE-1', 'CARD-OK', NOW + timedelta(minutes=5)),
+                           ('GATE-1', 'CARD-OK', NOW + timedelta(minutes=2)), ('GATE-2', 'CARD-OK', NOW),
+                           ('GATE-1', 'CARD-LOST', NOW), ('GATE-9', 'CARD-OK', NOW), ('GATE-1', 'CARD-NEW', NOW)])
+    assert (result['logged'], result['granted'], result['denied']) == (5, 3, 4)
+    assert [d['reason'] for d in result['decisions']] == [None, None, None, 'Access point inactive', 'Card lost',
+                                                          'Unknown reader', 'Unknown card']
+    assert AccessLog.query.count() == 5
+    assert AccessLog.query.filter_by(access_granted=False).count() == 2
+    assert db.session.query(RFIDCard.last_used_datetime).filter_by(card_uid='CARD-OK').scalar() == NOW + timedelta(minutes=5)
+
+    # An older batch arriving late doesn't move last_used_datetime backwards
+    ingest_scans([('GATE-1', 'CARD-OK', NOW - timedelta(hours=1))])
+    assert db.session.query(RFIDCard.last_used_datetime).filter_by(card_uid='CARD-OK').scalar() == NOW + timedelta(minutes=5)
+
+
+def test_ingest_endpoint(client, gates):
+    scans = [{'reader_id': 'GATE-1', 'card_uid': 'CARD-OK', 'scanned_at': '2024-03-04T09:00:00+00:00'},
+             {'reader_id': 'GATE-1', 'card_uid': 'CARD-LOST'}]
+    assert client.post('/rfid/scans', json={'scans': scans}).status_code == 403
+
+    response = client.post('/rfid/scans', json={'scans': scans}, headers=TOKEN)
+    assert response.status_code == 200
+    assert response.get_json()['decisions'] == [{'card_uid': 'CARD-OK', 'granted': True, 'reason': None},
+                                                 {'card_uid': 'CARD-LOST', 'granted': False, 'reason': 'Card lost'}]
+    assert AccessLog.query.filter_by(access_datetime=NOW).count() == 1
+
+    # The Z suffix from the endpoint's documented example, and an offset, both land on naive UTC
+    scans = [{'reader_id': 'GATE-1', 'card_uid': 'CARD-OK', 'scanned_at': '2024-03-04T09:05:00Z'},
+             {'reader_id': 'GATE-1', 'card_uid': 'CARD-OK', 'scanned_at': '2024-03-04T14:40:00+05:30'}]
+    assert client.post('/rfid/scans', json={'scans': scans}, headers=TOKEN).status_code == 200
+    assert AccessLog.query.filter_by(access_datetime=NOW + timedelta(minutes=5)).count() == 1
+    assert AccessLog.query.filter_by(access_datetime=NOW + timedelta(minutes=10)).count() == 1
+
+    assert client.post('/rfid/scans', json={'scans': [{'reader_id': 'GATE-1', 'card_uid': 'CARD-OK', 'scanned_at': 'Z'}]},
+                       headers=TOKEN).status_code == 400
+    assert client.post('/rfid/scans', json={'scans': [{'reader_id': 'GATE-1'}]}, headers=TOKEN).status_code == 400
+    assert client.post('/rfid/scans', json={'scans': 'nope'}, headers=TOKEN).status_code == 400
+
+
+def test_directory_follows_card_changes(gates):
+    user = gates
+    directory.load()
+    version = directory.version
+    assert decide(directory.cards['CARD-OK'], directory.readers['GATE-1'], NOW) == (True, None)
+
+    card = RFIDCard.query.filter_by(card_uid='CARD-OK').one()
+    card.status = 'lost'
+    db.session.add(RFIDCard(card_uid='CARD-NEW', user_id=user.id))
+    db.session.commit()
+    assert directory.version == version + 1 == read_directory_version() # One bump per transaction, applied locally
+    assert directory.cards['CARD-OK'].status == 'lost'
+    assert 'CARD-NEW' in directory.cards
+
+    card.card_uid = 'CARD-RENAMED'
+    db.session.commit()
+    assert 'CARD-OK' not in directory.cards and directory.cards['CARD-RENAMED'].status == 'lost'
+
+    card.last_used_datetime = NOW # Not something decisions depend on
+    db.session.commit()
+    assert directory.version == version + 2
+
+    db.session.delete(card)
+    db.session.commit()
+    assert 'CARD-RENAMED' not in directory.cards
+
+
+def test_directory_reloads_when_another_worker_changed_it(app, gates):
+    directory.load()
+    with db.engine.begin() as connection: # A change this process didn't make, as from another worker
+        connection.execute(RFIDCard.__table__.update().where(RFIDCard.__table__.c.card_uid == 'CARD-LOST').values(status='active'))
+        bump_directory_version(connection)
+    directory.ensure_fresh(check_interval=60)
+    assert directory.cards['CARD-LOST'].status == 'lost' # Not checked again yet
+    directory.ensure_fresh(check_interval=0)
+    assert directory.cards['CARD-LOST'].status == 'active'
+
+    # Bulk updates skip the per-object events, so they make every worker reload
+    RFIDCard.query.filter_by(card_uid='CARD-OK').update({'status': 'expired'})
+    db.session.commit()
+    assert not directory.loaded
+    assert ingest_scans([('GATE-1', 'CARD-OK', NOW)])['decisions'][0]['reason'] == 'Card expired'
+
+    # Ingestion's own last_used_datetime updates don't invalidate anything
+    version = directory.version
+    ingest_scans([('GATE-1', 'CARD-LOST', NOW)])
+    assert directory.loaded and directory.version == version == read_directory_version()
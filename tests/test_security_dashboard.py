@@ -0,0 +1,115 @@
+import pytest
+from datetime import datetime, timedelta
+from app import db
+from app.models import User, AccessPoint, IncidentTally, RFIDCard, SecurityIncident, SecurityPatrolLog, SecurityRollup
+from app.rfid import directory, ingest_scans
+from app.security_dashboard import build_dashboard, prune_minute_rollups, rebuild_rollups
+
+NOW = datetime(2024, 3, 4, 12, 30)
+
+
+def rollups(resolution, metric):
+    return {(row.bucket_start, row.key): row.count for row in
+            SecurityRollup.query.filter_by(resolution=resolution, metric=metric)}
+
+
+@pytest.fixture
+def site(app, init_database, monkeypatch):
+    monkeypatch.setitem(app.config, 'SECURITY_PATROL_WINDOW_HOURS', 6)
+    monkeypatch.setitem(app.config, 'SECURITY_PATROL_GAP_HOURS', 2)
+    guard = User(username='guard', email='guard@example.com', role=User.ROLE_MANAGEMENT)
+    guard.set_password('password')
+    db.session.add(guard)
+    db.session.commit()
+    gates = [AccessPoint(name='North gate', reader_id='NORTH'), AccessPoint(name='South gate', reader_id='SOUTH')]
+    db.session.add_all(gates + [RFIDCard(card_uid='CARD-1', user_id=guard.id),
+                                RFIDCard(card_uid='CARD-2', user_id=guard.id, status='lost')])
+    db.session.commit()
+    directory.clear()
+    app.extensions.pop('anomaly_detector', None) # Its sliding windows would carry denials over from other tests
+    yield guard, gates
+    directory.clear()
+    app.extensions.pop('anomaly_detector', None)
+
+
+def test_ingest_updates_scan_rollups(site):
+    guard, (north, south) = site
+    ingest_scans([('NORTH', 'CARD-1', NOW), ('NORTH', 'CARD-2', NOW + timedelta(seconds=20)),
+                  ('NORTH', 'CARD-2', NOW + timedelta(minutes=1)), ('SOUTH', 'CARD-2', NOW)])
+    ingest_scans([('NORTH', 'CARD-2', NOW + timedelta(seconds=40))]) # Adds to the existing bucket
+    minute = NOW.replace(second=0)
+    assert rollups('minute', 'scan_denied') == {(minute, str(north.id)): 2, (minute + timedelta(minutes=1), str(north.id)): 1,
+                                                (minute, str(south.id)): 1}
+    assert rollups('hour', 'scan_denied') == {(NOW.replace(minute=0), str(north.id)): 3, (NOW.replace(minute=0), str(south.id)): 1}
+    assert rollups('hour', 'scan_granted') == {(NOW.replace(minute=0), str(north.id)): 1}
+
+
+def test_incident_tallies_follow_status_changes(site):
+    guard, _ = site
+    incident = SecurityIncident(incident_type='intrusion', description='Fence cut', location_description='North',
+                                severity='high', incident_datetime=NOW)
+    db.session.add_all([incident, SecurityIncident(incident_type='theft', description='Bike', location_description='South',
+                                                   incident_datetime=NOW)])
+    db.session.commit()
+    tallies = lambda: {(row.status, row.severity): row.count for row in IncidentTally.query if row.count}
+    assert tallies() == {('reported', 'high'): 1, ('reported', 'low'): 1}
+    assert rollups('hour', 'incident') == {(NOW.replace(minute=0), 'high'): 1, (NOW.replace(minute=0), 'low'): 1}
+
+    incident.status = 'resolved' # Expired after the commit; the old status is still known
+    db.session.commit()
+    assert tallies() == {('resolved', 'high'): 1, ('reported', 'low'): 1}
+
+    db.session.delete(incident)
+    db.session.commit()
+    assert tallies() == {('reported', 'low'): 1}
+
+    incident = SecurityIncident(incident_type='fire', description='Smoke', location_description='Lab', severity='high')
+    db.session.add(incident)
+    db.session.rollback()
+    assert tallies() == {('reported', 'low'): 1}
+
+
+def test_dashboard_reads_rollups(client, site):
+    guard, (north, south) = site
+    ingest_scans([('NORTH', 'CARD-2', NOW - timedelta(minutes=10)), ('SOUTH', 'CARD-1', NOW - timedelta(minutes=5)),
+                  ('SOUTH', 'CARD-2', NOW - timedelta(hours=2))])
+    db.session.add_all([
+        SecurityPatrolLog(guard_id=guard.id, log_datetime=NOW - timedelta(hours=1), entry_type='check', notes='ok', access_point_id=north.id),
+        SecurityPatrolLog(guard_id=guard.id, log_datetime=NOW - timedelta(hours=5), entry_type='check', notes='ok', access_point_id=south.id),
+        SecurityPatrolLog(guard_id=guard.id, log_datetime=NOW, entry_type='check', notes='ok', access_point_id=south.id),
+        SecurityIncident(incident_type='intrusion', description='x', location_description='North', severity='high', incident_datetime=NOW),
+    ])
+    db.session.commit()
+
+    report = build_dashboard(NOW)
+    assert report['scans_last_hour'] == [{'access_point_id': north.id, 'name': 'North gate', 'granted': 0, 'denied': 1},
+                                         {'access_point_id': south.id, 'name': 'South gate', 'granted': 1, 'denied': 0}]
+    assert [row['denied'] for row in report['scans_by_hour']] == [0, 0, 0, 1, 0, 1]
+    assert report['open_incidents'] == {'high': 1}
+    north_coverage, south_coverage = report['patrol_coverage']
+    assert north_coverage['last_patrol_hour'] == '2024-03-04T11:00:00'
+    assert north_coverage['gaps'] == [{'start': '2024-03-04T07:00:00', 'end': '2024-03-04T11:00:00'}] # The current hour alone is too short
+    assert south_coverage['gaps'] == [{'start': '2024-03-04T08:00:00', 'end': '2024-03-04T12:00:00'}]
+
+    assert client.get('/security/dashboard').status_code == 302 # Login required
+    client.post('/login', data={'email_or_username': 'guard', 'password': 'password'})
+    response = client.get('/security/dashboard')
+    assert response.status_code == 200
+    assert set(response.get_json()) == set(report)
+
+
+def test_rebuild_and_prune(site):
+    guard, (north, south) = site
+    ingest_scans([('NORTH', 'CARD-2', NOW), ('NORTH', 'CARD-2', NOW - timedelta(days=3))])
+    db.session.add(SecurityPatrolLog(guard_id=guard.id, log_datetime=NOW, entry_type='check', notes='ok', access_point_id=north.id))
+    db.session.commit()
+    before = {(row.resolution, row.bucket_start, row.metric, row.key): row.count for row in SecurityRollup.query}
+
+    assert prune_minute_rollups(48, now=NOW) == 1
+    assert rollups('minute', 'scan_denied') == {(NOW, str(north.id)): 1}
+
+    SecurityRollup.query.delete()
+    db.session.commit()
+    rebuild_rollups(48, now=NOW)
+    after = {(row.resolution, row.bucket_start, row.metric, row.key): row.count for row in SecurityRollup.query}
+    assert after == {key: count for key, count in before.items() if key[0] == 'hour' or key[1] >= NOW - timedelta(hours=48)}
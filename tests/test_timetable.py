@@ -0,0 +1,84 @@
+import pytest
+from datetime import time
+from app import db
+from app.models import User, College, Course, CourseEnrollment, TimeSlot
+from app.timetable import Clash, StudentClash, check_enrollment, normalize_day, scan_college, sweep
+
+
+def test_normalize_day():
+    assert normalize_day('Monday') == 'Monday'
+    assert normalize_day(' thu ') == 'Thursday'
+    assert normalize_day('someday') is None
+    assert normalize_day(None) is None
+
+
+def test_sweep_reports_each_overlapping_pair_once():
+    intervals = sorted([(time(9), time(10), 1), (time(9, 30), time(11), 2), (time(10), time(10, 30), 3),
+                        (time(11), time(12), 1), (time(11, 30), time(11, 45), 1)]) # Same-course overlaps don't count
+    assert list(sweep(intervals)) == [(1, 2, time(9, 30), time(10)), (2, 3, time(10), time(10, 30))]
+
+
+@pytest.fixture
+def timetable(app, init_database):
+    college = College(name='Timetable College')
+    db.session.add(college)
+    db.session.commit()
+    courses = {code: Course(name=code, course_code=code, college_id=college.id) for code in ('MATH1', 'PHYS1', 'CHEM1', 'ART1')}
+    students = [User(username=f'tt_student{i}', email=f'tt_student{i}@example.com', college_id=college.id) for i in range(3)]
+    for student in students:
+        student.set_password('password')
+    db.session.add_all(list(courses.values()) + students)
+    db.session.commit()
+    db.session.add_all([
+        TimeSlot(course_id=courses['MATH1'].id, day_of_week='Monday', start_time=time(9), end_time=time(10, 30)),
+        TimeSlot(course_id=courses['MATH1'].id, day_of_week='Wednesday', start_time=time(9), end_time=time(10)),
+        TimeSlot(course_id=courses['PHYS1'].id, day_of_week='monday', start_time=time(10), end_time=time(11)),
+        TimeSlot(course_id=courses['CHEM1'].id, day_of_week='Wednesday', start_time=time(10), end_time=time(11)),
+        TimeSlot(course_id=courses['ART1'].id, day_of_week='Tuesday', start_time=time(9), end_time=time(10)),
+    ])
+    db.session.commit()
+    return college, courses, students
+
+
+def test_check_enrollment(timetable):
+    college, courses, (student, _, _) = timetable
+    db.session.add_all([CourseEnrollment(user_id=student.id, course_id=courses['MATH1'].id),
+                        CourseEnrollment(user_id=student.id, course_id=courses['ART1'].id, status='dropped')])
+    db.session.commit()
+    assert check_enrollment(student.id, courses['PHYS1'].id) == [
+        Clash(courses['PHYS1'].id, courses['MATH1'].id, 'Monday', time(10), time(10, 30))]
+    assert check_enrollment(student.id, courses['CHEM1'].id) == [] # Back to back with MATH1 on Wednesday
+    assert check_enrollment(student.id, courses['MATH1'].id) == []
+
+
+def test_enroll_rejects_clashing_course(client, timetable):
+    college, courses, (student, _, _) = timetable
+    db.session.add(CourseEnrollment(user_id=student.id, course_id=courses['MATH1'].id))
+    db.session.commit()
+    client.post('/login', data={'email_or_username': student.username, 'password': 'password'})
+
+    client.post(f"/course/{courses['PHYS1'].id}/enroll")
+    with client.session_transaction() as session:
+        assert ('warning', 'The course clashes with MATH1 on Monday 10:00-10:30.') in session['_flashes']
+    assert CourseEnrollment.query.filter_by(user_id=student.id, course_id=courses['PHYS1'].id).count() == 0
+
+    client.post(f"/course/{courses['CHEM1'].id}/enroll")
+    assert CourseEnrollment.query.filter_by(user_id=student.id, course_id=courses['CHEM1'].id).count() == 1
+
+
+def test_scan_college(app, timetable):
+    college, courses, (first, second, third) = timetable
+    math, phys, chem, art = (courses[code].id for code in ('MATH1', 'PHYS1', 'CHEM1', 'ART1'))
+    db.session.add_all([CourseEnrollment(user_id=first.id, course_id=math), CourseEnrollment(user_id=first.id, course_id=phys),
+                        CourseEnrollment(user_id=second.id, course_id=math), CourseEnrollment(user_id=second.id, course_id=chem),
+                        CourseEnrollment(user_id=second.id, course_id=art),
+                        CourseEnrollment(user_id=third.id, course_id=math),
+                        CourseEnrollment(user_id=third.id, course_id=phys, status='dropped')])
+    db.session.commit()
+    assert list(scan_college(college.id)) == [StudentClash(first.id, math, phys, 'Monday', time(10), time(10, 30))]
+    assert list(scan_college(college.id + 1)) == []
+
+    result = app.test_cli_runner().invoke(args=['timetable-clashes', '--college-id', str(college.id)])
+    assert result.exit_code == 0
+    assert result.output.splitlines() == ['user_id,course_id,other_course_id,day,start,end',
+                                          f'{first.id},{math},{phys},Monday,10:00:00,10:30:00']